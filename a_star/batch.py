@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Batch route planning over a process pool
+
+Searches started from the central server's threads all share one interpreter, so the GIL
+serializes them no matter how many dumpsters overflow at the same time. BatchPlanner solves
+a list of (start, goal) pairs across worker processes instead. The grid is handed to each
+worker once, through the pool initializer, and only the pairs and the resulting routes
+travel per query. The pool is restarted when the grid's version changes, as the workers
+hold a copy of the grid that went stale.
+
+BatchQueue gathers the queries that threads submit one at a time while an earlier batch is being
+solved, e.g. the dispatches of one truck tick, so that they can be solved as a single batch. A
+query submitted while nothing else is pending is solved right away.
+"""
+
+import multiprocessing
+import threading
+import time
+
+import path_finder
+from engine import Buffered_A_Star_Search
+
+# Batches smaller than this are solved in the calling process, forking isn't worth it
+MIN_PARALLEL_BATCH = 8
+
+class Endpoint:
+  """ Bare route endpoint, the search engines only ask components for their location """
+  def __init__(self, location):
+    self.location = tuple(location)
+
+  def getLocation(self):
+    return self.location
+
+# Set in every worker process by the pool initializer
+_worker_graph = None
+_worker_engine = None
+
+def _initialize_worker(graph, engine):
+  global _worker_graph, _worker_engine
+  _worker_graph = graph
+  _worker_engine = engine
+  # Workers have no terminal to draw the grid on
+  path_finder.TEST_PROGRAM_ACTIVE = 0
+
+def solve_route(graph, engine, start, goal):
+  """
+  Runs a single search and returns its (path, cost), (None, None) if goal can't be reached
+  """
+  try:
+    search = engine(graph, Endpoint(start), Endpoint(goal))
+    path = search.get_a_star_path()
+    if not path:
+      return None, None
+    return path, search.get_cost_so_far(tuple(goal))
+  except (KeyError, ValueError):
+    # A * runs out of cells to reconstruct from, the other engines refuse out of bounds cells
+    return None, None
+
+def _solve_in_worker(pair):
+  (start, goal) = pair
+  return solve_route(_worker_graph, _worker_engine, start, goal)
+
+class BatchPlanner:
+  def __init__(self, graph, processes=None, engine=Buffered_A_Star_Search):
+    """
+    Create a batch planner for the given graph, the pool is only started by the first big batch
+
+    :param graph: (GridWithWeights) The graph the routes are computed on, read only for the planner
+    :param processes: (int) Number of worker processes, defaults to the number of cores
+    :param engine: Search class run by the workers, called as engine(graph, compA, compB)
+    """
+    self.graph = graph
+    self.processes = processes or multiprocessing.cpu_count()
+    self.engine = engine
+    self.batches = 0
+    self.routes = 0
+    self.pool_starts = 0
+    self.__pool = None
+    self.__version = None
+    self.__lock = threading.Lock()
+
+  def plan(self, pairs):
+    """
+    Solves every (start, goal) pair
+
+    :param pairs: Iterable of ((x, y), (x, y)) location pairs
+    :return: (list) One (path, cost) tuple per pair in the same order, (None, None) for unreachable goals
+    """
+    pairs = [(tuple(start), tuple(goal)) for (start, goal) in pairs]
+    with self.__lock:
+      self.batches += 1
+      self.routes += len(pairs)
+      if self.processes < 2 or len(pairs) < MIN_PARALLEL_BATCH:
+        return [solve_route(self.graph, self.engine, start, goal) for (start, goal) in pairs]
+      pool = self.__get_pool()
+      # A few chunks per worker keeps them busy when some routes are much longer than others
+      chunksize = max(1, len(pairs) // (self.processes * 4))
+      return pool.map(_solve_in_worker, pairs, chunksize)
+
+  def close(self):
+    """ Stops the worker processes, a later batch starts a new pool """
+    with self.__lock:
+      self.__stop_pool()
+
+  def stats(self):
+    """ Returns the planner counters as a dict, meant for logging """
+    return {"batches": self.batches, "routes": self.routes, "pool_starts": self.pool_starts,
+            "processes": self.processes}
+
+  def __get_pool(self):
+    if self.__pool is None or self.__version != self.graph.version:
+      self.__stop_pool()
+      self.__version = self.graph.version
+      self.__pool = multiprocessing.Pool(self.processes, _initialize_worker, (self.graph, self.engine))
+      self.pool_starts += 1
+    return self.__pool
+
+  def __stop_pool(self):
+    if self.__pool is not None:
+      self.__pool.terminate()
+      self.__pool.join()
+      self.__pool = None
+
+class _Batch:
+  def __init__(self):
+    self.requests = []
+    self.submitted = []
+    self.results = None
+    self.error = None
+    self.done = threading.Event()
+
+class BatchQueue:
+  def __init__(self, solve, max_wait, max_size=None):
+    """
+    Create a queue that solves the requests submitted while another batch is being solved together
+
+    :param solve: Function solve(requests) -> list of one result per request, in the same order
+    :param max_wait: (float) Longest a batch waits for the batch being solved, in seconds, e.g. the truck tick
+    :param max_size: (int) Requests that make a batch start right away, unbounded by default
+    """
+    self.solve = solve
+    self.max_wait = max_wait
+    self.max_size = max_size
+    self.batches = 0
+    self.requests = 0
+    self.queued_seconds = 0.0
+    self.longest_queued = 0.0
+    self.__open = None
+    self.__solving = 0
+    self.__changed = threading.Condition(threading.Lock())
+
+  def submit(self, request):
+    """
+    Adds request to the open batch and blocks until that batch is solved
+
+    A request that finds no batch being solved is solved right away. Otherwise the first request
+    of the open batch waits for the solving one to finish, for max_wait seconds or until max_size
+    requests joined, whichever comes first, then solves every request of its batch in the calling
+    thread.
+
+    :return: The result solve gave for request
+    :raises: Whatever solve raised, in every thread of the batch
+    """
+    with self.__changed:
+      batch = self.__open
+      first = batch is None
+      if first:
+        batch = self.__open = _Batch()
+      index = len(batch.requests)
+      batch.requests.append(request)
+      batch.submitted.append(time.time())
+      if first:
+        deadline = batch.submitted[0] + self.max_wait
+        while self.__solving and not self.__full(batch) and time.time() < deadline:
+          self.__changed.wait(deadline - time.time())
+        self.__open = None
+        self.__solving += 1
+        started = time.time()
+        self.batches += 1
+        self.requests += len(batch.requests)
+        for submitted in batch.submitted:
+          self.queued_seconds += started - submitted
+          self.longest_queued = max(self.longest_queued, started - submitted)
+      elif self.__full(batch):
+        self.__changed.notify_all()
+    if first:
+      try:
+        batch.results = self.solve(batch.requests)
+      except Exception, e:
+        batch.error = e
+      with self.__changed:
+        self.__solving -= 1
+        self.__changed.notify_all()
+      batch.done.set()
+    else:
+      batch.done.wait()
+    if batch.error is not None:
+      raise batch.error
+    return batch.results[index]
+
+  def __full(self, batch):
+    return self.max_size is not None and len(batch.requests) >= self.max_size
+
+  def stats(self):
+    """ Returns the queue counters as a dict, meant for logging """
+    return {"batches": self.batches, "requests": self.requests,
+            "queued_seconds": round(self.queued_seconds, 3), "longest_queued": round(self.longest_queued, 3)}
+
+def plan_routes(graph, pairs, processes=None, engine=Buffered_A_Star_Search):
+  """
+  Solves a single batch of (start, goal) pairs with a throw-away pool, see BatchPlanner.plan
+  """
+  planner = BatchPlanner(graph, processes=processes, engine=engine)
+  try:
+    return planner.plan(pairs)
+  finally:
+    planner.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Bidirectional A * search for long truck -> dumpster legs
+
+A unidirectional search from the truck grows a wide frontier on long cross town routes.
+This search runs one A * forward from the truck and one backward from the goal and stops
+once the best route through a meeting cell can't be beaten by either frontier anymore.
+
+Both directions use the graph's heuristic, the octile lower bound unless landmarks were
+registered. Either is consistent, so the returned route is the cheapest one.
+"""
+
+from structs import PriorityQueue
+from heuristics import heuristic_for
+# lower_bound_step_costs moved to heuristics, still importable from here
+from heuristics import lower_bound_step_costs
+
+INFINITY = float("inf")
+
+class Bidirectional_A_Star_Search:
+  def __init__(self, graph, compA, compB, heuristic=None):
+    self.__heuristic = heuristic or heuristic_for(graph)
+    self.__came_from = {}
+    self.__cost_so_far = {}
+    self.__next_step = {}
+    self.__cost_to_goal = {}
+    self.__a_star_path = []
+    self.__nodes_expanded = 0
+    self.__cost = INFINITY
+    start = compA.getLocation()
+    goal = compB.getLocation()
+    if not (graph.in_bounds(start) and graph.in_bounds(goal)):
+      raise ValueError("Either of the component is out of bounds")
+    self.__heuristic.refresh()
+    meeting_point = self.bidirectional_search(graph, start, goal)
+    if meeting_point is not None:
+      self.__a_star_path = self.reconstruct_path(meeting_point)
+
+  def heuristic(self, a, b):
+    return self.__heuristic(a, b)
+
+  def predecessors(self, graph, current):
+    # Every in-bound cell around a passable cell can step into it
+    (x, y) = current
+    for previous in [(x + 1, y), (x + 1, y + 1), (x, y - 1), (x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y - 1)]:
+      if graph.in_bounds(previous):
+        yield previous
+
+  def bidirectional_search(self, graph, start, goal):
+    forward = PriorityQueue()
+    backward = PriorityQueue()
+    forward.put(start, self.heuristic(start, goal))
+    backward.put(goal, self.heuristic(goal, start))
+    came_from = self.__came_from
+    cost_so_far = self.__cost_so_far
+    next_step = self.__next_step
+    cost_to_goal = self.__cost_to_goal
+    came_from[start] = None
+    cost_so_far[start] = 0
+    next_step[goal] = None
+    cost_to_goal[goal] = 0
+    forward_closed = set()
+    backward_closed = set()
+    best_cost = INFINITY
+    meeting_point = None
+    if start == goal:
+      best_cost = 0
+      meeting_point = start
+
+    while True:
+      while not forward.empty() and forward.peek() in forward_closed:
+        forward.get()
+      while not backward.empty() and backward.peek() in backward_closed:
+        backward.get()
+      if forward.empty() or backward.empty():
+        break
+      # No route through an unexpanded cell of either side can beat the best one found
+      if forward.min_priority() >= best_cost or backward.min_priority() >= best_cost:
+        break
+
+      if len(forward.elements) <= len(backward.elements):
+        current = forward.get()
+        forward_closed.add(current)
+        self.__nodes_expanded += 1
+        for next in graph.neighbors(current):
+          new_cost = cost_so_far[current] + graph.cost(current, next)
+          if next not in cost_so_far or new_cost < cost_so_far[next]:
+            cost_so_far[next] = new_cost
+            came_from[next] = current
+            forward.put(next, new_cost + self.heuristic(next, goal))
+            if next in cost_to_goal and new_cost + cost_to_goal[next] < best_cost:
+              best_cost = new_cost + cost_to_goal[next]
+              meeting_point = next
+      else:
+        current = backward.get()
+        backward_closed.add(current)
+        self.__nodes_expanded += 1
+        # Nothing steps into a wall, so a wall is only a dead end the truck may be standing on, or a
+        # walled goal that only a truck already on it reaches
+        if not graph.passable(current):
+          continue
+        for previous in self.predecessors(graph, current):
+          new_cost = cost_to_goal[current] + graph.cost(previous, current)
+          if previous not in cost_to_goal or new_cost < cost_to_goal[previous]:
+            cost_to_goal[previous] = new_cost
+            next_step[previous] = current
+            backward.put(previous, new_cost + self.heuristic(start, previous))
+            if previous in cost_so_far and new_cost + cost_so_far[previous] < best_cost:
+              best_cost = new_cost + cost_so_far[previous]
+              meeting_point = previous
+
+    self.__cost = best_cost
+    return meeting_point
+
+  def reconstruct_path(self, meeting_point):
+    path = [meeting_point]
+    while self.__came_from[path[-1]] is not None:
+      path.append(self.__came_from[path[-1]])
+    path.reverse()
+    while self.__next_step[path[-1]] is not None:
+      path.append(self.__next_step[path[-1]])
+    return path
+
+  def get_cost_so_far(self, id):
+    """ Cost of the route to id, the goal's cost is the one of the complete route """
+    if self.__a_star_path and id == self.__a_star_path[-1]:
+      return self.__cost
+    return self.__cost_so_far[id]
+
+  def get_a_star_path(self):
+    return list(self.__a_star_path)
+
+  def get_came_from(self):
+    return self.__came_from
+
+  def get_nodes_expanded(self):
+    return self.__nodes_expanded
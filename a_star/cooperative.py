@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""
+Cooperative route planning for trucks dispatched at the same time (Cooperative A *, Silver 2005)
+
+Every other engine plans a truck as if it were alone on the map, so two trucks dispatched together
+can be sent down the same narrow corridor at the same moment. Cooperative_Planner plans in space
+and time instead. Time is counted in ticks, one cell driven per tick, and the Reservation_Table
+remembers which truck occupies which cell at which tick. A truck's route is a space-time A * search
+that may wait in place and only steps into cells free at the tick it gets there. It can't swap
+cells with a truck coming the other way either. Its route is then reserved, so the next truck
+plans around it.
+
+A batch is planned in priority order. When a truck finds no route within the search limits, the
+batch is planned again with that truck first, a replan, until every truck has a route or the
+replan budget runs out. Trucks left without a route get None and fall back to a plain search.
+
+Routes are lists of one cell per tick starting at the start tick, so a wait shows up as the same
+cell twice in a row.
+"""
+
+import heapq
+import threading
+
+from heuristics import heuristic_for
+from heuristics import lower_bound_step_costs
+
+# Ticks a truck keeps its goal cell after arriving, to empty the dumpster or unload at the landfill
+DEFAULT_DWELL = 2
+
+# Without a horizon, a truck's search looks HORIZON_FACTOR times as many ticks ahead as the fewest
+# steps from its start to its goal, plus HORIZON_SLACK ticks of waits and detours
+HORIZON_FACTOR = 3
+HORIZON_SLACK = 16
+
+# The search of a single truck gives up after expanding this many space-time states per tick of its
+# horizon, or per grid cell if that's fewer, so the table lock is never held for long
+EXPANSIONS_PER_TICK = 64
+EXPANSIONS_PER_CELL = 4
+
+class Reservation_Table:
+  def __init__(self):
+    # (cell, tick) -> truck in that cell at that tick
+    self.cells = {}
+    # (from cell, to cell, tick) -> truck leaving from cell at tick
+    self.moves = {}
+    # truck -> (start tick, route, dwell)
+    self.routes = {}
+    self.__lock = threading.RLock()
+
+  def lock(self):
+    """ Lock to hold while planning against the table and reserving the result """
+    return self.__lock
+
+  def reserve(self, name, path, start_tick, dwell=DEFAULT_DWELL):
+    """
+    Reserves a route for a truck, replacing the route it had
+
+    :param name: (str) Truck the route belongs to
+    :param path: (list) One (x, y) cell per tick
+    :param start_tick: (int) Tick at which the truck is in path[0]
+    :param dwell: (int) Ticks the truck stays in the last cell after arriving
+    """
+    with self.__lock:
+      self.release(name)
+      for (step, cell) in enumerate(path):
+        self.cells[(cell, start_tick + step)] = name
+        if step + 1 < len(path):
+          self.moves[(cell, path[step + 1], start_tick + step)] = name
+      end = start_tick + len(path) - 1
+      for tick in range(end + 1, end + 1 + dwell):
+        self.cells[(path[-1], tick)] = name
+      self.routes[name] = (start_tick, list(path), dwell)
+
+  def release(self, name):
+    """ Drops the route of a truck, e.g. once it arrived or got another assignment """
+    with self.__lock:
+      if name not in self.routes:
+        return
+      (start_tick, path, dwell) = self.routes.pop(name)
+      for (step, cell) in enumerate(path + [path[-1]] * dwell):
+        if self.cells.get((cell, start_tick + step)) == name:
+          del self.cells[(cell, start_tick + step)]
+        if step + 1 < len(path) and self.moves.get((cell, path[step + 1], start_tick + step)) == name:
+          del self.moves[(cell, path[step + 1], start_tick + step)]
+
+  def prune(self, tick):
+    """ Drops the routes that were over before tick """
+    with self.__lock:
+      for (name, (start_tick, path, dwell)) in self.routes.items():
+        if start_tick + len(path) + dwell <= tick:
+          self.release(name)
+
+  def owner(self, cell, tick):
+    """ Truck in cell at tick, None if it's free """
+    return self.cells.get((cell, tick))
+
+  def is_free(self, cell, tick, name=None):
+    owner = self.cells.get((cell, tick))
+    return owner is None or owner == name
+
+  def crosses(self, a, b, tick, name=None):
+    """ True if another truck drives from b to a while name drives from a to b at tick """
+    owner = self.moves.get((b, a, tick))
+    return owner is not None and owner != name
+
+  def __len__(self):
+    return len(self.routes)
+
+class Cooperative_Planner:
+  def __init__(self, graph, table=None, dwell=DEFAULT_DWELL, horizon=None, max_expansions=None, heuristic=None):
+    """
+    Create a planner of conflict free routes on the given graph
+
+    :param graph: (GridWithWeights) Graph the trucks are moving on
+    :param table: (Reservation_Table) Reservations to plan around, a new empty table by default
+    :param dwell: (int) Ticks a truck keeps its goal cell after arriving
+    :param horizon: (int) Longest route in ticks a search looks for, waits included, by default
+                    HORIZON_FACTOR times the fewest steps between start and goal plus HORIZON_SLACK
+    :param max_expansions: (int) Space-time states a search may expand before giving up, by default
+                           EXPANSIONS_PER_TICK per tick of the horizon, at most EXPANSIONS_PER_CELL per cell
+    :param heuristic: Heuristic guiding the searches, defaults to heuristic_for(graph)
+    """
+    self.graph = graph
+    self.table = table if table is not None else Reservation_Table()
+    self.dwell = dwell
+    self.horizon = horizon
+    self.max_expansions = max_expansions
+    self.heuristic = heuristic
+    self.batches = 0
+    self.searches = 0
+    self.replans = 0
+    self.failures = 0
+    self.nodes_expanded = 0
+    self.waits = 0
+
+  def plan(self, requests, start_tick=0, max_replans=None):
+    """
+    Plans conflict free routes for a batch of trucks
+
+    :param requests: List of (name, start, goal), in priority order
+    :param start_tick: (int) Tick at which every truck of the batch is in its start cell
+    :param max_replans: (int) Times the batch may be planned again in another order, the number of trucks by default
+    :return: (dict) Route of every truck, None for the trucks that couldn't be planned
+    """
+    order = list(requests)
+    replans_left = len(order) if max_replans is None else max_replans
+    with self.table.lock():
+      self.batches += 1
+      while True:
+        routes = {}
+        failed = None
+        for (name, start, goal) in order:
+          routes[name] = self.plan_route(name, start, goal, start_tick)
+          if routes[name] is None and failed is None:
+            failed = (name, start, goal)
+        if failed is None or failed == order[0] or replans_left <= 0:
+          return routes
+        # Give the truck that got stuck the first pick of the corridors and plan the batch again
+        for name in routes:
+          self.table.release(name)
+        order.remove(failed)
+        order.insert(0, failed)
+        replans_left -= 1
+        self.replans += 1
+
+  def plan_route(self, name, start, goal, start_tick=0):
+    """
+    Plans and reserves the route of a single truck around the routes reserved so far
+
+    :return: (list) One (x, y) cell per tick from start_tick, None if no route was found
+    """
+    graph = self.graph
+    if not (graph.in_bounds(start) and graph.in_bounds(goal)):
+      raise ValueError("Either of the component is out of bounds")
+    with self.table.lock():
+      self.table.release(name)
+      path = self.__search(name, tuple(start), tuple(goal), start_tick)
+      if path is None:
+        self.failures += 1
+        return None
+      self.table.reserve(name, path, start_tick, self.dwell)
+      self.waits += sum(1 for (a, b) in zip(path, path[1:]) if a == b)
+      return path
+
+  def __search(self, name, start, goal, start_tick):
+    graph = self.graph
+    table = self.table
+    heuristic = self.heuristic or heuristic_for(graph)
+    heuristic.refresh()
+    estimate = heuristic.estimate_to(goal)
+    # Waiting costs as much as the cheapest step, it delays the truck as much
+    wait_cost = min(lower_bound_step_costs(graph))
+    # Trucks drive one cell per tick in any of the 8 directions, no route takes fewer ticks than this
+    steps = max(abs(start[0] - goal[0]), abs(start[1] - goal[1]))
+    horizon = self.horizon or HORIZON_FACTOR * steps + HORIZON_SLACK
+    max_expansions = self.max_expansions or min(EXPANSIONS_PER_TICK * horizon, EXPANSIONS_PER_CELL * len(graph.cells))
+    self.searches += 1
+
+    def h(cell):
+      return estimate(cell[0], cell[1], graph.index(cell))
+
+    came_from = {(start, 0): None}
+    cost_so_far = {(start, 0): 0}
+    closed = set()
+    # Ties go to the state further in time, it's closer to the goal
+    frontier = [(h(start), 0, start)]
+    expanded = 0
+    try:
+      while frontier:
+        (priority, step, current) = heapq.heappop(frontier)
+        step = -step
+        state = (current, step)
+        if state in closed:
+          continue
+        closed.add(state)
+        if current == goal and self.__can_stay(name, goal, start_tick + step):
+          path = []
+          while state is not None:
+            path.append(state[0])
+            state = came_from[state]
+          path.reverse()
+          return path
+        expanded += 1
+        if expanded > max_expansions or step >= horizon:
+          if expanded > max_expansions:
+            return None
+          continue
+        tick = start_tick + step
+        for next in graph.neighbors(current) + [current]:
+          if not table.is_free(next, tick + 1, name) or table.crosses(current, next, tick, name):
+            continue
+          next_state = (next, step + 1)
+          new_cost = cost_so_far[state] + (wait_cost if next == current else graph.cost(current, next))
+          if next_state not in cost_so_far or new_cost < cost_so_far[next_state]:
+            cost_so_far[next_state] = new_cost
+            came_from[next_state] = state
+            heapq.heappush(frontier, (new_cost + h(next), -(step + 1), next))
+      return None
+    finally:
+      self.nodes_expanded += expanded
+
+  def __can_stay(self, name, goal, tick):
+    for dwell_tick in range(tick + 1, tick + 1 + self.dwell):
+      if not self.table.is_free(goal, dwell_tick, name):
+        return False
+    return True
+
+  def stats(self):
+    """ Returns the planner counters as a dict, meant for logging """
+    return {"batches": self.batches, "searches": self.searches, "replans": self.replans,
+            "failures": self.failures, "nodes_expanded": self.nodes_expanded, "waits": self.waits,
+            "reserved_routes": len(self.table)}
+
+def find_conflicts(routes, start_tick=0):
+  """
+  Lists the conflicts between routes that start at the same tick, meant for checking plans
+
+  :param routes: (dict) Route of every truck, one cell per tick
+  :return: (list) (tick, truck, truck) of every two trucks in the same cell or swapping cells
+  """
+  conflicts = []
+  occupied = {}
+  moves = {}
+  for (name, path) in sorted(routes.items()):
+    if not path:
+      continue
+    for (step, cell) in enumerate(path):
+      tick = start_tick + step
+      other = occupied.get((cell, tick))
+      if other is not None and step > 0:
+        conflicts.append((tick, other, name))
+      occupied[(cell, tick)] = name
+      if step + 1 < len(path):
+        other = moves.get((path[step + 1], cell, tick))
+        if other is not None and cell != path[step + 1]:
+          conflicts.append((tick, other, name))
+        moves[(cell, path[step + 1], tick)] = name
+  return conflicts
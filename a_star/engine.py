@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Reusable A * search engine of a single map
+
+A_Star_Search allocates fresh came_from/cost_so_far dicts and (x, y) tuples for every query.
+Search_Engine is created once per map instead. Cells are packed into their row major index
+(y * width + x) and the cost, parent and closed state of every cell live in arrays that are
+allocated once and reused by every query. A cell's entries only count when its stamp matches
+the generation of the running query, so starting a new query never clears the arrays.
+Tuples are only built for the returned path, and the grid is only drawn through render().
+
+Buffered_A_Star_Search wraps the engine of a map behind the usual engine(graph, compA, compB)
+interface, so it can be plugged in wherever A_Star_Search is.
+"""
+
+from array import array
+import heapq
+import threading
+import weakref
+
+from structs import draw_grid
+from path_finder import FUEL_COST_PER_BLOCK
+from heuristics import heuristic_for
+
+INFINITY = float("inf")
+
+# (dx, dy) of the 8 neighbors, in the order of SquareGrid.neighbors
+NEIGHBOR_OFFSETS = [(1, 0), (1, 1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, -1)]
+
+# Engines created by engine_for, dropped with their graph
+_engines = weakref.WeakKeyDictionary()
+
+def engine_for(graph):
+  """ Returns the shared Search_Engine of graph, creating it on first use """
+  engine = _engines.get(graph)
+  if engine is None:
+    engine = _engines.setdefault(graph, Search_Engine(graph))
+  return engine
+
+class Search_Engine:
+  def __init__(self, graph):
+    """
+    Create the engine of a map, its buffers are sized to the graph right away
+
+    :param graph: (GridWithWeights) Graph every query of this engine runs on
+    """
+    self.graph = graph
+    self.queries = 0
+    self.nodes_expanded = 0
+    self.__generation = 0
+    self.__heap = []
+    self.__last = (None, None, None, None)
+    self.__lock = threading.Lock()
+    self.__allocate()
+
+  def __allocate(self):
+    size = len(self.graph.cells)
+    self.__cost = array('d', [INFINITY]) * size
+    self.__parent = array('l', [-1]) * size
+    self.__stamp = array('l', [0]) * size
+    self.__closed = array('l', [0]) * size
+    self.__generation = 0
+
+  def search(self, start, goal, heuristic=None):
+    """
+    Searches the route from start to goal
+
+    :param start: (tuple) (x, y) location the route starts from
+    :param goal: (tuple) (x, y) location the route ends at
+    :param heuristic: Heuristic guiding the search, defaults to heuristic_for(graph)
+    :return: (list, float) Path from start to goal, both included, and its cost, (None, None) if unreachable
+    """
+    (path, cost, expanded) = self.search_with_stats(start, goal, heuristic)
+    return path, cost
+
+  def search_with_stats(self, start, goal, heuristic=None):
+    """ Same as search, also returns the number of nodes the query expanded """
+    graph = self.graph
+    if not (graph.in_bounds(start) and graph.in_bounds(goal)):
+      raise ValueError("Either of the component is out of bounds")
+    heuristic = heuristic or heuristic_for(graph)
+    heuristic.refresh()
+    estimate = heuristic.estimate_to(goal)
+    with self.__lock:
+      if len(self.__cost) != len(graph.cells):
+        # The grid was resized since the buffers were allocated
+        self.__allocate()
+      self.__generation += 1
+      (path, cost, expanded) = self.__search(graph.index(start), graph.index(goal), estimate)
+      self.queries += 1
+      self.nodes_expanded += expanded
+      self.__last = (start, goal, path, cost)
+      return path, cost, expanded
+
+  def __search(self, start, goal, estimate):
+    graph = self.graph
+    width = graph.width
+    height = graph.height
+    cells = graph.cells
+    weights = graph.cell_weights
+    generation = self.__generation
+    cost = self.__cost
+    parent = self.__parent
+    stamp = self.__stamp
+    closed = self.__closed
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    step_costs = {}
+    for distance in (1, 2):
+      step_costs[distance] = graph.dist_weights.get(distance, 1) + graph.fuel_weights.get(distance * FUEL_COST_PER_BLOCK, 1)
+    offsets = [(dx, dy, dy * width + dx, step_costs[abs(dx) + abs(dy)]) for (dx, dy) in NEIGHBOR_OFFSETS]
+
+    heap = self.__heap
+    del heap[:]
+    cost[start] = 0
+    parent[start] = -1
+    stamp[start] = generation
+    heap.append((0, start))
+    expanded = 0
+
+    while heap:
+      current = heappop(heap)[1]
+      if current == goal:
+        break
+      if closed[current] == generation:
+        continue
+      closed[current] = generation
+      expanded += 1
+      (y, x) = divmod(current, width)
+      current_cost = cost[current]
+      for (dx, dy, delta, step_cost) in offsets:
+        nx = x + dx
+        ny = y + dy
+        if 0 <= nx < width and 0 <= ny < height:
+          next = current + delta
+          if cells[next]:
+            continue
+          new_cost = current_cost + weights[next] + step_cost
+          if stamp[next] != generation or new_cost < cost[next]:
+            stamp[next] = generation
+            cost[next] = new_cost
+            parent[next] = current
+            # Inconsistent estimates can reach a closed cell for less, it's expanded again then
+            closed[next] = 0
+            heappush(heap, (new_cost + estimate(nx, ny, next), next))
+
+    if stamp[goal] != generation:
+      return None, None, expanded
+    path = []
+    current = goal
+    while current != -1:
+      path.append((current % width, current // width))
+      current = parent[current]
+    path.reverse()
+    return path, cost[goal], expanded
+
+  def render(self, path=None, start=None, goal=None):
+    """ Draws the grid with the given route, or the one of the last query, on stdout """
+    with self.__lock:
+      (last_start, last_goal, last_path, last_cost) = self.__last
+    if path is None:
+      (path, start, goal) = (last_path or [], last_start, last_goal)
+    print "Map grid with the path traced from Truck (T) to Dumpster (D) is shown as '@'"
+    draw_grid(self.graph, width=1, path=path, start=start, goal=goal)
+
+  def stats(self):
+    """ Returns the engine counters as a dict, meant for logging """
+    return {"queries": self.queries, "nodes_expanded": self.nodes_expanded, "cells": len(self.__cost)}
+
+class Buffered_A_Star_Search:
+  """
+  Runs a query on the shared Search_Engine of the graph, with the interface of A_Star_Search
+  """
+  def __init__(self, graph, compA, compB, engine=None, heuristic=None):
+    self.__engine = engine or engine_for(graph)
+    self.__goal = compB.getLocation()
+    (self.__path, self.__cost, self.__nodes_expanded) = self.__engine.search_with_stats(compA.getLocation(), self.__goal, heuristic)
+
+  def get_cost_so_far(self, id):
+    """ Cost of the route, only known for the goal """
+    if id != self.__goal or self.__cost is None:
+      raise KeyError(id)
+    return self.__cost
+
+  def get_a_star_path(self):
+    return list(self.__path or [])
+
+  def get_nodes_expanded(self):
+    return self.__nodes_expanded
+
+  def render(self):
+    path = self.__path or []
+    self.__engine.render(path, path[0] if path else None, self.__goal)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Distance field (flow field) towards a fixed target such as the landfill
+
+Every return trip in the system ends at the same landfill, so instead of running a full
+A * search per truck we run one reverse Dijkstra from the landfill over the whole grid.
+Each cell then knows its cost to the landfill and the next cell to move to, which makes
+any truck -> landfill route a walk down the field, O(path length).
+
+The field is rebuilt lazily the first time it is used after graph.version changed, or right
+away by apply_change when it's subscribed to the Map's patches.
+"""
+
+from array import array
+import threading
+
+from structs import PriorityQueue
+
+INFINITY = float("inf")
+
+# All 8 neighbor offsets, a predecessor of a cell is any in-bound cell around it
+NEIGHBOR_OFFSETS = [(1, 0), (1, 1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, -1)]
+
+class DistanceField:
+  def __init__(self, graph, target):
+    """
+    Create the distance field of the given target and compute it right away
+
+    :param graph: (GridWithWeights) Graph the trucks are moving on
+    :param target: (tuple) (x, y) location every route of this field ends at
+    :raises ValueError: If the target is outside the graph
+    """
+    if not graph.in_bounds(target):
+      raise ValueError("Distance field target " + str(target) + " is out of bounds")
+    self.graph = graph
+    self.target = target
+    self.version = None
+    self.__cost = None
+    self.__next = None
+    self.__lock = threading.Lock()
+    self.build()
+
+  def build(self):
+    """ Runs the reverse Dijkstra from the target over the whole graph """
+    graph = self.graph
+    width = graph.width
+    height = graph.height
+    version = graph.version
+    cost = array('d', [INFINITY]) * (width * height)
+    next = array('l', [-1]) * (width * height)
+    done = bytearray(width * height)
+
+    target_index = graph.index(self.target)
+    cost[target_index] = 0
+    frontier = PriorityQueue()
+    frontier.put(target_index, 0)
+
+    while not frontier.empty():
+      current = frontier.get()
+      if done[current]:
+        continue
+      done[current] = 1
+      (x, y) = (current % width, current // width)
+      # Nothing can step into a wall, so walls only get a cost (a truck may stand on one)
+      if current != target_index and not graph.passable((x, y)):
+        continue
+      for (dx, dy) in NEIGHBOR_OFFSETS:
+        (px, py) = (x + dx, y + dy)
+        if 0 <= px < width and 0 <= py < height:
+          previous = py * width + px
+          if done[previous]:
+            continue
+          new_cost = cost[current] + graph.cost((px, py), (x, y))
+          if new_cost < cost[previous]:
+            cost[previous] = new_cost
+            next[previous] = current
+            frontier.put(previous, new_cost)
+
+    with self.__lock:
+      self.__cost = cost
+      self.__next = next
+      self.version = version
+
+  def refresh(self):
+    """ Rebuilds the field if the graph changed since it was last built """
+    if self.version != self.graph.version:
+      self.build()
+
+  def apply_change(self, change):
+    """
+    Rebuilds the field after a map patch, meant to be subscribed to the Map. A patch that only made
+    cells more expensive that can't reach the target anyway changes nothing and is skipped.
+
+    :param change: (MapChange) Change made by Map.apply_patch
+    """
+    graph = self.graph
+    with self.__lock:
+      (cost, version) = (self.__cost, self.version)
+    if version == graph.version:
+      # Changes are handed out after the fact, a reader may have rebuilt the field already
+      return
+    if version == change.from_version and not change.improved and \
+       all(cost[graph.index(cell)] == INFINITY for cell in change.cells):
+      with self.__lock:
+        if self.version == change.from_version:
+          self.version = change.version
+          return
+    self.build()
+
+  def get_cost(self, start):
+    """
+    Returns the cost of the cheapest route from start to the target
+
+    :param start: (tuple) (x, y) location
+    :return: (float) The route cost, or None if the target can't be reached from start
+    """
+    self.refresh()
+    if not self.graph.in_bounds(start):
+      return None
+    cost = self.__cost[self.graph.index(start)]
+    return None if cost == INFINITY else cost
+
+  def get_path(self, start):
+    """
+    Returns the route from start to the target by walking down the field
+
+    :param start: (tuple) (x, y) location
+    :return: (list) Path from start to target, both included, or None if unreachable
+    """
+    self.refresh()
+    graph = self.graph
+    if not graph.in_bounds(start):
+      return None
+    with self.__lock:
+      cost = self.__cost
+      next = self.__next
+    current = graph.index(start)
+    if cost[current] == INFINITY:
+      return None
+    path = [start]
+    while next[current] != -1:
+      current = next[current]
+      path.append((current % graph.width, current // graph.width))
+    return path
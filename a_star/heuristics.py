@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+"""
+Heuristics of the path finding engines
+
+Every engine estimates the cost left to the goal with one of these objects. Each is called as
+heuristic(a, b) with two (x, y) cells and returns an estimate of the cost from a to b.
+refresh() brings it up to date with the graph, and engines call it once per query before
+estimating anything.
+
+Octile_Heuristic prices straight and diagonal moves with the cheapest step costs of the graph, a
+lower bound of the true cost, so searches guided by it return optimal routes.
+
+Landmark_Heuristic (ALT, Goldberg & Harrelson 2005) precomputes the cost from and to a handful of
+landmark cells and bounds d(a, b) with the triangle inequality, which is much tighter than octile
+around walls. Its tables are written to disk keyed by a fingerprint of the map, so they're only
+computed again when the map changes.
+
+Manhattan_Heuristic is the original distance + fuel estimate of A_Star_Search. It isn't a lower
+bound on an 8-connected grid and is only kept for the greedy behaviour of the old searches.
+
+Euclidean_Heuristic is the straight line distance times the cheapest weight per unit of distance,
+the lower bound for road networks, whose nodes don't sit on a grid.
+
+heuristic_for(graph) returns the heuristic registered for a graph with use_heuristic(), or the
+default one of the kind of graph, and is what every engine uses unless it's given one.
+"""
+
+from array import array
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import weakref
+
+INFINITY = float("inf")
+
+DEFAULT_LANDMARK_COUNT = 4
+
+# Landmark tables are kept here unless a Landmark_Heuristic is given another directory
+LANDMARK_DIRECTORY = os.path.join(os.path.expanduser("~"), ".iDumpster", "landmarks")
+
+# Bumped whenever the layout of the landmark files changes
+LANDMARK_FILE_VERSION = 1
+
+NEIGHBOR_OFFSETS = [(1, 0), (1, 1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, -1)]
+
+_heuristics = weakref.WeakKeyDictionary()
+
+def heuristic_for(graph):
+  """ Returns the heuristic registered for graph, octile (euclidean on road networks) unless use_heuristic changed it """
+  base = getattr(graph, 'base', None)
+  if base is not None and graph not in _heuristics:
+    # Views of a grid at an hour of the day only add delays to its weights, so the estimates
+    # of the grid stay lower bounds and its landmark tables needn't be built again
+    return heuristic_for(base)
+  heuristic = _heuristics.get(graph)
+  if heuristic is None:
+    if hasattr(graph, 'min_cost_per_distance'):
+      heuristic = Euclidean_Heuristic(graph)
+    else:
+      heuristic = Octile_Heuristic(graph)
+    heuristic = _heuristics.setdefault(graph, heuristic)
+  return heuristic
+
+def use_heuristic(graph, heuristic):
+  """ Makes heuristic the one every engine uses on graph when it isn't given one """
+  _heuristics[graph] = heuristic
+
+def lower_bound_step_costs(graph):
+  """
+  Returns the (straight, diagonal) octile factors of the graph: the cheapest way to make
+  progress along a straight line and along a diagonal, given the cheapest cell weight
+  """
+  weight = graph.min_cell_weight()
+  straight_cost = graph.cost((0, 0), (1, 0)) - graph.default_cost((0, 0), (1, 0)) + weight
+  diagonal_cost = graph.cost((0, 0), (1, 1)) - graph.default_cost((0, 0), (1, 1)) + weight
+  return min(straight_cost, diagonal_cost), min(diagonal_cost, 2 * straight_cost)
+
+class Octile_Heuristic:
+  def __init__(self, graph):
+    self.graph = graph
+    self.version = None
+    self.straight_cost = None
+    self.diagonal_cost = None
+    self.refresh()
+
+  def refresh(self):
+    """ Recomputes the step factors if the graph changed since they were computed """
+    if self.version != self.graph.version:
+      (self.straight_cost, self.diagonal_cost) = lower_bound_step_costs(self.graph)
+      self.version = self.graph.version
+
+  def __call__(self, a, b):
+    (x1, y1) = a
+    (x2, y2) = b
+    dx = abs(x1 - x2)
+    dy = abs(y1 - y2)
+    if dx > dy:
+      return self.straight_cost * (dx - dy) + self.diagonal_cost * dy
+    return self.straight_cost * (dy - dx) + self.diagonal_cost * dx
+
+  def estimate_to(self, goal):
+    """ Returns estimate(x, y, index) of the cost from a cell to goal, for index based engines """
+    (goal_x, goal_y) = goal
+    straight_cost = self.straight_cost
+    diagonal_cost = self.diagonal_cost
+    def estimate(x, y, index):
+      dx = abs(x - goal_x)
+      dy = abs(y - goal_y)
+      if dx > dy:
+        return straight_cost * (dx - dy) + diagonal_cost * dy
+      return straight_cost * (dy - dx) + diagonal_cost * dx
+    return estimate
+
+class Euclidean_Heuristic:
+  """ Straight line lower bound of a road network, see RoadNetwork.min_cost_per_distance """
+  def __init__(self, graph):
+    self.graph = graph
+    self.version = None
+    self.factor = None
+    self.refresh()
+
+  def refresh(self):
+    if self.version != self.graph.version:
+      self.factor = self.graph.min_cost_per_distance()
+      self.version = self.graph.version
+
+  def __call__(self, a, b):
+    (x1, y1) = a
+    (x2, y2) = b
+    return self.factor * math.hypot(x1 - x2, y1 - y2)
+
+  def estimate_to(self, goal):
+    (goal_x, goal_y) = goal
+    factor = self.factor
+    def estimate(x, y, index):
+      return factor * math.hypot(x - goal_x, y - goal_y)
+    return estimate
+
+class Manhattan_Heuristic:
+  """ Distance + fuel estimate of the original A_Star_Search, not admissible """
+  def __init__(self, graph, fuel_cost_per_block=1):
+    self.graph = graph
+    self.factor = 1 + fuel_cost_per_block
+
+  def refresh(self):
+    pass
+
+  def __call__(self, a, b):
+    (x1, y1) = a
+    (x2, y2) = b
+    return (abs(x1 - x2) + abs(y1 - y2)) * self.factor
+
+  def estimate_to(self, goal):
+    (goal_x, goal_y) = goal
+    factor = self.factor
+    def estimate(x, y, index):
+      return factor * (abs(x - goal_x) + abs(y - goal_y))
+    return estimate
+
+class Landmark_Heuristic:
+  def __init__(self, graph, count=DEFAULT_LANDMARK_COUNT, directory=LANDMARK_DIRECTORY):
+    """
+    Create the ALT heuristic of the graph, loading or computing its landmark tables right away
+
+    :param graph: (GridWithWeights) Graph the landmarks are picked on
+    :param count: (int) Number of landmarks, each costs two full Dijkstra runs and 16 bytes per cell
+    :param directory: (str) Where landmark tables are persisted, None keeps them in memory only
+    """
+    if count < 1:
+      raise ValueError("At least one landmark is needed")
+    self.graph = graph
+    self.count = count
+    self.directory = directory
+    self.version = None
+    self.fingerprint = None
+    self.landmarks = []
+    self.builds = 0
+    self.loads = 0
+    self.__from_landmark = []
+    self.__to_landmark = []
+    self.__octile = Octile_Heuristic(graph)
+    self.__lock = threading.Lock()
+    self.refresh()
+
+  def refresh(self):
+    """ Brings the tables up to date after a map change, from disk if this map was seen before """
+    if self.version == self.graph.version:
+      return
+    with self.__lock:
+      if self.version == self.graph.version:
+        return
+      version = self.graph.version
+      self.__octile.refresh()
+      fingerprint = map_fingerprint(self.graph, self.count)
+      if fingerprint != self.fingerprint:
+        if not self.load(fingerprint):
+          self.build()
+          self.save(fingerprint)
+        self.fingerprint = fingerprint
+      self.version = version
+
+  def __call__(self, a, b):
+    graph = self.graph
+    (x1, y1) = a
+    (x2, y2) = b
+    index_a = y1 * graph.width + x1
+    index_b = y2 * graph.width + x2
+    best = self.__octile(a, b)
+    for (from_landmark, to_landmark) in zip(self.__from_landmark, self.__to_landmark):
+      # d(L, b) <= d(L, a) + d(a, b) and d(a, L) <= d(a, b) + d(b, L)
+      bound = from_landmark[index_b] - from_landmark[index_a]
+      if bound > best and bound != INFINITY:
+        best = bound
+      bound = to_landmark[index_a] - to_landmark[index_b]
+      if bound > best and bound != INFINITY:
+        best = bound
+    return best
+
+  def estimate_to(self, goal):
+    """ Returns estimate(x, y, index) of the cost from a cell to goal, for index based engines """
+    goal_index = self.graph.index(goal)
+    octile = self.__octile.estimate_to(goal)
+    # Only the goal's side of every bound is fixed per query
+    tables = [(from_landmark, from_landmark[goal_index], to_landmark, to_landmark[goal_index])
+              for (from_landmark, to_landmark) in zip(self.__from_landmark, self.__to_landmark)]
+    def estimate(x, y, index):
+      best = octile(x, y, index)
+      for (from_landmark, from_goal, to_landmark, to_goal) in tables:
+        bound = from_goal - from_landmark[index]
+        if bound > best and bound != INFINITY:
+          best = bound
+        bound = to_landmark[index] - to_goal
+        if bound > best and bound != INFINITY:
+          best = bound
+      return best
+    return estimate
+
+  def build(self):
+    """ Picks the landmarks and runs the forward and backward Dijkstra of each one """
+    graph = self.graph
+    passable = [index for (index, wall) in enumerate(graph.cells) if not wall]
+    self.landmarks = []
+    self.__from_landmark = []
+    self.__to_landmark = []
+    self.builds += 1
+    if not passable:
+      return
+    # Farthest point selection: every landmark is the cell farthest from the ones picked so far,
+    # the first one is the cell farthest from an arbitrary passable cell
+    closest = cell_distances(graph, passable[0])
+    for i in range(self.count):
+      landmark = max((index for index in passable if closest[index] != INFINITY), key=closest.__getitem__)
+      if self.landmarks and closest[landmark] == 0:
+        break
+      from_landmark = cell_distances(graph, landmark)
+      if not self.landmarks:
+        closest = array('d', from_landmark)
+      else:
+        for index in passable:
+          if from_landmark[index] < closest[index]:
+            closest[index] = from_landmark[index]
+      self.landmarks.append((landmark % graph.width, landmark // graph.width))
+      self.__from_landmark.append(from_landmark)
+      self.__to_landmark.append(cell_distances(graph, landmark, reverse=True))
+    logging.info("Built " + str(len(self.landmarks)) + " landmarks on the " + str(graph.width) + "x" + str(graph.height) + " map")
+
+  def file_name(self, fingerprint):
+    return os.path.join(self.directory, fingerprint + ".alt")
+
+  def load(self, fingerprint):
+    """ Loads the tables of the map with this fingerprint, False if they were never saved """
+    if self.directory is None or not os.path.exists(self.file_name(fingerprint)):
+      return False
+    size = len(self.graph.cells)
+    try:
+      with open(self.file_name(fingerprint), "rb") as table_file:
+        header = json.loads(table_file.readline())
+        if header["version"] != LANDMARK_FILE_VERSION or header["size"] != size:
+          return False
+        (from_tables, to_tables) = ([], [])
+        for landmark in header["landmarks"]:
+          for tables in (from_tables, to_tables):
+            table = array('d')
+            table.fromfile(table_file, size)
+            tables.append(table)
+    except (IOError, EOFError, ValueError, KeyError), e:
+      logging.warning("Ignoring unreadable landmark file " + self.file_name(fingerprint) + ": " + str(e))
+      return False
+    self.landmarks = [tuple(landmark) for landmark in header["landmarks"]]
+    self.__from_landmark = from_tables
+    self.__to_landmark = to_tables
+    self.loads += 1
+    return True
+
+  def save(self, fingerprint):
+    """ Writes the tables next to the ones of other maps, written to a temporary file and renamed """
+    if self.directory is None:
+      return
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      temporary = self.file_name(fingerprint) + ".tmp"
+      with open(temporary, "wb") as table_file:
+        header = {"version": LANDMARK_FILE_VERSION, "size": len(self.graph.cells), "landmarks": self.landmarks}
+        table_file.write(json.dumps(header) + "\n")
+        for (from_landmark, to_landmark) in zip(self.__from_landmark, self.__to_landmark):
+          from_landmark.tofile(table_file)
+          to_landmark.tofile(table_file)
+      os.rename(temporary, self.file_name(fingerprint))
+    except (IOError, OSError), e:
+      logging.warning("Couldn't persist the landmark tables: " + str(e))
+
+def map_fingerprint(graph, count):
+  """ Hash of everything a landmark table depends on: size, walls, weights and landmark count """
+  digest = hashlib.sha1()
+  digest.update("%d %d %d %d " % (LANDMARK_FILE_VERSION, graph.width, graph.height, count))
+  digest.update(bytes(graph.cells))
+  digest.update(graph.cell_weights.tostring())
+  digest.update(repr(sorted(graph.dist_weights.items())))
+  digest.update(repr(sorted(graph.fuel_weights.items())))
+  return digest.hexdigest()
+
+def cell_distances(graph, source, reverse=False):
+  """
+  Dijkstra over the whole graph from the cell index source
+
+  :return: (array) Cost from source to every cell, or from every cell to source when reverse
+  """
+  width = graph.width
+  height = graph.height
+  cells = graph.cells
+  weights = graph.cell_weights
+  # What a step costs on top of the weight of the cell it enters
+  step_costs = {1: graph.cost((0, 0), (1, 0)) - graph.default_cost((0, 0), (1, 0)),
+                2: graph.cost((0, 0), (1, 1)) - graph.default_cost((0, 0), (1, 1))}
+  offsets = [(dx, dy, dy * width + dx, step_costs[abs(dx) + abs(dy)]) for (dx, dy) in NEIGHBOR_OFFSETS]
+  cost = array('d', [INFINITY]) * len(cells)
+  done = bytearray(len(cells))
+  cost[source] = 0
+  frontier = [(0, source)]
+  while frontier:
+    (current_cost, current) = heapq.heappop(frontier)
+    if done[current]:
+      continue
+    done[current] = 1
+    # Nothing leaves or steps into a wall, except the source itself
+    if current != source and cells[current]:
+      continue
+    (y, x) = divmod(current, width)
+    for (dx, dy, delta, step_cost) in offsets:
+      if 0 <= x + dx < width and 0 <= y + dy < height:
+        next = current + delta
+        if reverse:
+          # Stepping from next into current, any cell can be left but only into a passable one
+          new_cost = current_cost + weights[current] + step_cost
+        elif cells[next]:
+          continue
+        else:
+          new_cost = current_cost + weights[next] + step_cost
+        if new_cost < cost[next]:
+          cost[next] = new_cost
+          heapq.heappush(frontier, (new_cost, next))
+  return cost
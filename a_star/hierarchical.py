@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+Hierarchical path finding (HPA*, Botea, Mueller & Schaeffer 2004) for city sized maps
+
+The grid is cut into square clusters. Along every border between two neighbouring clusters the
+crossings (pairs of passable cells on both sides) are grouped into entrances and each entrance
+keeps one or two transitions. Inside each cluster the cheapest route between every pair of its
+transitions is computed with a search that never leaves the cluster, the first time a query needs
+that cluster, and kept from then on. A route query connects the start and goal to the transitions
+of their own clusters, searches the small abstract graph and stitches the stored cluster routes
+back together. Start and goal in the same or neighbouring clusters are searched directly.
+
+Routes are near optimal rather than optimal, the price of searching the abstract graph. When walls
+or weights change, update_cells() rebuilds the borders around the changed cells and drops the
+routes of the clusters next to them; if the graph changed without being told which cells, the
+whole abstraction is rebuilt on the next query. Updates can come from the Map's subscriber thread
+while dispatch threads are searching, so a search holds the hierarchy's lock from start to end.
+"""
+
+import threading
+import weakref
+
+from structs import PriorityQueue
+from heuristics import heuristic_for
+
+DEFAULT_CLUSTER_SIZE = 16
+
+# An entrance longer than this keeps a transition at both of its ends instead of one in the middle
+LONG_ENTRANCE = 6
+
+# Offsets of the clusters that own a shared border with a cluster, each border is listed once
+BORDER_DIRECTIONS = [(1, 0), (0, 1), (1, 1), (1, -1)]
+
+_hierarchies = weakref.WeakKeyDictionary()
+
+def hierarchy_for(graph, cluster_size=DEFAULT_CLUSTER_SIZE):
+  """ Returns the shared Hierarchical_Graph of the graph, building it on first use """
+  hierarchy = _hierarchies.get(graph)
+  if hierarchy is None or hierarchy.cluster_size != cluster_size:
+    hierarchy = Hierarchical_Graph(graph, cluster_size)
+    _hierarchies[graph] = hierarchy
+  return hierarchy
+
+def update_hierarchy(graph, change):
+  """ Hands a map patch to the hierarchy of graph, if one was built """
+  hierarchy = _hierarchies.get(graph)
+  if hierarchy is not None:
+    hierarchy.apply_change(change)
+
+class Hierarchical_Graph:
+  def __init__(self, graph, cluster_size=DEFAULT_CLUSTER_SIZE):
+    """
+    Create the abstraction of the graph and build it right away
+
+    :param graph: (GridWithWeights) Graph to build the abstraction of
+    :param cluster_size: (int) Width and height of a cluster in cells
+    """
+    if cluster_size < 2:
+      raise ValueError("Clusters must be at least 2 cells wide")
+    self.graph = graph
+    self.cluster_size = cluster_size
+    self.version = None
+    self.__lock = threading.RLock()
+    self.build()
+
+  def lock(self):
+    """ Lock to hold while reading the abstraction, every update of it holds it too """
+    return self.__lock
+
+  def build(self):
+    """ Builds every border and every cluster from scratch """
+    with self.__lock:
+      graph = self.graph
+      self.clusters_x = (graph.width + self.cluster_size - 1) // self.cluster_size
+      self.clusters_y = (graph.height + self.cluster_size - 1) // self.cluster_size
+      self.borders = {}
+      self.crossings = {}
+      self.transitions = {}
+      self.intra = {}
+      clusters = [(cx, cy) for cx in range(self.clusters_x) for cy in range(self.clusters_y)]
+      for cluster in clusters:
+        for (dx, dy) in BORDER_DIRECTIONS:
+          other = (cluster[0] + dx, cluster[1] + dy)
+          if self.valid_cluster(other):
+            self.build_border(cluster, other)
+      for cluster in clusters:
+        self.find_transitions(cluster)
+      self.version = graph.version
+
+  def update_cells(self, cells):
+    """
+    Rebuilds only the part of the abstraction that the changed cells can affect
+
+    :param cells: Iterable of (x, y) cells whose wall or weight changed
+    """
+    with self.__lock:
+      if self.version is None:
+        return self.build()
+      dirty = set(self.cluster_of(cell) for cell in cells if self.graph.in_bounds(cell))
+      affected = set(dirty)
+      for cluster in dirty:
+        for other in self.neighbouring_clusters(cluster):
+          affected.add(other)
+          self.build_border(*sorted([cluster, other]))
+      for cluster in affected:
+        self.find_transitions(cluster)
+      self.version = self.graph.version
+
+  def apply_change(self, change):
+    """ Updates the abstraction after a map patch, meant to be subscribed to the Map """
+    with self.__lock:
+      if self.version == self.graph.version:
+        # Changes are handed out after the fact, a search may have rebuilt the abstraction already
+        return
+      if self.version == change.from_version and self.graph.version == change.version:
+        self.update_cells(change.cells)
+      else:
+        self.build()
+
+  def refresh(self):
+    """ Rebuilds everything if the graph changed behind the abstraction's back """
+    with self.__lock:
+      if self.version != self.graph.version:
+        self.build()
+
+  def valid_cluster(self, cluster):
+    return 0 <= cluster[0] < self.clusters_x and 0 <= cluster[1] < self.clusters_y
+
+  def cluster_of(self, cell):
+    return (cell[0] // self.cluster_size, cell[1] // self.cluster_size)
+
+  def cluster_bounds(self, cluster):
+    x0 = cluster[0] * self.cluster_size
+    y0 = cluster[1] * self.cluster_size
+    return x0, y0, min(x0 + self.cluster_size, self.graph.width), min(y0 + self.cluster_size, self.graph.height)
+
+  def neighbouring_clusters(self, cluster):
+    (cx, cy) = cluster
+    for dx in (-1, 0, 1):
+      for dy in (-1, 0, 1):
+        if (dx or dy) and self.valid_cluster((cx + dx, cy + dy)):
+          yield (cx + dx, cy + dy)
+
+  def build_border(self, cluster, other):
+    """ Finds the entrances between two neighbouring clusters and keeps their transitions """
+    for (a, b) in self.borders.pop((cluster, other), []):
+      self.crossings[a].discard(b)
+      self.crossings[b].discard(a)
+    passable = self.graph.passable
+    (x0, y0, x1, y1) = self.cluster_bounds(cluster)
+    (dx, dy) = (other[0] - cluster[0], other[1] - cluster[1])
+    selected = []
+
+    if dx and dy:
+      # Corner crossing, a single diagonal step between the two clusters
+      a = (x1 - 1 if dx > 0 else x0, y1 - 1 if dy > 0 else y0)
+      b = (a[0] + dx, a[1] + dy)
+      if self.graph.in_bounds(b) and passable(a) and passable(b):
+        selected.append((a, b))
+    else:
+      # Cells along the border, `a` inside this cluster and `b` straight across in the other one
+      if dx:
+        line = [((x1 - 1, y), (x1, y)) for y in range(y0, y1)]
+      else:
+        line = [((x, y1 - 1), (x, y1)) for x in range(x0, x1)]
+      straight = [passable(a) and passable(b) for (a, b) in line]
+      run = []
+      for (index, crossing) in enumerate(line + [None]):
+        if crossing is not None and straight[index]:
+          run.append(crossing)
+          continue
+        if run:
+          if len(run) > LONG_ENTRANCE:
+            selected += [run[0], run[-1]]
+          else:
+            selected.append(run[len(run) // 2])
+          run = []
+      # Diagonal crossings are only needed where no straight crossing next to them gets around the corner
+      for index in range(len(line) - 1):
+        if straight[index] or straight[index + 1]:
+          continue
+        ((a1, b1), (a2, b2)) = (line[index], line[index + 1])
+        for (a, b) in ((a1, b2), (a2, b1)):
+          if passable(a) and passable(b):
+            selected.append((a, b))
+
+    self.borders[(cluster, other)] = selected
+    for (a, b) in selected:
+      self.crossings.setdefault(a, set()).add(b)
+      self.crossings.setdefault(b, set()).add(a)
+
+  def find_transitions(self, cluster):
+    """ Collects the transitions of a cluster and drops its routes, they are recomputed on demand """
+    transitions = set()
+    for other in self.neighbouring_clusters(cluster):
+      for (a, b) in self.borders.get(tuple(sorted([cluster, other])), []):
+        transitions.add(a if self.cluster_of(a) == cluster else b)
+    self.transitions[cluster] = transitions
+    self.intra.pop(cluster, None)
+
+  def cluster_routes(self, cluster):
+    """ Returns transition -> {transition: (cost, path)} for a cluster, computing it on first use """
+    with self.__lock:
+      routes = self.intra.get(cluster)
+      if routes is None:
+        transitions = self.transitions[cluster]
+        bounds = self.cluster_bounds(cluster)
+        routes = dict((transition, self.bounded_search(bounds, transition, transitions - set([transition])))
+                      for transition in transitions)
+        self.intra[cluster] = routes
+      return routes
+
+  def bounded_search(self, bounds, source, targets, reverse=False):
+    """
+    Dijkstra from source that never leaves the given (x0, y0, x1, y1) rectangle
+
+    :param reverse: (bool) Search backwards, giving routes from each target to source
+    :return: (dict) target -> (cost, path) for every target reachable inside the rectangle, paths
+             run from source to target, or from target to source when searching in reverse
+    """
+    graph = self.graph
+    (x0, y0, x1, y1) = bounds
+    frontier = PriorityQueue()
+    frontier.put(source, 0)
+    came_from = {source: None}
+    cost_so_far = {source: 0}
+    settled = set()
+    remaining = set(targets)
+    while not frontier.empty() and remaining:
+      current = frontier.get()
+      if current in settled:
+        continue
+      settled.add(current)
+      remaining.discard(current)
+      if reverse:
+        # Nothing steps into a wall, a walled source is only reached by standing on it
+        if not graph.passable(current):
+          continue
+        (x, y) = current
+        steps = [(x + 1, y), (x + 1, y + 1), (x, y - 1), (x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y - 1)]
+      else:
+        steps = graph.neighbors(current)
+      for next in steps:
+        if not (x0 <= next[0] < x1 and y0 <= next[1] < y1) or next in settled:
+          continue
+        step_cost = graph.cost(next, current) if reverse else graph.cost(current, next)
+        new_cost = cost_so_far[current] + step_cost
+        if next not in cost_so_far or new_cost < cost_so_far[next]:
+          cost_so_far[next] = new_cost
+          came_from[next] = current
+          frontier.put(next, new_cost)
+
+    routes = {}
+    for target in targets:
+      if target in settled:
+        path = [target]
+        while came_from[path[-1]] is not None:
+          path.append(came_from[path[-1]])
+        if not reverse:
+          path.reverse()
+        routes[target] = (cost_so_far[target], path)
+    return routes
+
+class Hierarchical_Search:
+  def __init__(self, graph, compA, compB, hierarchy=None, heuristic=None):
+    self.__heuristic = heuristic or heuristic_for(graph)
+    self.__a_star_path = []
+    self.__cost = None
+    self.__nodes_expanded = 0
+    start = compA.getLocation()
+    goal = compB.getLocation()
+    if not (graph.in_bounds(start) and graph.in_bounds(goal)):
+      raise ValueError("Either of the component is out of bounds")
+    self.__hierarchy = hierarchy or hierarchy_for(graph)
+    self.__heuristic.refresh()
+    # A patch landing halfway would change the crossings and cluster routes under the search
+    with self.__hierarchy.lock():
+      self.__hierarchy.refresh()
+      self.hierarchical_search(start, goal)
+
+  def heuristic(self, a, b):
+    return self.__heuristic(a, b)
+
+  def hierarchical_search(self, start, goal):
+    hierarchy = self.__hierarchy
+    graph = hierarchy.graph
+    start_cluster = hierarchy.cluster_of(start)
+    goal_cluster = hierarchy.cluster_of(goal)
+    if start == goal:
+      self.__a_star_path = [start]
+      self.__cost = 0
+      return
+
+    # Routes between the same or neighbouring clusters are searched directly over both clusters
+    if abs(start_cluster[0] - goal_cluster[0]) <= 1 and abs(start_cluster[1] - goal_cluster[1]) <= 1:
+      (sx0, sy0, sx1, sy1) = hierarchy.cluster_bounds(start_cluster)
+      (gx0, gy0, gx1, gy1) = hierarchy.cluster_bounds(goal_cluster)
+      local = hierarchy.bounded_search((min(sx0, gx0), min(sy0, gy0), max(sx1, gx1), max(sy1, gy1)), start, [goal])
+      if goal in local:
+        (self.__cost, self.__a_star_path) = local[goal]
+        return
+
+    # Temporarily connect start and goal to the transitions of their clusters
+    start_edges = hierarchy.bounded_search(hierarchy.cluster_bounds(start_cluster), start, hierarchy.transitions[start_cluster])
+    goal_edges = hierarchy.bounded_search(hierarchy.cluster_bounds(goal_cluster), goal, hierarchy.transitions[goal_cluster], reverse=True)
+
+    frontier = PriorityQueue()
+    frontier.put(start, 0)
+    came_from = {start: None}
+    cost_so_far = {start: 0}
+    closed = set()
+    while not frontier.empty():
+      current = frontier.get()
+      if current in closed:
+        continue
+      closed.add(current)
+      self.__nodes_expanded += 1
+      if current == goal:
+        break
+      for (next, cost, path) in self.abstract_edges(current, start, goal, start_edges, goal_edges):
+        new_cost = cost_so_far[current] + cost
+        if next not in cost_so_far or new_cost < cost_so_far[next]:
+          cost_so_far[next] = new_cost
+          came_from[next] = (current, path)
+          frontier.put(next, new_cost + self.heuristic(next, goal))
+
+    if goal not in closed:
+      return
+    # Stitch the cluster routes of the abstract path back into a cell path
+    segments = []
+    current = goal
+    while came_from[current] is not None:
+      (current, path) = came_from[current]
+      segments.append(path)
+    segments.reverse()
+    cells = [start]
+    for path in segments:
+      cells += path[1:]
+    self.__a_star_path = cells
+    self.__cost = cost_so_far[goal]
+
+  def abstract_edges(self, current, start, goal, start_edges, goal_edges):
+    """ Yields (next, cost, path) for every abstract edge leaving current """
+    hierarchy = self.__hierarchy
+    graph = hierarchy.graph
+    if current == start:
+      for (transition, (cost, path)) in start_edges.items():
+        yield transition, cost, path
+    if current in goal_edges:
+      (cost, path) = goal_edges[current]
+      yield goal, cost, path
+    cluster = hierarchy.cluster_of(current)
+    for (transition, (cost, path)) in hierarchy.cluster_routes(cluster).get(current, {}).items():
+      yield transition, cost, path
+    for other in hierarchy.crossings.get(current, ()):
+      yield other, graph.cost(current, other), [current, other]
+
+  def get_cost_so_far(self, id):
+    """ Cost of the route, only known for the goal """
+    if not self.__a_star_path or id != self.__a_star_path[-1]:
+      raise KeyError(id)
+    return self.__cost
+
+  def get_a_star_path(self):
+    return list(self.__a_star_path)
+
+  def get_nodes_expanded(self):
+    return self.__nodes_expanded
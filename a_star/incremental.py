@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Incremental replanning with D* Lite (Koenig & Likhachev, 2002)
+
+A truck's route is normally computed once. When a wall appears or a weight changes under a truck
+that is already driving, a fresh A * search would redo all of its work. D* Lite searches backwards
+from the goal and keeps its g/rhs values between calls, so after a change only the cells whose
+cost to the goal actually changed are expanded again, and the truck's progress along the route is
+absorbed by the key modifier km instead of a restart.
+
+Incremental_Planner keeps one D_Star_Lite per active truck and repairs all of them when cells change.
+"""
+
+import threading
+
+from structs import PriorityQueue
+from heuristics import Octile_Heuristic
+from heuristics import lower_bound_step_costs
+
+INFINITY = float("inf")
+
+class D_Star_Lite:
+  def __init__(self, graph, compA, compB):
+    """
+    Create the planner of a route and compute the initial one
+
+    :param graph: (GridWithWeights) Graph the truck is driving on
+    :param compA: Component the route starts from (anything with getLocation)
+    :param compB: Component the route ends at (anything with getLocation)
+    """
+    self.graph = graph
+    self.start = compA.getLocation()
+    self.goal = compB.getLocation()
+    if not (graph.in_bounds(self.start) and graph.in_bounds(self.goal)):
+      raise ValueError("Either of the component is out of bounds")
+    self.nodes_expanded = 0
+    self.initialize()
+    self.compute_shortest_path()
+
+  def initialize(self):
+    # D* Lite needs the estimate to stay the same between repairs, so it keeps its own octile
+    # heuristic and only refreshes it when starting over
+    self.__heuristic = Octile_Heuristic(self.graph)
+    self.__g = {}
+    self.__rhs = {self.goal: 0}
+    self.__open = {}
+    self.__frontier = PriorityQueue()
+    self.__km = 0
+    self.__last = self.start
+    self.insert(self.goal, self.calculate_key(self.goal))
+
+  def heuristic(self, a, b):
+    return self.__heuristic(a, b)
+
+  def g(self, s):
+    return self.__g.get(s, INFINITY)
+
+  def rhs(self, s):
+    return self.__rhs.get(s, INFINITY)
+
+  def calculate_key(self, s):
+    value = min(self.g(s), self.rhs(s))
+    return (value + self.heuristic(self.start, s) + self.__km, value)
+
+  def insert(self, s, key):
+    self.__open[s] = key
+    self.__frontier.put(s, key)
+
+  def top_key(self):
+    # Entries whose key no longer matches the open list were removed or re-inserted since
+    frontier = self.__frontier
+    while not frontier.empty() and self.__open.get(frontier.peek()) != frontier.min_priority():
+      frontier.get()
+    if frontier.empty():
+      return (INFINITY, INFINITY)
+    return frontier.min_priority()
+
+  def predecessors(self, s):
+    # Nothing can step into a wall, every in-bound cell around a passable cell can
+    if not self.graph.passable(s):
+      return []
+    (x, y) = s
+    cells = [(x + 1, y), (x + 1, y + 1), (x, y - 1), (x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y - 1)]
+    return [cell for cell in cells if self.graph.in_bounds(cell)]
+
+  def update_vertex(self, u):
+    if u != self.goal:
+      self.__rhs[u] = min([self.graph.cost(u, s) + self.g(s) for s in self.graph.neighbors(u)] or [INFINITY])
+    self.__open.pop(u, None)
+    if self.g(u) != self.rhs(u):
+      self.insert(u, self.calculate_key(u))
+
+  def compute_shortest_path(self):
+    while self.top_key() < self.calculate_key(self.start) or self.rhs(self.start) != self.g(self.start):
+      k_old = self.top_key()
+      if k_old == (INFINITY, INFINITY):
+        break
+      u = self.__frontier.get()
+      del self.__open[u]
+      self.nodes_expanded += 1
+      k_new = self.calculate_key(u)
+      if k_old < k_new:
+        self.insert(u, k_new)
+      elif self.g(u) > self.rhs(u):
+        self.__g[u] = self.rhs(u)
+        for s in self.predecessors(u):
+          self.update_vertex(s)
+      else:
+        self.__g[u] = INFINITY
+        for s in self.predecessors(u) + [u]:
+          self.update_vertex(s)
+
+  def move_to(self, location):
+    """ Records that the truck moved along its route, no search happens until the next repair """
+    self.__km += self.heuristic(self.__last, location)
+    self.__last = location
+    self.start = location
+
+  def update_cells(self, cells):
+    """
+    Repairs the route after the walls or weights of the given cells changed
+
+    :param cells: Iterable of (x, y) cells whose wall or weight changed
+    :return: (int) Number of cells expanded by the repair
+    """
+    expanded = self.nodes_expanded
+    (straight_cost, diagonal_cost) = lower_bound_step_costs(self.graph)
+    if straight_cost < self.__heuristic.straight_cost or diagonal_cost < self.__heuristic.diagonal_cost:
+      # A cheaper cell breaks the heuristic's lower bound, which D* Lite can't repair around
+      self.initialize()
+    else:
+      touched = set()
+      for cell in cells:
+        if self.graph.in_bounds(cell):
+          touched.add(cell)
+          (x, y) = cell
+          touched.update(c for c in [(x + 1, y), (x + 1, y + 1), (x, y - 1), (x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y - 1)]
+                         if self.graph.in_bounds(c))
+      for u in touched:
+        self.update_vertex(u)
+    self.compute_shortest_path()
+    return self.nodes_expanded - expanded
+
+  def get_a_star_path(self):
+    """ Returns the current route from the truck's location to the goal, [] if there is none """
+    if self.g(self.start) == INFINITY:
+      return []
+    path = [self.start]
+    current = self.start
+    while current != self.goal and len(path) <= len(self.graph.cells):
+      current = min(self.graph.neighbors(current), key=lambda s: self.graph.cost(current, s) + self.g(s))
+      path.append(current)
+    return path
+
+  def get_cost_so_far(self, id):
+    """ Cost of the remaining route, only known for the goal """
+    if id != self.goal or self.g(self.start) == INFINITY:
+      raise KeyError(id)
+    return self.g(self.start)
+
+  def get_nodes_expanded(self):
+    return self.nodes_expanded
+
+class Incremental_Planner:
+  """
+  Keeps the D* Lite state of every truck that is currently driving a route, each one on the graph
+  it was planned on
+  """
+  def __init__(self, graph):
+    self.graph = graph
+    self.__planners = {}
+    self.__lock = threading.Lock()
+
+  def plan(self, name, compA, compB, graph=None):
+    """
+    Starts tracking the route of a truck and returns its path
+
+    :param graph: (GridWithWeights) Graph to plan the truck's route on instead of the planner's, e.g.
+                  the view of the grid at the hour the truck drives, its walls are the grid's
+    """
+    planner = D_Star_Lite(graph or self.graph, compA, compB)
+    with self.__lock:
+      self.__planners[name] = planner
+    return planner.get_a_star_path()
+
+  def move(self, name, location):
+    """ Records the truck's new location, ignored for trucks without a tracked route """
+    with self.__lock:
+      planner = self.__planners.get(name)
+      if planner is not None:
+        planner.move_to(location)
+
+  def release(self, name):
+    """ Stops tracking a truck, e.g. once it reached its goal """
+    with self.__lock:
+      self.__planners.pop(name, None)
+
+  def update_cells(self, cells):
+    """
+    Repairs the route of every tracked truck after cells changed
+
+    :return: (dict) truck name -> repaired path
+    """
+    cells = list(cells)
+    with self.__lock:
+      repaired = {}
+      for (name, planner) in self.__planners.items():
+        planner.update_cells(cells)
+        repaired[name] = planner.get_a_star_path()
+      return repaired
+
+  def apply_change(self, change):
+    """ Repairs the tracked routes after a map patch, see update_cells """
+    return self.update_cells(change.cells)
+
+  def is_tracked(self, name):
+    with self.__lock:
+      return name in self.__planners
+
+  def tracked(self):
+    with self.__lock:
+      return list(self.__planners.keys())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Jump Point Search for grids where every passable cell has the same weight
+
+On open parts of the map plain A * pushes every one of the 8 neighbors of every expanded cell
+into the heap. Jump point search (Harabor & Grastien, 2011) prunes the neighbors that have an
+equally cheap path around the current cell and jumps along straight and diagonal lines until it
+meets a forced neighbor, so only jump points ever reach the heap. Diagonal moves may cut corners,
+exactly like SquareGrid.neighbors does.
+
+The pruning is only exact when all cells cost the same to enter and a diagonal step costs between
+one and two straight steps. When the graph doesn't satisfy that the search falls back to a plain
+A * expansion, so the returned cost is always the optimal one.
+"""
+
+from structs import PriorityQueue
+from heuristics import heuristic_for
+
+class Jump_Point_Search:
+  def __init__(self, graph, compA, compB, heuristic=None):
+    self.__heuristic = heuristic or heuristic_for(graph)
+    self.__heuristic.refresh()
+    self.__came_from = {}
+    self.__cost_so_far = {}
+    self.__a_star_path = []
+    self.__nodes_expanded = 0
+    self.__heap_pushes = 0
+    self.__graph = graph
+    start = compA.getLocation()
+    goal = compB.getLocation()
+    (self.__straight_cost, self.__diagonal_cost) = uniform_step_costs(graph)
+    self.__jumping = self.__straight_cost is not None
+    if not (graph.in_bounds(start) and graph.in_bounds(goal)):
+      raise ValueError("Either of the component is out of bounds")
+    self.__came_from, self.__cost_so_far = self.jump_point_search(graph, start, goal)
+    if goal in self.__came_from:
+      self.__a_star_path = self.reconstruct_path(self.__came_from, start, goal)
+
+  def heuristic(self, a, b):
+    return self.__heuristic(a, b)
+
+  def successors(self, graph, current, parent, goal):
+    """ Yields (next, cost) pairs, jump points when jumping or plain neighbors otherwise """
+    if not self.__jumping:
+      for next in graph.neighbors(current):
+        yield next, graph.cost(current, next)
+      return
+    (x, y) = current
+    for (dx, dy) in self.pruned_directions(graph, current, parent):
+      jump_point = self.jump(graph, x, y, dx, dy, goal)
+      if jump_point is not None:
+        steps = max(abs(jump_point[0] - x), abs(jump_point[1] - y))
+        step_cost = self.__diagonal_cost if dx and dy else self.__straight_cost
+        yield jump_point, steps * step_cost
+
+  def pruned_directions(self, graph, current, parent):
+    (x, y) = current
+    if parent is None:
+      return [(1, 0), (1, 1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, -1)]
+    dx = cmp(x, parent[0])
+    dy = cmp(y, parent[1])
+    walkable = self.walkable
+    if dx and dy:
+      directions = [(0, dy), (dx, 0), (dx, dy)]
+      if not walkable(graph, x - dx, y):
+        directions.append((-dx, dy))
+      if not walkable(graph, x, y - dy):
+        directions.append((dx, -dy))
+    elif dx:
+      directions = [(dx, 0)]
+      if not walkable(graph, x, y + 1):
+        directions.append((dx, 1))
+      if not walkable(graph, x, y - 1):
+        directions.append((dx, -1))
+    else:
+      directions = [(0, dy)]
+      if not walkable(graph, x + 1, y):
+        directions.append((1, dy))
+      if not walkable(graph, x - 1, y):
+        directions.append((-1, dy))
+    return directions
+
+  def jump(self, graph, x, y, dx, dy, goal):
+    """ Walks from (x, y) along (dx, dy) and returns the first jump point met, None at a dead end """
+    walkable = self.walkable
+    while True:
+      x += dx
+      y += dy
+      if not walkable(graph, x, y):
+        return None
+      if (x, y) == goal:
+        return (x, y)
+      if dx and dy:
+        if (not walkable(graph, x - dx, y) and walkable(graph, x - dx, y + dy)) or \
+           (not walkable(graph, x, y - dy) and walkable(graph, x + dx, y - dy)):
+          return (x, y)
+        # A diagonal step is a jump point as soon as one of its straight scans finds one
+        if self.jump(graph, x, y, dx, 0, goal) is not None or self.jump(graph, x, y, 0, dy, goal) is not None:
+          return (x, y)
+      elif dx:
+        if (not walkable(graph, x, y + 1) and walkable(graph, x + dx, y + 1)) or \
+           (not walkable(graph, x, y - 1) and walkable(graph, x + dx, y - 1)):
+          return (x, y)
+      else:
+        if (not walkable(graph, x + 1, y) and walkable(graph, x + 1, y + dy)) or \
+           (not walkable(graph, x - 1, y) and walkable(graph, x - 1, y + dy)):
+          return (x, y)
+
+  def walkable(self, graph, x, y):
+    return 0 <= x < graph.width and 0 <= y < graph.height and not graph.cells[y * graph.width + x]
+
+  def jump_point_search(self, graph, start, goal):
+    frontier = PriorityQueue()
+    frontier.put(start, 0)
+    self.__heap_pushes += 1
+    came_from = {start: None}
+    cost_so_far = {start: 0}
+    closed = set()
+
+    while not frontier.empty():
+      current = frontier.get()
+      if current in closed:
+        continue
+      closed.add(current)
+      self.__nodes_expanded += 1
+
+      if current == goal:
+        break
+
+      for next, step_cost in self.successors(graph, current, came_from[current], goal):
+        new_cost = cost_so_far[current] + step_cost
+        if next not in cost_so_far or new_cost < cost_so_far[next]:
+          cost_so_far[next] = new_cost
+          frontier.put(next, new_cost + self.heuristic(next, goal))
+          self.__heap_pushes += 1
+          came_from[next] = current
+
+    return came_from, cost_so_far
+
+  def reconstruct_path(self, came_from, start, goal):
+    # Jump points are joined by straight or diagonal lines, so every cell in between is filled in
+    jump_points = [goal]
+    while jump_points[-1] != start:
+      jump_points.append(came_from[jump_points[-1]])
+    jump_points.reverse()
+    path = [start]
+    for (x2, y2) in jump_points[1:]:
+      (x, y) = path[-1]
+      (dx, dy) = (cmp(x2, x), cmp(y2, y))
+      while (x, y) != (x2, y2):
+        (x, y) = (x + dx, y + dy)
+        path.append((x, y))
+    return path
+
+  def get_cost_so_far(self, id):
+    return self.__cost_so_far[id]
+
+  def get_a_star_path(self):
+    return list(self.__a_star_path)
+
+  def get_came_from(self):
+    return self.__came_from
+
+  def get_nodes_expanded(self):
+    return self.__nodes_expanded
+
+  def get_heap_pushes(self):
+    return self.__heap_pushes
+
+  def is_jumping(self):
+    """ False when the graph's weights forced the search back to a plain A * expansion """
+    return self.__jumping
+
+def uniform_step_costs(graph):
+  """
+  Returns the (straight, diagonal) step costs of the graph when jump point search is exact on it,
+  (None, None) when passable cells carry different weights or diagonals are priced out of range
+  """
+  weight = graph.uniform_cell_weight()
+  if weight is None:
+    return None, None
+  straight_cost = graph.cost((0, 0), (1, 0)) - graph.default_cost((0, 0), (1, 0)) + weight
+  diagonal_cost = graph.cost((0, 0), (1, 1)) - graph.default_cost((0, 0), (1, 1)) + weight
+  if not straight_cost <= diagonal_cost <= 2 * straight_cost:
+    return None, None
+  return straight_cost, diagonal_cost
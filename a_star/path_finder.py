@@ -11,6 +11,8 @@ The algorithm also takes care of the environmental object like trees, other comp
 """
 
 from structs import PriorityQueue
+from structs import IndexedPriorityQueue
+from heuristics import heuristic_for
 # TODO Either merge draw_grid utilities with SquareGrid data structure or put it in util module
 from structs import draw_grid
 import logging
@@ -19,24 +21,36 @@ TEST_PROGRAM_ACTIVE = 1
 FUEL_COST_PER_BLOCK = 1
 
 class A_Star_Search:
-  __came_from = {}
-  __cost_so_far = {}
-  __a_star_path = []
-  __compA = None
-  __compB = None
-  def __init__(self, graph, compA, compB):
+  def __init__(self, graph, compA, compB, queue=PriorityQueue, draw=None, heuristic=None):
+    # queue is the frontier class, IndexedPriorityQueue trades stale entries for decrease-key
+    # draw prints the grid with the path, defaults to TEST_PROGRAM_ACTIVE
+    # heuristic defaults to the graph's one, octile unless another one was registered
+    self.__heuristic = heuristic or heuristic_for(graph)
+    self.__came_from = {}
+    self.__cost_so_far = {}
+    self.__a_star_path = []
+    self.__queue = queue
+    self.__frontier = None
+    self.__nodes_expanded = 0
     self.__compA = compA
     self.__compB = compB
     start = self.__compA.getLocation()
     goal = self.__compB.getLocation()
     if not (graph.in_bounds(start) and graph.in_bounds(goal)):
-      logger.error("Either of the component is out of bounds")
+      logging.error("Either of the component is out of bounds")
     else:
       self.__came_from, self.__cost_so_far = self.a_star_search(graph, start, goal)
       self.__a_star_path = self.reconstruct_path(self.__came_from, start, goal)
-    if TEST_PROGRAM_ACTIVE:
-      print "Map grid with the path traced from Truck (T) to Dumpster (D) is shown as '@'"
-      draw_grid(graph, width=1, path=self.__a_star_path, start=start, goal=goal)
+      self.__a_star_path.reverse()
+    # Only grids can be drawn, a RoadNetwork has no width and height
+    if (TEST_PROGRAM_ACTIVE if draw is None else draw) and hasattr(graph, "width") and hasattr(graph, "height"):
+      self.render(graph)
+
+  def render(self, graph):
+    start = self.__compA.getLocation()
+    goal = self.__compB.getLocation()
+    print "Map grid with the path traced from Truck (T) to Dumpster (D) is shown as '@'"
+    draw_grid(graph, width=1, path=self.__a_star_path, start=start, goal=goal)
 
   def reconstruct_path(self, came_from, start, goal):
     current = goal
@@ -56,7 +70,10 @@ class A_Star_Search:
     return self.distance_estimate(a, b) * FUEL_COST_PER_BLOCK
 
   def a_star_search(self, graph, start, goal):
-    frontier = PriorityQueue()
+    heuristic = self.__heuristic
+    heuristic.refresh()
+    frontier = self.__queue()
+    self.__frontier = frontier
     frontier.put(start, 0)
     came_from = {}
     cost_so_far = {}
@@ -70,12 +87,13 @@ class A_Star_Search:
 
       if current == goal:
         break
+      self.__nodes_expanded += 1
 
       for next in graph.neighbors(current):
-        new_cost = cost_so_far[current] + graph.default_cost(current, next) + graph.distance_cost(current, next) + graph.fuel_cost(current, next)
+        new_cost = cost_so_far[current] + graph.cost(current, next)
         if next not in cost_so_far or new_cost < cost_so_far[next]:
           cost_so_far[next] = new_cost
-          priority = new_cost + self.distance_estimate(goal, next) + self.fuel_estimate(goal, next) # heuristics
+          priority = new_cost + heuristic(next, goal)
           frontier.put(next, priority)
           came_from[next] = current
 
@@ -85,9 +103,87 @@ class A_Star_Search:
     return self.__cost_so_far[id]
 
   def get_a_star_path(self):
-    reversed_path = self.__a_star_path
-    reversed_path.reverse()
-    return reversed_path
+    return list(self.__a_star_path)
 
   def get_came_from(self):
     return self.__came_from
+
+  def get_nodes_expanded(self):
+    return self.__nodes_expanded
+
+  def get_queue_stats(self):
+    """ Returns the push/pop/stale pop/decrease-key counters and peak size of the frontier """
+    if self.__frontier is None:
+      return {}
+    return self.__frontier.stats()
+
+class One_To_Many_Search:
+  """
+  Expands once from a single component (e.g. the overflowing dumpster) and finds the true
+  path cost from every candidate location (e.g. idle trucks) to it, instead of running one
+  A * search per candidate. The search runs backwards over the graph, so costs and paths
+  are those of candidate -> component routes, and it stops as soon as every reachable
+  candidate has been settled.
+  """
+  def __init__(self, graph, comp, candidates):
+    self.__graph = graph
+    self.__goal = comp.getLocation()
+    self.__candidates = set(candidates)
+    self.__next_step = {}
+    self.__cost_so_far = {}
+    self.__nodes_expanded = 0
+    if not graph.in_bounds(self.__goal):
+      logging.error("The component to search from is out of bounds")
+    else:
+      self.__next_step, self.__cost_so_far = self.reverse_search(graph, self.__goal, self.__candidates)
+
+  def reverse_search(self, graph, goal, candidates):
+    frontier = PriorityQueue()
+    frontier.put(goal, 0)
+    next_step = {goal: None}
+    cost_so_far = {goal: 0}
+    settled = set()
+    remaining = set(candidate for candidate in candidates if graph.in_bounds(candidate))
+
+    while not frontier.empty() and remaining:
+      current = frontier.get()
+      if current in settled:
+        continue
+      settled.add(current)
+      remaining.discard(current)
+      self.__nodes_expanded += 1
+      # Nothing can step into a wall, so a wall is only reached when a candidate stands on it. A walled
+      # goal is reached from nowhere else either, as in the forward searches
+      if not graph.passable(current):
+        continue
+
+      for previous in graph.predecessors(current):
+        if previous in settled:
+          continue
+        new_cost = cost_so_far[current] + graph.cost(previous, current)
+        if previous not in cost_so_far or new_cost < cost_so_far[previous]:
+          cost_so_far[previous] = new_cost
+          frontier.put(previous, new_cost)
+          next_step[previous] = current
+
+    return next_step, dict((candidate, cost_so_far[candidate]) for candidate in candidates if candidate in settled)
+
+  def get_cost(self, candidate):
+    """ Returns the path cost from candidate to the component, None if unreachable """
+    return self.__cost_so_far.get(candidate)
+
+  def get_costs(self):
+    """ Returns a dict of every reachable candidate location to its path cost """
+    return dict(self.__cost_so_far)
+
+  def get_path(self, candidate):
+    """ Returns the path from candidate to the component, both included, None if unreachable """
+    if candidate not in self.__cost_so_far:
+      return None
+    path = [candidate]
+    while self.__next_step[path[-1]] is not None:
+      path.append(self.__next_step[path[-1]])
+    return path
+
+  def get_nodes_expanded(self):
+    return self.__nodes_expanded
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Bounded LRU cache of A * routes placed in front of the path finder
+
+Trucks keep travelling between the same dumpsters and the same landfill, so the central
+server asks for the same (start, goal) routes over and over again. Routes are cached per
+(start, goal, map version, search engine); any wall or weight change bumps graph.version,
+which drops every cached route the next time the cache is used.
+
+Changes made through Map.apply_patch are cheaper: subscribed with map.subscribe(cache.apply_change, synchronous=True),
+the cache only drops the routes the patch could have changed and keeps the others.
+"""
+
+from collections import OrderedDict
+import threading
+
+from engine import Buffered_A_Star_Search
+from batch import solve_route
+from heuristics import Octile_Heuristic
+
+DEFAULT_ROUTE_CACHE_SIZE = 256
+
+class RouteCache:
+  def __init__(self, graph, size=DEFAULT_ROUTE_CACHE_SIZE, engine=Buffered_A_Star_Search):
+    """
+    Create a new route cache for the given graph
+
+    :param graph: (GridWithWeights) The graph the routes are computed on
+    :param size: (int) Maximum number of routes kept in the cache
+    :param engine: Search class used on a miss, called as engine(graph, compA, compB)
+    """
+    if size < 1:
+      raise ValueError("Route cache size must be at least 1")
+    self.graph = graph
+    self.size = size
+    self.engine = engine
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+    self.__routes = OrderedDict()
+    self.__version = graph.version
+    self.__lock = threading.Lock()
+
+  def get_route(self, compA, compB, engine=None, found=None):
+    """
+    Returns the route from compA to compB as a (path, cost) tuple, searching only on a miss
+
+    :param compA: Component the route starts from (anything with getLocation)
+    :param compB: Component the route ends at (anything with getLocation)
+    :param engine: Search class to use for this query instead of the cache's default one
+    :param found: (path, cost) of this query already found another way, e.g. by a one-to-many
+                  search, stored on a miss instead of running engine
+    :return: (list, float) Path from start to goal, both included, and its cost
+    """
+    engine = engine or self.engine
+    key = (compA.getLocation(), compB.getLocation(), self.graph.version, engine)
+    with self.__lock:
+      self.__check_version()
+      if key in self.__routes:
+        self.hits += 1
+        (path, cost) = self.__routes.pop(key)
+        self.__routes[key] = (path, cost)
+        return list(path), cost
+      self.misses += 1
+
+    if found is not None:
+      (path, cost) = found
+    else:
+      a_star_instance = engine(self.graph, compA, compB)
+      path = a_star_instance.get_a_star_path()
+      cost = a_star_instance.get_cost_so_far(compB.getLocation())
+
+    with self.__lock:
+      if key[2] == self.graph.version:
+        self.__routes[key] = (tuple(path), cost)
+        while len(self.__routes) > self.size:
+          self.__routes.popitem(last=False)
+          self.evictions += 1
+    return list(path), cost
+
+  def get_routes(self, pairs, planner=None):
+    """
+    Batch version of get_route for location pairs, the misses are searched together
+
+    :param pairs: Iterable of ((x, y), (x, y)) location pairs
+    :param planner: (BatchPlanner) Solves the misses across its process pool, whose engine is used,
+                    without it the misses are searched one by one with the cache's engine
+    :return: (list) One (path, cost) tuple per pair, (None, None) for unreachable goals
+    """
+    pairs = [(tuple(start), tuple(goal)) for (start, goal) in pairs]
+    engine = planner.engine if planner is not None else self.engine
+    version = self.graph.version
+    routes = [None] * len(pairs)
+    missing = []
+    with self.__lock:
+      self.__check_version()
+      for (index, (start, goal)) in enumerate(pairs):
+        key = (start, goal, version, engine)
+        if key in self.__routes:
+          self.hits += 1
+          route = self.__routes.pop(key)
+          self.__routes[key] = route
+          routes[index] = (list(route[0]), route[1])
+        else:
+          self.misses += 1
+          missing.append(index)
+
+    if planner is not None:
+      solved = planner.plan([pairs[index] for index in missing])
+    else:
+      solved = [solve_route(self.graph, engine, pairs[index][0], pairs[index][1]) for index in missing]
+
+    with self.__lock:
+      for (index, (path, cost)) in zip(missing, solved):
+        routes[index] = (path, cost)
+        if path is not None and version == self.graph.version:
+          self.__routes[(pairs[index][0], pairs[index][1], version, engine)] = (tuple(path), cost)
+      while len(self.__routes) > self.size:
+        self.__routes.popitem(last=False)
+        self.evictions += 1
+    return routes
+
+  def invalidate(self):
+    """ Drops every cached route """
+    with self.__lock:
+      self.invalidations += len(self.__routes)
+      self.__routes.clear()
+      self.__version = self.graph.version
+
+  def apply_change(self, change):
+    """
+    Drops the routes a map patch could have changed, meant to be subscribed to the Map
+
+    A route is dropped when it crosses a changed cell, its cost changed or it's blocked now, or when a
+    cell got cheaper close enough to it that a detour through it may beat the route. Routes through
+    cells that only got more expensive elsewhere stay optimal and are kept.
+
+    :param change: (MapChange) Change made by Map.apply_patch
+    """
+    with self.__lock:
+      if self.__version != change.from_version or self.graph.version != change.version:
+        # The graph changed in other ways too, nothing can be kept
+        self.__check_version()
+        return
+      cells = set(change.cells)
+      bounds = change.improved_bounds()
+      if bounds is not None:
+        heuristic = Octile_Heuristic(self.graph)
+      routes = OrderedDict()
+      for ((start, goal, version, engine), (path, cost)) in self.__routes.items():
+        if not cells.isdisjoint(path) or (bounds is not None and detour_bound(heuristic, start, goal, bounds) < cost):
+          self.invalidations += 1
+        else:
+          routes[(start, goal, change.version, engine)] = (path, cost)
+      self.__routes = routes
+      self.__version = change.version
+
+  def stats(self):
+    """ Returns the cache counters as a dict, meant for logging """
+    return {"size": len(self.__routes), "capacity": self.size, "hits": self.hits,
+            "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations}
+
+  def __check_version(self):
+    # Called with the lock held, stale routes are useless once the map changed
+    if self.__version != self.graph.version:
+      self.invalidations += len(self.__routes)
+      self.__routes.clear()
+      self.__version = self.graph.version
+
+  def __len__(self):
+    return len(self.__routes)
+
+def detour_bound(heuristic, start, goal, bounds):
+  """ Lower bound of the cost of a route from start to goal through any cell of the box bounds """
+  ((x0, y0), (x1, y1)) = bounds
+  closest_to_start = (min(max(start[0], x0), x1), min(max(start[1], y0), y1))
+  closest_to_goal = (min(max(goal[0], x0), x1), min(max(goal[1], y0), y1))
+  return heuristic(start, closest_to_start) + heuristic(closest_to_goal, goal)
@@ -34,16 +34,170 @@ def draw_grid(graph, width=2, **style):
     print ""
 
 class PriorityQueue:
+  """
+  Plain heapq frontier, an item whose priority improves is pushed again and its older
+  entries are popped later as stale ones. Counts pushes, pops and stale pops, a pop is
+  stale when the item was already popped since it was last pushed.
+  """
   def __init__(self):
     self.elements = []
+    self.pending = set()
+    self.pushes = 0
+    self.pops = 0
+    self.stale_pops = 0
+    self.max_size = 0
 
   def empty(self):
     return len(self.elements) == 0
 
+  def __len__(self):
+    return len(self.elements)
+
   def put(self, item, priority):
     heapq.heappush(self.elements, (priority, item))
+    self.pending.add(item)
+    self.pushes += 1
+    if len(self.elements) > self.max_size:
+      self.max_size = len(self.elements)
 
   def get(self):
-    return heapq.heappop(self.elements)[1]
+    item = heapq.heappop(self.elements)[1]
+    self.pops += 1
+    if item in self.pending:
+      self.pending.remove(item)
+    else:
+      self.stale_pops += 1
+    return item
+
+  def peek(self):
+    return self.elements[0][1]
+
+  def min_priority(self):
+    return self.elements[0][0]
+
+  def stats(self):
+    return {'pushes': self.pushes, 'pops': self.pops, 'stale_pops': self.stale_pops,
+            'decrease_keys': 0, 'max_size': self.max_size}
+
+class IndexedPriorityQueue:
+  """
+  Binary heap that holds every item at most once. position maps each queued item to its
+  index in the heap, so putting an item that is already queued changes its priority in
+  place (decrease-key) instead of leaving a stale duplicate behind.
+  Drop-in replacement of PriorityQueue with the same counters, stale_pops always stays 0.
+  """
+  def __init__(self):
+    self.elements = []
+    self.position = {}
+    self.pushes = 0
+    self.pops = 0
+    self.stale_pops = 0
+    self.decrease_keys = 0
+    self.max_size = 0
+
+  def empty(self):
+    return len(self.elements) == 0
+
+  def __len__(self):
+    return len(self.elements)
+
+  def __contains__(self, item):
+    return item in self.position
+
+  def priority(self, item):
+    return self.elements[self.position[item]][0]
+
+  def put(self, item, priority):
+    """ Queues item, or moves it to its new priority if it's already queued """
+    index = self.position.get(item)
+    if index is None:
+      self.elements.append((priority, item))
+      self.position[item] = len(self.elements) - 1
+      self.pushes += 1
+      if len(self.elements) > self.max_size:
+        self.max_size = len(self.elements)
+      self.sift_up(len(self.elements) - 1)
+    else:
+      old_priority = self.elements[index][0]
+      self.elements[index] = (priority, item)
+      if priority < old_priority:
+        self.decrease_keys += 1
+        self.sift_up(index)
+      else:
+        self.sift_down(index)
+
+  def get(self):
+    elements = self.elements
+    last = elements.pop()
+    self.pops += 1
+    if not elements:
+      del self.position[last[1]]
+      return last[1]
+    (priority, item) = elements[0]
+    del self.position[item]
+    elements[0] = last
+    self.position[last[1]] = 0
+    self.sift_down(0)
+    return item
+
+  def remove(self, item):
+    """ Takes item out of the queue without popping it """
+    index = self.position.pop(item)
+    last = self.elements.pop()
+    if index < len(self.elements):
+      self.elements[index] = last
+      self.position[last[1]] = index
+      self.sift_down(index)
+      self.sift_up(self.position[last[1]])
+
+  def peek(self):
+    return self.elements[0][1]
+
+  def min_priority(self):
+    return self.elements[0][0]
+
+  def stats(self):
+    return {'pushes': self.pushes, 'pops': self.pops, 'stale_pops': self.stale_pops,
+            'decrease_keys': self.decrease_keys, 'max_size': self.max_size}
 
+  def sift_up(self, index):
+    elements = self.elements
+    position = self.position
+    entry = elements[index]
+    while index > 0:
+      parent = (index - 1) >> 1
+      if entry < elements[parent]:
+        elements[index] = elements[parent]
+        position[elements[index][1]] = index
+        index = parent
+      else:
+        break
+    elements[index] = entry
+    position[entry[1]] = index
 
+  def sift_down(self, index):
+    # Walks the smaller child up to a leaf, then sifts the entry back up (as heapq does),
+    # which takes fewer comparisons as entries moved to the root usually belong near the bottom
+    elements = self.elements
+    position = self.position
+    size = len(elements)
+    start = index
+    entry = elements[index]
+    child = 2 * index + 1
+    while child < size:
+      if child + 1 < size and not elements[child] < elements[child + 1]:
+        child += 1
+      elements[index] = elements[child]
+      position[elements[index][1]] = index
+      index = child
+      child = 2 * index + 1
+    while index > start:
+      parent = (index - 1) >> 1
+      if entry < elements[parent]:
+        elements[index] = elements[parent]
+        position[elements[index][1]] = index
+        index = parent
+      else:
+        break
+    elements[index] = entry
+    position[entry[1]] = index
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Checks that BatchQueue solves a lone request right away and gathers the requests submitted
+# while a batch is being solved into the next batch
+
+from a_star.batch import BatchQueue
+import threading
+import time
+
+SOLVE_SECONDS = 0.3
+
+solved_batches = []
+
+def slow_solve(requests):
+    solved_batches.append(list(requests))
+    time.sleep(SOLVE_SECONDS)
+    return [request * 2 for request in requests]
+
+def submit_all(queue, requests, results):
+    threads = []
+    for request in requests:
+        thread = threading.Thread(target=lambda request=request: results.append((request, queue.submit(request))))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    return threads
+
+# A request submitted while nothing else is pending doesn't wait for a batch to fill up
+queue = BatchQueue(lambda requests: [request * 2 for request in requests], max_wait=2.0)
+started = time.time()
+assert queue.submit(21) == 42
+latency = time.time() - started
+print "Single request solved in %.3fs" % latency
+assert latency < 0.1, latency
+
+# The requests submitted while the first one is being solved are solved together as one batch
+queue = BatchQueue(slow_solve, max_wait=2.0)
+results = []
+for thread in submit_all(queue, range(6), results):
+    thread.join()
+print "Batches solved:", solved_batches, queue.stats()
+assert solved_batches == [[0], [1, 2, 3, 4, 5]], solved_batches
+assert sorted(results) == [(request, request * 2) for request in range(6)], results
+assert queue.stats()["longest_queued"] < SOLVE_SECONDS + 0.1, queue.stats()
+
+# A batch doesn't wait for the one being solved longer than max_wait
+del solved_batches[:]
+queue = BatchQueue(slow_solve, max_wait=0.05)
+results = []
+threads = submit_all(queue, range(2), results)
+time.sleep(0.15)
+print "Batches started within max_wait:", solved_batches
+assert solved_batches == [[0], [1]], solved_batches
+for thread in threads:
+    thread.join()
+
+# Nor once max_size requests joined it
+del solved_batches[:]
+queue = BatchQueue(slow_solve, max_wait=2.0, max_size=3)
+results = []
+threads = submit_all(queue, range(4), results)
+time.sleep(0.05)
+print "Batches started at max_size:", solved_batches
+assert solved_batches == [[0], [1, 2, 3]], solved_batches
+for thread in threads:
+    thread.join()
+assert sorted(results) == [(request, request * 2) for request in range(4)], results
+
+print "BatchQueue checks passed"
@@ -17,6 +17,8 @@ import os
 import logging
 import threading
 import time
+from collections import OrderedDict
+from collections import namedtuple
 
 # Components in the system
 from util.component import Map
@@ -30,6 +32,13 @@ from util.component import TruckState
 from util.component import DumpsterState
 from util.component import component_type
 
+# Secondary indexes of the state
+from util.component import TRUCKS
+from util.component import DUMPSTERS
+from util.component import IDLE_TRUCKS
+from util.component import is_idle_truck
+from util.component import ABSENT
+
 # Object hook for decoding enumeration class types
 from util.component import as_enum
 from util.component import EnumEncoder
@@ -42,8 +51,55 @@ from util.grid_structs import string_grid
 
 from util.grid_structs import FUEL_COST_PER_BLOCK
 
+# Compact route encoding shared with the trucks
+from util.path_codec import encode_path
+from util.path_codec import path_from_message
+from util.path_codec import ROUTE_KEY
+from util.traffic import attach_traffic
+from util.map_patch import MapPatch
+from util.map_patch import MAP_PATCH_TYPE
+from util.spatial_index import SpatialIndex
+
 # A * search algorithm
-from a_star.path_finder import A_Star_Search
+from a_star.engine import Buffered_A_Star_Search
+from a_star.path_finder import One_To_Many_Search
+from a_star.route_cache import RouteCache
+from a_star.route_cache import DEFAULT_ROUTE_CACHE_SIZE
+from a_star.flow_field import DistanceField
+from a_star.jump_point import Jump_Point_Search
+from a_star.bidirectional import Bidirectional_A_Star_Search
+from a_star.hierarchical import Hierarchical_Search
+from a_star.hierarchical import update_hierarchy
+from a_star.incremental import Incremental_Planner
+from a_star.batch import Endpoint
+from a_star.batch import BatchPlanner
+from a_star.batch import BatchQueue
+from a_star.cooperative import Cooperative_Planner
+from a_star.cooperative import Reservation_Table
+from a_star.heuristics import Octile_Heuristic
+from a_star.heuristics import Landmark_Heuristic
+from a_star.heuristics import Manhattan_Heuristic
+from a_star.heuristics import use_heuristic
+
+# Search engines that can be picked on the command line
+SEARCH_ENGINES = {"a_star": Buffered_A_Star_Search, "jump_point": Jump_Point_Search, "bidirectional": Bidirectional_A_Star_Search,
+                  "hierarchical": Hierarchical_Search}
+
+# Heuristics that can be picked on the command line, landmarks are persisted per map
+SEARCH_HEURISTICS = {"octile": Octile_Heuristic, "landmarks": Landmark_Heuristic, "manhattan": Manhattan_Heuristic}
+
+# Idle trucks handed to the one-to-many search of a dispatch, the closest ones first
+DEFAULT_DISPATCH_CANDIDATES = 8
+
+# Trucks drive one cell per status update, every 2 seconds, the tick of the cooperative planner
+TRUCK_STEP_SECONDS = 2
+
+# Hours of the day whose planners are kept besides the grid's own: the current hour, and the
+# previous one for the dispatches that started just before the hour turned
+KEPT_HOUR_PLANNERS = 2
+
+# Planners of a graph, see route_planners_for, batch_planners maps a search engine to its BatchPlanner
+RoutePlanners = namedtuple("RoutePlanners", ["route_cache", "landfill_field", "cooperative_planner", "batch_planners"])
 
 # Web Server
 from www import web_server
@@ -85,11 +141,9 @@ def getJSONTrucks ():
   """
   JSONTrucks = []
   current_state = environment_current_state.getCurrentState()
-  all_component_names = current_state.keys()
-  for component in all_component_names:
-    if current_state[component]["type"] == component_type.Truck:
-      Truck_dict = dict([('name', component), ('location', current_state[component]['location']), ('status', current_state[component]['status']), ('fuel_level', current_state[component]['fuel_level']), ('trash_level', current_state[component]['trash_level'])])
-      JSONTrucks.append(Truck_dict)
+  for component in current_state.names(TRUCKS):
+    Truck_dict = dict([('name', component), ('location', current_state[component]['location']), ('status', current_state[component]['status']), ('fuel_level', current_state[component]['fuel_level']), ('trash_level', current_state[component]['trash_level'])])
+    JSONTrucks.append(Truck_dict)
 
   return json.dumps(JSONTrucks, cls=EnumEncoder)
 
@@ -99,11 +153,9 @@ def getJSONDumpsters ():
   """
   JSONDumpsters = []
   current_state = environment_current_state.getCurrentState()
-  all_component_names = current_state.keys()
-  for component in all_component_names:
-    if current_state[component]["type"] == component_type.Dumpster:
-      Dumpster_dict = dict([('name', component), ('location', current_state[component]['location']), ('trash_level', current_state[component]['trash_level'])])
-      JSONDumpsters.append(Dumpster_dict)
+  for component in current_state.names(DUMPSTERS):
+    Dumpster_dict = dict([('name', component), ('location', current_state[component]['location']), ('trash_level', current_state[component]['trash_level'])])
+    JSONDumpsters.append(Dumpster_dict)
 
   return json.dumps(JSONDumpsters)
 
@@ -137,103 +189,382 @@ def manhattan_distance(start_loc, end_loc):
   (x2, y2) = end_loc
   return abs(pow(x1, 1) - pow(x2, 1)) + abs(pow(y1, 1) - pow(y2, 1))
 
+def select_search_engine(start_loc, end_loc):
+  """
+  Picks the search engine for a route, long routes go to the bidirectional search
+
+  :param start_loc: (tuple) (x, y) location the route starts from
+  :param end_loc: (tuple) (x, y) location the route ends at
+  :return: The search class to run the query with
+  """
+  if long_route_distance > 0 and manhattan_distance(start_loc, end_loc) >= long_route_distance:
+    return Bidirectional_A_Star_Search
+  return SEARCH_ENGINES[search_engine]
+
+def dispatch_route(route_cache, nearest_trucks_search, truck_loc, dumpster):
+  """
+  Returns the (path, cost) of a truck to a dumpster through the route cache and the selected search engine.
+  The one-to-many search that ranked the trucks is exact, so with the default engine its route is
+  stored in the cache on a miss instead of searching again. The legs of the other engines are
+  searched along with the other legs submitted while a batch was being solved, see solve_dispatch_legs.
+
+  :return: (list, float) The route, (None, None) if the engine finds none
+  """
+  # Long legs at or above --long_route_distance go to the bidirectional search
+  engine = select_search_engine(truck_loc, dumpster.getLocation())
+  try:
+    if engine is Buffered_A_Star_Search:
+      found = (nearest_trucks_search.get_path(truck_loc), nearest_trucks_search.get_cost(truck_loc))
+      route = route_cache.get_route(Endpoint(truck_loc), dumpster, engine=engine, found=found)
+    else:
+      route = dispatch_batch.submit((route_cache, engine, truck_loc, dumpster.getLocation()))
+  except (KeyError, ValueError):
+    route = (None, None)
+  if route[0] is None:
+    logging.warning("The " + engine.__name__ + " found no route from " + str(truck_loc) + " to " + dumpster.getName())
+    return None, None
+  logging.debug("Route cache: " + str(route_cache.stats()))
+  return route
+
+def solve_dispatch_legs(requests):
+  """
+  Solves a batch of the dispatch legs submitted to dispatch_batch, those of the same graph and engine
+  go through the route cache as one batch, whose misses the engine's BatchPlanner spreads over its
+  worker processes
+
+  :param requests: List of (RouteCache, engine, truck location, dumpster location)
+  :return: (list) One (path, cost) per request, (None, None) for unreachable dumpsters
+  """
+  groups = OrderedDict()
+  for (index, (route_cache, engine, start_loc, end_loc)) in enumerate(requests):
+    groups.setdefault((route_cache, engine), []).append(index)
+  routes = [None] * len(requests)
+  for ((route_cache, engine), indexes) in groups.items():
+    batch_planner = batch_planner_for(route_cache.graph, engine)
+    solved = route_cache.get_routes([requests[index][2:] for index in indexes], planner=batch_planner)
+    for (index, route) in zip(indexes, solved):
+      routes[index] = route
+    logging.debug("Batch planner: " + str(batch_planner.stats()))
+  return routes
+
+def current_graph():
+  """
+  Returns the map graph with the traffic of the current hour, routes are priced at their departure hour
+  """
+  return environment_map.graph.at_hour(time.localtime().tm_hour)
+
+def route_planners_for(graph):
+  """
+  Returns the route cache, landfill distance field, cooperative planner and batch planners of a
+  graph, created on first use so that each hour of the day keeps its own routes. The planners of
+  every hour share the reservations of the trucks on the road.
+
+  Only the KEPT_HOUR_PLANNERS hours used last keep their planners, along with the grid's which
+  are never dropped; an hour view that falls out also drops the weights it summed and stops the
+  worker processes of its batch planners.
+
+  :param graph: (GridWithWeights) The map graph, or its view at an hour of the day
+  :return: (RoutePlanners)
+  """
+  with route_planners_lock:
+    planners = route_planners.pop(graph, None)
+    if planners is None:
+      planners = RoutePlanners(RouteCache(graph, size=args.route_cache_size, engine=SEARCH_ENGINES[search_engine]),
+                               DistanceField(graph, map_landfill.getLocation()),
+                               Cooperative_Planner(graph, table=truck_reservations),
+                               {})
+      if graph is environment_map.graph:
+        # Map patches only drop the routes they touch, the views of an hour start over on any change.
+        # The routes are dropped before the patch is done, the field is rebuilt off the ingestion thread
+        environment_map.subscribe(planners.route_cache.apply_change, synchronous=True)
+        environment_map.subscribe(planners.landfill_field.apply_change)
+    # Most recently used last
+    route_planners[graph] = planners
+    hours = [view for view in route_planners if view is not environment_map.graph]
+    for view in hours[:-KEPT_HOUR_PLANNERS]:
+      for batch_planner in route_planners.pop(view).batch_planners.values():
+        batch_planner.close()
+      view.drop_weights()
+      logging.debug("Dropped the planners of hour " + str(view.hour))
+    return planners
+
+def batch_planner_for(graph, engine):
+  """ Returns the BatchPlanner running engine on graph, kept with the other planners of the graph """
+  planners = route_planners_for(graph)
+  with route_planners_lock:
+    if engine not in planners.batch_planners:
+      planners.batch_planners[engine] = BatchPlanner(graph, processes=args.batch_processes, engine=engine)
+    return planners.batch_planners[engine]
+
+def current_tick():
+  return int(time.time() // TRUCK_STEP_SECONDS)
+
+def plan_cooperative_route(graph, truck_name, start_loc, end_loc, path):
+  """
+  Replaces a truck's route by one that keeps clear of the routes of the other trucks on the road,
+  when cooperative routing is on
+
+  :param path: (list) Route planned for the truck alone, kept if no conflict free route is found
+  :return: (list) The route to send to the truck
+  """
+  if not args.cooperative:
+    return path
+  # The trucks dispatched while a batch is being planned are planned together next, see plan_cooperative_batch
+  started = time.time()
+  cooperative_path = cooperative_batch.submit((graph, truck_name, tuple(start_loc), tuple(end_loc)))
+  logging.info("Conflict free route of " + truck_name + " queued and planned in " + ("%.3f" % (time.time() - started)) +
+               "s, cooperative batches: " + str(cooperative_batch.stats()))
+  if cooperative_path is None:
+    logging.warning("No conflict free route for " + truck_name + ", sending the one planned for it alone")
+    return path
+  return cooperative_path
+
+def plan_cooperative_batch(requests):
+  """
+  Plans a batch of the routes submitted to cooperative_batch, those of the same graph as one
+  Cooperative_Planner batch in the order they were submitted. A truck that gets stuck behind
+  the others is given the first pick and the batch is planned again.
+
+  :param requests: List of (graph, truck name, start location, end location)
+  :return: (list) One route per request, None for the trucks left without a conflict free route
+  """
+  tick = current_tick()
+  truck_reservations.prune(tick)
+  groups = OrderedDict()
+  for (graph, truck_name, start_loc, end_loc) in requests:
+    groups.setdefault(graph, []).append((truck_name, start_loc, end_loc))
+  routes = {}
+  for (graph, trucks) in groups.items():
+    cooperative_planner = route_planners_for(graph).cooperative_planner
+    routes.update(cooperative_planner.plan(trucks, start_tick=tick))
+    logging.debug("Cooperative planner: " + str(cooperative_planner.stats()))
+  return [routes[truck_name] for (graph, truck_name, start_loc, end_loc) in requests]
+
+def send_route(truck_name, path):
+  """
+  Publishes a new route to a truck that is already on its way
+  """
+  data = json.dumps({"status": TruckState.BUSY, ROUTE_KEY: encode_path(path)}, separators=(',', ':'), sort_keys=True, cls=EnumEncoder)
+  publishing_message_broker = pika.BlockingConnection(pika_parameters)
+  publishing_channel = publishing_message_broker.channel()
+  publishing_channel.exchange_declare(exchange='Truck_exchange', type='direct')
+  publishing_channel.basic_publish(exchange="Truck_exchange", routing_key=truck_name, body=data)
+  publishing_channel.close()
+  publishing_message_broker.close()
+
+def on_map_change(change):
+  """
+  Subscriber of the map's patches: updates the hierarchy and repairs the routes of the trucks on the road
+
+  Trucks whose route crosses a patched cell are handed to the D* Lite planner, which from then on
+  repairs their route after every patch instead of searching it again from scratch.
+
+  :param change: (MapChange) Change made by Map.apply_patch
+  """
+  logging.info("Map patched to epoch " + str(change.epoch) + ", " + str(len(change.cells)) + " cells changed")
+  update_hierarchy(environment_map.graph, change)
+  repaired = truck_replanner.apply_change(change)
+  cells = set(change.cells)
+  current_state = environment_current_state.getCurrentState()
+  for component_name in current_state.names(TRUCKS):
+    component = current_state[component_name]
+    if component.get("status") != TruckState.BUSY:
+      continue
+    route = [tuple(cell) for cell in component.get("a_star_path", [])]
+    if route and component_name not in repaired and not cells.isdisjoint(route):
+      location = component.location
+      # Priced like any other route, with the traffic of the hour it's repaired at
+      repaired[component_name] = truck_replanner.plan(component_name, Endpoint(location), Endpoint(route[-1]), graph=current_graph())
+  for (component_name, path) in repaired.items():
+    route = [tuple(cell) for cell in current_state.get(component_name, {}).get("a_star_path", [])]
+    if not path:
+      logging.warning(component_name + "'s goal can't be reached since the map was patched, keeping its route")
+    elif path != route:
+      logging.info("Sending " + component_name + " the route repaired after the map patch")
+      send_route(component_name, path)
+
+def route_fuel(path):
+  """ Fuel a truck burns driving a route, a block per cell after the first, waits included """
+  return FUEL_COST_PER_BLOCK * (len(path) - 1)
+
+def update_truck_reach(fuel_capacity):
+  """
+  Widens the dispatch search radius to the distance a truck with a full tank of fuel_capacity could
+  drive to a dumpster and back
+  """
+  global max_truck_reach
+  try:
+    reach = int(float(fuel_capacity) / (FUEL_COST_PER_BLOCK * 2))
+  except (TypeError, ValueError):
+    return
+  if reach > max_truck_reach:
+    max_truck_reach = reach
+
 def manage_overflowing_dumpster (overflowing_dumpster):
   """
   Worker thread to manage overflowing dumpster
 
   """
   logging.info(overflowing_dumpster.getName() + "'s Thread")
-  # check if the dumpster state is
-  if (environment_current_state.get(overflowing_dumpster.getName(), key="status") == DumpsterState.UNASSIGNED) and ("assigned_to" not in environment_current_state.get(overflowing_dumpster.getName())):
-      with state_variable_lock:
-          environment_current_state.update(overflowing_dumpster.getName(), "status", DumpsterState.ASSIGNED)
-      for component_name in environment_current_state.getCurrentState():
-          print component_name
-          if environment_current_state.type(component_name) == component_type.Truck:
-              if (environment_current_state.get(component_name, key="status") == TruckState.IDLE) and ("assigned_to" not in environment_current_state.get(component_name)):
-                  # Calculate the trash capacity - trash collected by truck so far and
-                  # see if that is greater current dumpster's trash
-                  current_truck_trash_level = environment_current_state.get(component_name, key="trash_level")
-                  current_truck_trash_capacity = environment_current_state.get(component_name, key="trash_capacity")
-                  current_truck_trash_collected = current_truck_trash_level * current_truck_trash_capacity
-                  overflowing_dumpster_trash_content = overflowing_dumpster.getTrashCollected()
-                  if (current_truck_trash_collected + overflowing_dumpster_trash_content) < current_truck_trash_capacity:
-                      # Calculate the fuel estimate for the round trip and see if the truck
-                      # has that much amount of fuel left to go for a drive
-                      current_truck_loc = environment_current_state.get(component_name, key="location")
-                      current_truck_fuel_level = environment_current_state.get(component_name, key="fuel_level")
-                      current_truck_fuel_capacity = environment_current_state.get(component_name, key="fuel_capacity")
-                      current_truck_fuel_left = current_truck_fuel_level/100.0 * current_truck_fuel_capacity
-                      overflowing_dumpster_loc = overflowing_dumpster.getLocation()
-                      estimated_distance = manhattan_distance(current_truck_loc, overflowing_dumpster_loc)
-                      # Assuming unit fuel consumed for unit distance
-                      # Also for round trip time, we consider 2 times the estimated distance
-                      estimated_fuel_consumed = FUEL_COST_PER_BLOCK * (estimated_distance * 2)
-                      if current_truck_fuel_left > estimated_fuel_consumed:
-                          with state_variable_lock:
-                              environment_current_state.update(overflowing_dumpster.getName(), "assigned_to", component_name)
-                              environment_current_state.update(component_name, "assigned_to", overflowing_dumpster.getName())                              
-                          # Create truck object
-                          logging.info("Creating " + component_name + " object to parse the information to the A * search")
-                          current_truck_selected = Truck(name=component_name, location={"x":current_truck_loc[0], "y": current_truck_loc[1]}, fuel_capacity=current_truck_fuel_capacity, fuel_level=current_truck_fuel_level, trash_capacity=current_truck_trash_capacity, trash_level=current_truck_trash_level, status=TruckState.BUSY)
-                          with state_variable_lock:
-                              environment_current_state.put(current_truck_selected)
-                          # Use A * search to get the route
-                          logging.info("Calculating " + component_name + " to " + overflowing_dumpster.getName() + " path")
-                          a_star_instance = A_Star_Search(environment_map.graph, current_truck_selected, overflowing_dumpster)
-                          a_star_path = a_star_instance.get_a_star_path()
-                          came_from = a_star_instance.get_came_from()
-                          path_information = {"status": TruckState.BUSY, "a_star_path": a_star_path}
-                          print path_information
-                          data = json.dumps(path_information, indent = 4, sort_keys=True,cls=EnumEncoder)
-                          # Send the route the desired routing key
-                          publishing_message_broker = pika.BlockingConnection(pika_parameters)
-                          publishing_channel = publishing_message_broker.channel()
-                          logging.info("After Message broker")
-                          publishing_channel.exchange_declare(exchange='Truck_exchange', type='direct')
-                          result = publishing_channel.queue_declare(exclusive=True)
-                          queue_name = result.method.queue
-                          publishing_channel.basic_publish(exchange = "Truck_exchange", routing_key=component_name, body=data)
-                          publishing_channel.close()
-                          publishing_message_broker.close()
-                          # print data
-                          logging.info("Calculated Path using A * search sent to the truck under consideration")
-                          break
+  # Claim the dumpster if it's still unassigned, only one thread handles a dumpster at a time
+  if environment_current_state.compare_and_set(overflowing_dumpster.getName(),
+                                               {"status": DumpsterState.UNASSIGNED, "assigned_to": ABSENT},
+                                               {"status": DumpsterState.ASSIGNED}):
+      # Gather the idle trucks that can still take this dumpster's trash
+      # The truck index holds the idle trucks only, it finds the closest ones whose fuel could
+      # last the round trip and that can take the trash
+      overflowing_dumpster_trash_content = overflowing_dumpster.getTrashCollected()
+      # Trucks of the batches looked at already, the next batch skips them
+      tried_trucks = set()
+      def can_take_dumpster(component_name, distance):
+          if component_name in tried_trucks:
+              return False
+          component = current_state.get(component_name)
+          if component is None or not is_idle_truck(component):
+              return False
+          # Calculate the trash capacity - trash collected by truck so far and
+          # see if that is greater current dumpster's trash
+          current_truck_trash_collected = component["trash_level"] * component["trash_capacity"]
+          if (current_truck_trash_collected + overflowing_dumpster_trash_content) >= component["trash_capacity"]:
+              return False
+          # No route is shorter than the distance, so trucks that can't drive it there and back are skipped
+          return component["fuel_level"]/100.0 * component["fuel_capacity"] > FUEL_COST_PER_BLOCK * distance * 2
+      # Batches of the closest trucks not tried yet are pulled from the index until one is assigned,
+      # or no truck within reach of a full tank is left
+      dispatch_graph = current_graph()
+      route_cache = route_planners_for(dispatch_graph).route_cache
+      assigned = False
+      while not assigned:
+          current_state = environment_current_state.getCurrentState()
+          nearest_trucks = truck_index.nearest(overflowing_dumpster.getLocation(), k=dispatch_candidates, radius=max_truck_reach, accept=can_take_dumpster)
+          if not nearest_trucks:
+              break
+          candidate_trucks = dict((component_name, truck_index.location(component_name)) for (distance, component_name) in nearest_trucks)
+          tried_trucks.update(candidate_trucks)
+          logging.debug("Truck index: " + str(truck_index.stats()))
+          # One search from the dumpster gives the true path cost of every candidate truck
+          nearest_trucks_search = One_To_Many_Search(dispatch_graph, overflowing_dumpster, candidate_trucks.values())
+          reachable_trucks = [component_name for component_name in candidate_trucks if nearest_trucks_search.get_cost(candidate_trucks[component_name]) is not None]
+          reachable_trucks.sort(key=lambda component_name: nearest_trucks_search.get_cost(candidate_trucks[component_name]))
+          logging.info(str(len(reachable_trucks)) + " of " + str(len(candidate_trucks)) + " candidate trucks can reach " + overflowing_dumpster.getName())
+          for component_name in reachable_trucks:
+              # Calculate the fuel needed for the round trip and see if the truck
+              # has that much amount of fuel left to go for a drive
+              current_truck_loc = candidate_trucks[component_name]
+              current_truck_fuel_level = environment_current_state.get(component_name, key="fuel_level")
+              current_truck_fuel_capacity = environment_current_state.get(component_name, key="fuel_capacity")
+              current_truck_fuel_left = current_truck_fuel_level/100.0 * current_truck_fuel_capacity
+              (a_star_path, a_star_cost) = dispatch_route(route_cache, nearest_trucks_search, current_truck_loc, overflowing_dumpster)
+              if a_star_path is None:
+                  continue
+              # Trucks burn unit fuel per block driven
+              # Also for round trip time, we consider 2 times the path length
+              estimated_fuel_consumed = route_fuel(a_star_path) * 2
+              if current_truck_fuel_left > estimated_fuel_consumed:
+                  # The truck may have been taken by another dumpster since the snapshot, so it's only
+                  # assigned, and marked busy, if it's still idle and unassigned
+                  if not environment_current_state.compare_and_set_all([
+                          (component_name, {"status": TruckState.IDLE, "assigned_to": ABSENT},
+                           {"status": TruckState.BUSY, "assigned_to": overflowing_dumpster.getName()}),
+                          (overflowing_dumpster.getName(), {"assigned_to": ABSENT}, {"assigned_to": component_name})]):
+                      logging.info(component_name + " was assigned elsewhere in the meantime, trying the next truck")
+                      continue
+                  cooperative_path = plan_cooperative_route(dispatch_graph, component_name, current_truck_loc, overflowing_dumpster.getLocation(), a_star_path)
+                  # Detours and waits around the other trucks burn fuel too, the route sent has to fit as well
+                  if current_truck_fuel_left <= route_fuel(cooperative_path) * 2:
+                      logging.info("The conflict free route of " + component_name + " needs more fuel than it has left, trying the next truck")
+                      truck_reservations.release(component_name)
+                      environment_current_state.compare_and_set_all([
+                          (component_name, {"status": TruckState.BUSY, "assigned_to": overflowing_dumpster.getName()},
+                           {"status": TruckState.IDLE, "assigned_to": ABSENT}),
+                          (overflowing_dumpster.getName(), {"assigned_to": component_name}, {"assigned_to": ABSENT})])
+                      continue
+                  a_star_path = cooperative_path
+                  logging.info(component_name + " to " + overflowing_dumpster.getName() + " path costs " + str(a_star_cost))
+                  path_information = {"status": TruckState.BUSY, ROUTE_KEY: encode_path(a_star_path)}
+                  print path_information
+                  data = json.dumps(path_information, separators=(',', ':'), sort_keys=True, cls=EnumEncoder)
+                  # Send the route the desired routing key
+                  publishing_message_broker = pika.BlockingConnection(pika_parameters)
+                  publishing_channel = publishing_message_broker.channel()
+                  logging.info("After Message broker")
+                  publishing_channel.exchange_declare(exchange='Truck_exchange', type='direct')
+                  result = publishing_channel.queue_declare(exclusive=True)
+                  queue_name = result.method.queue
+                  publishing_channel.basic_publish(exchange = "Truck_exchange", routing_key=component_name, body=data)
+                  publishing_channel.close()
+                  publishing_message_broker.close()
+                  # print data
+                  logging.info("Calculated Path using A * search sent to the truck under consideration")
+                  assigned = True
+                  break
+      if not assigned:
+          # No truck could be assigned, the next report of the dumpster tries again
+          environment_current_state.compare_and_set(overflowing_dumpster.getName(),
+                                                    {"status": DumpsterState.ASSIGNED, "assigned_to": ABSENT},
+                                                    {"status": DumpsterState.UNASSIGNED})
                           
-  elif environment_current_state.get(overflowing_dumpster.getName(), key="status") == DumpsterState.ASSIGNED and ("assigned_to" in environment_current_state.get(overflowing_dumpster.getName())):
-      truck_assigned = environment_current_state.get(overflowing_dumpster.getName(), key="assigned_to")
-      if environment_current_state.get(truck_assigned, key="status") == TruckState.BUSY:
-          if environment_current_state.get(truck_assigned, key="a_star_path") == []:
-              truck_assigned_loc = environment_current_state.get(truck_assigned, key="location")
-              truck_assigned_fuel_cap = environment_current_state.get(truck_assigned, key="fuel_capacity")
-              truck_assigned_fuel_lev = environment_current_state.get(truck_assigned, key="fuel_level")
-              truck_assigned_trash_cap = environment_current_state.get(truck_assigned, key="trash_capacity")
-              truck_assigned_trash_lev = environment_current_state.get(truck_assigned, key="trash_level")
-              truck_assigned_trash_collected = overflowing_dumpster.getTrashCollected() + truck_assigned_trash_cap * truck_assigned_trash_lev;
-              truck_assigned_trash_lev_new = truck_assigned_trash_collected/truck_assigned_trash_cap
-              current_truck_assigned = Truck(name=truck_assigned, location={"x": truck_assigned_loc[0], "y": truck_assigned_loc[1]}, fuel_capacity=truck_assigned_fuel_cap, fuel_level=truck_assigned_fuel_lev, trash_capacity=truck_assigned_trash_cap, trash_level=truck_assigned_trash_lev_new, status=TruckState.BUSY)
-              a_star_instance = A_Star_Search(environment_map.graph, current_truck_assigned, map_landfill)
-              a_star_path = a_star_instance.get_a_star_path()
-              came_from = a_star_instance.get_came_from()
-              path_information = {"status": TruckState.BUSY, "a_star_path": a_star_path}
-              print path_information
-              data = json.dumps(path_information, indent = 4, sort_keys=True,cls=EnumEncoder)
-              # Send the route the desired routing key
-              publishing_message_broker = pika.BlockingConnection(pika_parameters)
-              publishing_channel = publishing_message_broker.channel()
-              logging.info("After Message broker")
-              publishing_channel.exchange_declare(exchange='Truck_exchange', type='direct')
-              result = publishing_channel.queue_declare(exclusive=True)
-              queue_name = result.method.queue
-              time.sleep(5.0)
-              publishing_channel.basic_publish(exchange = "Truck_exchange", routing_key=truck_assigned, body=data)
-              with state_variable_lock:
-                  environment_current_state.remove(overflowing_dumpster.getName(), "assigned_to")
-                  environment_current_state.remove(truck_assigned, "assigned_to")
-                  environment_current_state.update(overflowing_dumpster.getName(), "status", DumpsterState.UNASSIGNED)
-              publishing_channel.close()
-              publishing_message_broker.close()
-              
+  else:
+      # The assigned truck reached the dumpster once its route ran out. Every report of the dumpster
+      # starts a thread, so the return trip is claimed first: only the thread that moves the
+      # dumpster from ASSIGNED to COLLECTING plans and sends it
+      current_state = environment_current_state.getCurrentState()
+      dumpster_record = current_state.get(overflowing_dumpster.getName())
+      truck_assigned = dumpster_record.get("assigned_to") if dumpster_record is not None else None
+      truck_record = current_state.get(truck_assigned) if truck_assigned is not None else None
+      if truck_record is None or truck_record.get("status") != TruckState.BUSY or truck_record.get("a_star_path") != []:
+          return
+      if not environment_current_state.compare_and_set_all([
+              (overflowing_dumpster.getName(), {"status": DumpsterState.ASSIGNED, "assigned_to": truck_assigned},
+               {"status": DumpsterState.COLLECTING}),
+              (truck_assigned, {"status": TruckState.BUSY, "assigned_to": overflowing_dumpster.getName(), "a_star_path": []}, {})]):
+          logging.info("The return trip of " + truck_assigned + " from " + overflowing_dumpster.getName() + " is handled already")
+          return
+      truck_assigned_loc = truck_record.location
+      truck_assigned_trash_cap = truck_record["trash_capacity"]
+      truck_assigned_trash_collected = overflowing_dumpster.getTrashCollected() + truck_assigned_trash_cap * truck_record["trash_level"]
+      current_truck_assigned = Truck(name=truck_assigned, location={"x": truck_assigned_loc[0], "y": truck_assigned_loc[1]}, fuel_capacity=truck_record["fuel_capacity"], fuel_level=truck_record["fuel_level"], trash_capacity=truck_assigned_trash_cap, trash_level=truck_assigned_trash_collected/truck_assigned_trash_cap, status=TruckState.BUSY)
+      # Return trips walk down the landfill's distance field, which covers every cell that
+      # can reach the landfill, so no search can do better when it has no route
+      return_graph = current_graph()
+      landfill_field = route_planners_for(return_graph).landfill_field
+      a_star_path = landfill_field.get_path(current_truck_assigned.getLocation())
+      if a_star_path is None:
+          logging.error(truck_assigned + " can't reach the landfill from " + str(truck_assigned_loc) + ", releasing it and " + overflowing_dumpster.getName())
+          environment_current_state.compare_and_set_all([
+              (overflowing_dumpster.getName(), {"assigned_to": truck_assigned},
+               {"assigned_to": ABSENT, "status": DumpsterState.UNASSIGNED}),
+              (truck_assigned, {"assigned_to": overflowing_dumpster.getName()}, {"assigned_to": ABSENT})])
+          return
+      cooperative_path = plan_cooperative_route(return_graph, truck_assigned, truck_assigned_loc, map_landfill.getLocation(), a_star_path)
+      # The detours and waits of the conflict free route burn fuel too, if they would leave the truck
+      # stranded it drives the route planned for it alone
+      if truck_record["fuel_level"]/100.0 * truck_record["fuel_capacity"] > route_fuel(cooperative_path):
+          a_star_path = cooperative_path
+      else:
+          logging.warning("The conflict free route of " + truck_assigned + " needs more fuel than it has left, sending the one planned for it alone")
+          truck_reservations.release(truck_assigned)
+      path_information = {"status": TruckState.BUSY, ROUTE_KEY: encode_path(a_star_path)}
+      print path_information
+      data = json.dumps(path_information, separators=(',', ':'), sort_keys=True, cls=EnumEncoder)
+      # Send the route the desired routing key
+      publishing_message_broker = pika.BlockingConnection(pika_parameters)
+      publishing_channel = publishing_message_broker.channel()
+      logging.info("After Message broker")
+      publishing_channel.exchange_declare(exchange='Truck_exchange', type='direct')
+      result = publishing_channel.queue_declare(exclusive=True)
+      queue_name = result.method.queue
+      time.sleep(5.0)
+      publishing_channel.basic_publish(exchange = "Truck_exchange", routing_key=truck_assigned, body=data)
+      # Release both at once, the claim kept the other threads of this dumpster away
+      if not environment_current_state.compare_and_set_all([
+              (overflowing_dumpster.getName(), {"status": DumpsterState.COLLECTING, "assigned_to": truck_assigned},
+               {"assigned_to": ABSENT, "status": DumpsterState.UNASSIGNED}),
+              (truck_assigned, {"assigned_to": overflowing_dumpster.getName()}, {"assigned_to": ABSENT})]):
+          logging.warning(overflowing_dumpster.getName() + " and " + truck_assigned + " were released by someone else")
+      publishing_channel.close()
+      publishing_message_broker.close()
+      
 
 
 def get_log_level(verbosity):
@@ -330,16 +661,15 @@ def monitor_components(channel, delivery_info, msg_properties, msg):
             current_dumpster = Dumpster(name=delivery_info.routing_key, location=status_msg["location"], trash_capacity=status_msg["capacity"], trash_level=status_msg["level"])
             logging.info("Storing dumpster data in the state variable")
 
-            if delivery_info.routing_key in environment_current_state.getCurrentState():
-                with state_variable_lock:
+            with environment_current_state.locked(delivery_info.routing_key):
+                if environment_current_state.exist(delivery_info.routing_key):
                     environment_current_state.update(delivery_info.routing_key, "location", status_msg["location"])
                     environment_current_state.update(delivery_info.routing_key, "trash_capacity", status_msg["capacity"])
                     environment_current_state.update(delivery_info.routing_key, "trash_level", status_msg["level"])
-                logging.info("Updates Made")
-            else:
-                with state_variable_lock:
+                    logging.info("Updates Made")
+                else:
                     environment_current_state.put(current_dumpster)
-                logging.info("New dumpster added")
+                    logging.info("New dumpster added")
 
             if current_dumpster.getTrashLevel() > current_dumpster.ThresholdLevel:
                 threading.Thread(target=manage_overflowing_dumpster, args=(current_dumpster, )).start()
@@ -359,24 +689,43 @@ def monitor_components(channel, delivery_info, msg_properties, msg):
         elif "status" not in status_msg:
             logging.warning("Ignoring " + delivery_info.routing_key + "'s message: Missing 'status' field")
         else:
-            if "a_star_path" not in status_msg:
-                logging.warning("Ignoring " + delivery_info.routing_key + "'s message: Missing 'a_star_path' field")
-                status_msg["a_star_path"] = list()
+            path_info = path_from_message(status_msg)
+            if path_info is None:
+                logging.warning("Ignoring " + delivery_info.routing_key + "'s message: Missing '" + ROUTE_KEY + "' field")
+                path_info = list()
             current_truck = Truck(name=delivery_info.routing_key, location=status_msg["location"], trash_capacity=status_msg["trash_capacity"], trash_level=status_msg["trash_level"], fuel_level=status_msg["fuel_level"], fuel_capacity=status_msg["fuel_capacity"], status=status_msg["status"])
             logging.info("Storing truck data in the state variable")
-            with state_variable_lock:
-                environment_current_state.put(current_truck)
-            path_info = toListOfTuples(status_msg["a_star_path"])
-            with state_variable_lock:
-                environment_current_state.update(current_truck.getName(), "a_star_path", path_info)
+            with environment_current_state.locked(current_truck.getName()):
+                # The assignment is the server's, a status report of the truck doesn't drop it
+                previous_record = environment_current_state.get(current_truck.getName()) if environment_current_state.exist(current_truck.getName()) else None
+                assigned_to = previous_record.get("assigned_to") if previous_record is not None else None
+                # The whole record is written at once, readers never see it without its route or assignment
+                if assigned_to is not None:
+                    environment_current_state.put(current_truck, a_star_path=path_info, assigned_to=assigned_to)
+                else:
+                    environment_current_state.put(current_truck, a_star_path=path_info)
+            update_truck_reach(status_msg["fuel_capacity"])
+            # Keep the D* Lite route of a rerouted truck in step with the truck
+            if path_info:
+                truck_replanner.move(current_truck.getName(), current_truck.getLocation())
+            else:
+                truck_replanner.release(current_truck.getName())
             # all_trucks_state[delivery_info.routing_key] = status_msg["status"]
             if status_msg["status"] == TruckState.BUSY:
                 if "assigned_to" in environment_current_state.get(current_truck.getName()):
                     if current_truck.getLocation() == map_landfill.getLocation():
                         logging.info("current_state IDLE of this truck")
-                        # with state_variable_lock:
+                        # with environment_current_state.locked(current_truck.getName()):
                         #     environment_current_state.update(current_truck.getName(), "status", TruckState.IDLE)
 
+    elif status_msg["type"] == MAP_PATCH_TYPE:
+        logging.info(delivery_info.routing_key + "'s map patch Received")
+        try:
+            change = environment_map.apply_patch(MapPatch.from_dict(status_msg))
+            logging.info("Map patch applied: " + repr(change))
+        except ValueError, pe:
+            logging.warning("Ignoring " + delivery_info.routing_key + "'s map patch: " + str(pe))
+
     else:
         logging.warning("Ignoring message: Unknown type message received")
 
@@ -410,7 +759,17 @@ try:
   parser.add_argument("-v", "--verbosity", help="The verbosity levels of logging ranging from 0 for ONLY CRITICAL logging to 4 for DEBUG", metavar="verbosity", default=4)
   # Parsing map dimensions using argparser,
   # TODO read it using yaml so that even map environment can be loaded, else have to parse everything through command line which is cumbersome
-  parser.add_argument("-s", "--map_size", help="The mxn dimension map size that will be generated at start", metavar="map dimensions", default="10x10", type=str, required=True)
+  parser.add_argument("-s", "--map_size", help="The mxn dimension map size that will be generated at start, unless a map file is given", metavar="map dimensions", default="10x10", type=str)
+  parser.add_argument("-m", "--map_file", help="Binary map file, or occupancy layer of the map as a .npy file whose non zero cells are walls", metavar="map file", default=None, type=str)
+  parser.add_argument("-w", "--weights_file", help="Cell weights of the map file as a .npy file of the same shape", metavar="weights file", default=None, type=str)
+  parser.add_argument("-e", "--search_engine", help="Search engine used for truck routes, jump_point only pays off on uniformly weighted maps", metavar="search engine", choices=sorted(SEARCH_ENGINES.keys()), default="a_star", type=str)
+  parser.add_argument("-a", "--heuristic", help="Heuristic of the search engines, manhattan is the fast but inexact one of the first releases", metavar="heuristic", choices=sorted(SEARCH_HEURISTICS.keys()), default="octile", type=str)
+  parser.add_argument("-l", "--long_route_distance", help="Manhattan distance from which routes use the bidirectional search, 0 to disable", metavar="long route distance", default=0, type=int)
+  parser.add_argument("-r", "--route_cache_size", help="Number of truck routes kept in the route cache", metavar="route cache size", default=DEFAULT_ROUTE_CACHE_SIZE, type=int)
+  parser.add_argument("-o", "--cooperative", help="Plan truck routes around each other with a space-time reservation table", action="store_true")
+  parser.add_argument("-n", "--dispatch_candidates", help="Number of the closest idle trucks considered for an overflowing dumpster", metavar="dispatch candidates", default=DEFAULT_DISPATCH_CANDIDATES, type=int)
+  parser.add_argument("-j", "--batch_processes", help="Worker processes that search batches of dispatch legs together, the number of cores by default", metavar="batch processes", default=None, type=int)
+  parser.add_argument("-t", "--traffic_profile", help="File of hourly congestion delays, routes avoid the cells that are slow at their departure hour", metavar="traffic profile", default=None, type=str)
 
   # Parse arguments
   args = parser.parse_args()
@@ -440,16 +799,55 @@ try:
   logging_date_format = '%I:%M:%S %p'
   logging.basicConfig(level=log_level, format=logging_format, datefmt=logging_date_format)
 
-  environment_map = Map(width=m, height=n, template='TEMPLATE_1')
+  if args.map_file:
+    environment_map = Map.load(args.map_file, args.weights_file)
+    logging.info("Loaded a " + str(environment_map.graph.width) + "x" + str(environment_map.graph.height) + " map from " + args.map_file)
+  else:
+    environment_map = Map(width=m, height=n, template='TEMPLATE_1')
 
   # Place landfill in (0, 0)
   map_landfill = Landfill(0, 0)
 
+  # Hourly congestion delays, graph.at_hour returns the map itself without a profile
+  if args.traffic_profile:
+    attach_traffic(environment_map.graph).load(args.traffic_profile)
+
+  # Every engine picks up the heuristic registered for the map
+  use_heuristic(environment_map.graph, SEARCH_HEURISTICS[args.heuristic](environment_map.graph))
+
+  # Routes are cached per (start, goal, map version) in front of the A * search
+  search_engine = args.search_engine
+  long_route_distance = args.long_route_distance
+  # RoutePlanners of the grid and of the last hours used, least recently used first, all
+  # rebuilt by themselves whenever the map or the traffic profile changes
+  route_planners = OrderedDict()
+  route_planners_lock = threading.Lock()
+  # Dispatch legs the one-to-many search doesn't cover are searched right away, those submitted while
+  # a batch is being searched are searched together next, after a truck tick at most
+  dispatch_batch = BatchQueue(solve_dispatch_legs, TRUCK_STEP_SECONDS)
+  # So are the conflict free routes of the trucks, with --cooperative, their time queued is logged
+  cooperative_batch = BatchQueue(plan_cooperative_batch, TRUCK_STEP_SECONDS)
+
+  # Idle trucks bucketed by location, kept in step with the state's IDLE_TRUCKS index: trucks
+  # leave it when they're assigned and come back once they report being idle again
+  truck_index = SpatialIndex(environment_map.graph.width, environment_map.graph.height)
+  environment_current_state.watch(IDLE_TRUCKS, lambda component_name, component: truck_index.move(component_name, component.location),
+                                  truck_index.remove)
+  dispatch_candidates = args.dispatch_candidates
+  # Farthest a truck seen so far could drive to a dumpster and back, see update_truck_reach
+  max_truck_reach = 0
+
+  # Cells and ticks taken by the routes sent to the trucks, used with --cooperative
+  truck_reservations = Reservation_Table()
+
+  # Map patches received at runtime repair the routes of the trucks they get in the way of, each
+  # truck on the view of the grid at the hour its repairs started
+  truck_replanner = Incremental_Planner(environment_map.graph)
+  environment_map.subscribe(on_map_change)
+
   message_broker = None
   channel = None
 
-  state_variable_lock = threading.Lock()
-
   try:
     # Connect to the message broker using the given broker address (host)
     # Use the virutal host (vhost) and credential information (credentials), if provided
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Compares the map serializations on TEMPLATE_1 maps
+
+The former MapEncoder wrote str() of the Map's __dict__ into the JSON and as_map parsed it back
+with ast.literal_eval, rebuilding the walls and weights item by item. MapEncoder now sends the
+binary map format of util.map_format in base64. For each map size this reports the encode and
+decode time and the size of both JSON messages, and the size of the raw binary map.
+"""
+
+import argparse
+import json
+import random
+import time
+
+from util.component import Map
+from util.component import MapEncoder
+from util.component import as_map
+from util.grid_structs import GridWithWeights
+from util.map_format import encode_map
+from util.map_format import decode_map
+
+class LegacyMapEncoder(json.JSONEncoder):
+  """ MapEncoder as it was before the binary map format """
+  def default(self, obj):
+    if isinstance(obj, Map):
+      # The former Map only held its graph, its patch epoch, lock and subscribers came later
+      map_dict = dict()
+      for key in obj.__dict__.keys():
+        if isinstance(obj.__dict__[key], GridWithWeights):
+          map_dict[key] = obj.__dict__[key].as_dict()
+      return {"__map__": str(map_dict)}
+    return json.JSONEncoder.default(self, obj)
+
+def add_random_weights(graph, max_weight, seed):
+  generator = random.Random(seed)
+  for index in range(len(graph.cells)):
+    if not graph.cells[index]:
+      graph.cell_weights[index] = generator.randint(0, max_weight)
+  graph.touch()
+
+def timed(function, *args, **kwargs):
+  started = time.time()
+  result = function(*args, **kwargs)
+  return time.time() - started, result
+
+def same_map(a, b):
+  return (a.width, a.height, a.cells, a.cell_weights, a.dist_weights, a.fuel_weights) == \
+         (b.width, b.height, b.cells, b.cell_weights, b.dist_weights, b.fuel_weights)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark of the map serializations on TEMPLATE_1 maps")
+  parser.add_argument("-s", "--sizes", help="Map sizes to benchmark, one square map per size", metavar="sizes", nargs="*", default=[50, 100, 200, 400], type=int)
+  parser.add_argument("-w", "--random_weights", help="Give passable cells random weights from 0 to this value, 0 keeps the template weights", metavar="max weight", default=0, type=int)
+  parser.add_argument("--seed", help="Seed of the random weights", metavar="seed", default=1, type=int)
+  args = parser.parse_args()
+
+  print "%-6s %-8s %10s %10s %12s" % ("size", "format", "encode s", "decode s", "bytes")
+  for size in args.sizes:
+    map_obj = Map(width=size, height=size, template='TEMPLATE_1')
+    if args.random_weights:
+      add_random_weights(map_obj.graph, args.random_weights, args.seed)
+    for (name, encoder) in [("legacy", LegacyMapEncoder), ("binary", MapEncoder)]:
+      (encode_seconds, data) = timed(json.dumps, map_obj, cls=encoder)
+      (decode_seconds, decoded) = timed(json.loads, data, object_hook=as_map)
+      print "%-6d %-8s %10.4f %10.4f %12d" % (size, name, encode_seconds, decode_seconds, len(data))
+      if not same_map(map_obj.graph, decoded.graph):
+        print "WARNING: the %s format didn't round trip the %dx%d map" % (name, size, size)
+    (encode_seconds, data) = timed(encode_map, map_obj.graph)
+    (decode_seconds, decoded) = timed(decode_map, data)
+    print "%-6d %-8s %10.4f %10.4f %12d" % (size, "raw", encode_seconds, decode_seconds, len(data))
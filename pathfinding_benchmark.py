@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of the path finding engines
+
+Generates TEMPLATE_1 maps and maps with random obstacle densities for every requested size,
+runs the same seeded (start, goal) queries through every requested engine and reports the
+latency percentiles, nodes expanded, peak memory and path cost of each engine.
+Every (map, engine) run happens in its own process, so the peak memory of one run doesn't
+hide the one of the next. Results can be written as JSON to compare two runs.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import time
+
+import a_star.path_finder
+from a_star.path_finder import A_Star_Search
+from a_star.engine import Buffered_A_Star_Search
+from a_star.jump_point import Jump_Point_Search
+from a_star.bidirectional import Bidirectional_A_Star_Search
+from a_star.hierarchical import Hierarchical_Search
+from a_star.incremental import D_Star_Lite
+from a_star.batch import Endpoint
+from a_star.heuristics import Octile_Heuristic
+from a_star.heuristics import Landmark_Heuristic
+from a_star.heuristics import Manhattan_Heuristic
+from a_star.heuristics import use_heuristic
+from util.component import Map
+
+ENGINES = {"a_star": A_Star_Search, "buffered_a_star": Buffered_A_Star_Search, "jump_point": Jump_Point_Search, "bidirectional": Bidirectional_A_Star_Search,
+           "hierarchical": Hierarchical_Search, "d_star_lite": D_Star_Lite}
+
+PERCENTILES = [50, 90, 99]
+
+# Landmark tables are built per run rather than loaded, their build time isn't part of the queries
+HEURISTICS = {"octile": Octile_Heuristic, "landmarks": lambda graph: Landmark_Heuristic(graph, directory=None),
+              "manhattan": Manhattan_Heuristic}
+
+def build_map(template, size, density, seed):
+  """ Returns the graph of a TEMPLATE_1 map, or of an open map with random walls covering density of its cells """
+  if template == 'TEMPLATE_1':
+    return Map(width=size, height=size, template='TEMPLATE_1').graph
+  graph = Map(width=size, height=size, template=None).graph
+  generator = random.Random(seed)
+  graph.cells[:] = bytearray(1 if generator.random() < density else 0 for i in range(size * size))
+  graph.touch()
+  return graph
+
+def build_queries(graph, count, seed):
+  generator = random.Random(seed)
+  passable = [(x, y) for y in range(graph.height) for x in range(graph.width) if graph.passable((x, y))]
+  if not passable:
+    return []
+  return [(generator.choice(passable), generator.choice(passable)) for i in range(count)]
+
+def percentile(values, rank):
+  """ Nearest rank percentile of an already sorted list """
+  if not values:
+    return None
+  index = max(0, int(round(rank / 100.0 * len(values) + 0.5)) - 1)
+  return values[min(index, len(values) - 1)]
+
+def peak_rss_kb():
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_engine(template, size, density, engine_name, query_count, seed, heuristic_name):
+  """ Builds the map and runs every query through one engine, returns the result record """
+  graph = build_map(template, size, density, seed)
+  use_heuristic(graph, HEURISTICS[heuristic_name](graph))
+  queries = build_queries(graph, query_count, seed)
+  engine = ENGINES[engine_name]
+  rss_before = peak_rss_kb()
+  latencies = []
+  nodes_expanded = 0
+  total_cost = 0
+  reachable = 0
+  for (start, goal) in queries:
+    started = time.time()
+    try:
+      search = engine(graph, Endpoint(start), Endpoint(goal))
+      path = search.get_a_star_path()
+    except KeyError:
+      # A * fails to reconstruct the path of an unreachable goal
+      (search, path) = (None, None)
+    latencies.append((time.time() - started) * 1000.0)
+    if hasattr(search, 'get_nodes_expanded'):
+      nodes_expanded += search.get_nodes_expanded()
+    try:
+      cost = search.get_cost_so_far(goal) if path else None
+    except KeyError:
+      cost = None
+    if cost is not None:
+      reachable += 1
+      total_cost += cost
+  latencies.sort()
+  result = {"template": template, "size": size, "density": density if template != 'TEMPLATE_1' else None,
+            "engine": engine_name, "heuristic": heuristic_name, "queries": len(queries), "reachable": reachable, "total_cost": total_cost,
+            "nodes_expanded": nodes_expanded, "peak_rss_kb": peak_rss_kb(), "search_rss_kb": peak_rss_kb() - rss_before,
+            "latency_ms": dict(("p%d" % rank, percentile(latencies, rank)) for rank in PERCENTILES)}
+  result["latency_ms"]["max"] = latencies[-1] if latencies else None
+  result["latency_ms"]["mean"] = sum(latencies) / len(latencies) if latencies else None
+  return result
+
+def result_key(result):
+  return (result["template"], result["size"], result["density"], result["engine"], result.get("heuristic", "octile"))
+
+def compare(results, baseline_file, seed, queries):
+  """ Prints the p50 latency, nodes expanded and total cost of each run relative to the same run of a saved report """
+  with open(baseline_file) as baseline:
+    report = json.load(baseline)
+  previous = dict((result_key(result), result) for result in report["results"] if "error" not in result)
+  print "Compared to " + baseline_file
+  if report["seed"] != seed or report["queries"] != queries:
+    print "WARNING: the baseline ran %d queries with seed %d, the ratios mix different query sets" % (report["queries"], report["seed"])
+  for result in results:
+    old = previous.get(result_key(result))
+    if "error" in result or old is None:
+      continue
+    ratio = lambda new, before: (float(new) / before) if before else float("nan")
+    print "%-10s %-5d %-6s %-13s p50 x%.2f  expanded x%.2f  cost x%.3f" % (result["template"], result["size"], result["density"], result["engine"],
+                                                                            ratio(result["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+                                                                            ratio(result["nodes_expanded"], old["nodes_expanded"]),
+                                                                            ratio(result["total_cost"], old["total_cost"]))
+
+def _run_in_child(connection, args):
+  # A * draws the whole grid per query unless told otherwise
+  a_star.path_finder.TEST_PROGRAM_ACTIVE = 0
+  try:
+    connection.send(run_engine(*args))
+  except Exception, e:
+    connection.send({"error": "%s: %s" % (type(e).__name__, e)})
+  connection.close()
+
+def run_isolated(*args):
+  """ Runs run_engine in a child process, so ru_maxrss only measures that run """
+  (parent, child) = multiprocessing.Pipe(duplex=False)
+  process = multiprocessing.Process(target=_run_in_child, args=(child, args))
+  process.start()
+  result = parent.recv()
+  process.join()
+  return result
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark of the path finding engines over generated maps")
+  parser.add_argument("-s", "--sizes", help="Map sizes to benchmark, one square map per size", metavar="sizes", nargs="*", default=[10, 50, 100, 250], type=int)
+  parser.add_argument("-t", "--templates", help="Map templates, 'random' uses the obstacle densities", metavar="templates", nargs="*", choices=["TEMPLATE_1", "random"], default=["TEMPLATE_1", "random"])
+  parser.add_argument("-d", "--densities", help="Obstacle densities of the random maps", metavar="densities", nargs="*", default=[0.1, 0.3], type=float)
+  parser.add_argument("-e", "--engines", help="Engines to benchmark", metavar="engines", nargs="*", choices=sorted(ENGINES.keys()), default=sorted(ENGINES.keys()))
+  parser.add_argument("-a", "--heuristic", help="Heuristic registered for every map, D* Lite always uses octile", metavar="heuristic", choices=sorted(HEURISTICS.keys()), default="octile", type=str)
+  parser.add_argument("-q", "--queries", help="Number of seeded queries per map", metavar="queries", default=20, type=int)
+  parser.add_argument("--seed", help="Seed of the random maps and queries", metavar="seed", default=1, type=int)
+  parser.add_argument("-o", "--output", help="File the JSON results are written to", metavar="output", default=None, type=str)
+  parser.add_argument("-c", "--compare", help="JSON results of an earlier run to compare this run with", metavar="baseline", default=None, type=str)
+  args = parser.parse_args()
+
+  runs = []
+  for size in args.sizes:
+    for template in args.templates:
+      for density in (args.densities if template == "random" else [None]):
+        for engine_name in args.engines:
+          runs.append((template, size, density, engine_name, args.queries, args.seed, args.heuristic))
+
+  print "%-10s %-5s %-6s %-13s %9s %9s %9s %9s %10s %12s %12s" % ("template", "size", "dense", "engine", "p50 ms", "p90 ms", "p99 ms",
+                                                                    "max ms", "expanded", "peak rss kb", "total cost")
+  results = []
+  for run in runs:
+    result = run_isolated(*run)
+    if "error" in result:
+      (template, size, density, engine_name) = run[:4]
+      print "%-10s %-5d %-6s %-13s failed: %s" % (template, size, density, engine_name, result["error"])
+      result.update({"template": template, "size": size, "density": density, "engine": engine_name})
+    else:
+      latency = result["latency_ms"]
+      print "%-10s %-5d %-6s %-13s %9.2f %9.2f %9.2f %9.2f %10d %12d %12g" % (result["template"], result["size"], result["density"],
+                                                                              result["engine"], latency["p50"] or 0, latency["p90"] or 0,
+                                                                              latency["p99"] or 0, latency["max"] or 0, result["nodes_expanded"],
+                                                                              result["peak_rss_kb"], result["total_cost"])
+    results.append(result)
+
+  if args.output:
+    report = {"seed": args.seed, "queries": args.queries, "python": platform.python_version(),
+              "machine": platform.machine(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    with open(args.output, "w") as output:
+      json.dump(report, output, indent=2, sort_keys=True)
+    print "Results written to " + args.output
+
+  if args.compare:
+    compare(results, args.compare, args.seed, args.queries)
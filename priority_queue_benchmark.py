@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Compares the A * frontier queues on TEMPLATE_1 maps
+
+The same seeded truck -> dumpster queries are searched once with the lazy heapq PriorityQueue
+and once with the IndexedPriorityQueue (decrease-key), reporting runtime, pushes, pops,
+stale pops and the peak size of the frontier for each map size.
+"""
+
+import argparse
+import random
+import time
+
+import a_star.path_finder
+from a_star.path_finder import A_Star_Search
+from a_star.structs import PriorityQueue
+from a_star.structs import IndexedPriorityQueue
+from util.component import Map
+
+QUEUES = [("heapq", PriorityQueue), ("indexed", IndexedPriorityQueue)]
+
+class Location:
+  """ Bare endpoint of a query, A_Star_Search only asks components for their location """
+  def __init__(self, location):
+    self.location = location
+
+  def getLocation(self):
+    return self.location
+
+def random_queries(graph, count, seed):
+  generator = random.Random(seed)
+  passable = [(x, y) for y in range(graph.height) for x in range(graph.width) if graph.passable((x, y))]
+  return [(generator.choice(passable), generator.choice(passable)) for i in range(count)]
+
+def add_random_weights(graph, max_weight, seed):
+  # Uneven weights make routes improve after a cell was first reached, which is where the queues differ
+  generator = random.Random(seed)
+  for y in range(graph.height):
+    for x in range(graph.width):
+      if graph.passable((x, y)):
+        graph.cell_weights[graph.index((x, y))] = generator.randint(0, max_weight)
+  graph.touch()
+
+def run_queries(graph, queries, queue):
+  totals = {'pushes': 0, 'pops': 0, 'stale_pops': 0, 'decrease_keys': 0, 'max_size': 0}
+  cost = 0
+  started = time.time()
+  for (start, goal) in queries:
+    search = A_Star_Search(graph, Location(start), Location(goal), queue=queue)
+    cost += search.get_cost_so_far(goal)
+    for (key, value) in search.get_queue_stats().items():
+      if key == 'max_size':
+        totals[key] = max(totals[key], value)
+      else:
+        totals[key] += value
+  return time.time() - started, cost, totals
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark of the A * frontier queues on TEMPLATE_1 maps")
+  parser.add_argument("-s", "--sizes", help="Map sizes to benchmark, one square map per size", metavar="sizes", nargs="*", default=[25, 50, 100, 200], type=int)
+  parser.add_argument("-q", "--queries", help="Number of random queries per map", metavar="queries", default=50, type=int)
+  parser.add_argument("-w", "--random_weights", help="Give passable cells random weights from 0 to this value, 0 keeps the template weights", metavar="max weight", default=0, type=int)
+  parser.add_argument("--seed", help="Seed of the random queries", metavar="seed", default=1, type=int)
+  args = parser.parse_args()
+
+  # No grid drawing while benchmarking
+  a_star.path_finder.TEST_PROGRAM_ACTIVE = 0
+
+  print "%-6s %-8s %10s %10s %10s %10s %10s %10s" % ("size", "queue", "seconds", "pushes", "pops", "stale", "decrease", "max heap")
+  for size in args.sizes:
+    graph = Map(width=size, height=size, template='TEMPLATE_1').graph
+    if args.random_weights:
+      add_random_weights(graph, args.random_weights, args.seed)
+    queries = random_queries(graph, args.queries, args.seed)
+    costs = set()
+    for (name, queue) in QUEUES:
+      (seconds, cost, totals) = run_queries(graph, queries, queue)
+      costs.add(cost)
+      print "%-6d %-8s %10.3f %10d %10d %10d %10d %10d" % (size, name, seconds, totals['pushes'], totals['pops'],
+                                                           totals['stale_pops'], totals['decrease_keys'], totals['max_size'])
+    if len(costs) != 1:
+      print "WARNING: queues disagree on the total route cost of %dx%d: %s" % (size, size, sorted(costs))
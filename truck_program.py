@@ -23,6 +23,11 @@ from util.component import TruckState
 from util.component import EnumEncoder
 from util.component import as_enum
 
+# Routes travel in their compact encoded form
+from util.path_codec import encode_path
+from util.path_codec import path_from_message
+from util.path_codec import ROUTE_KEY
+
 
 # Global variable that controls running the app
 publish_levels = True
@@ -82,7 +87,11 @@ def publish_truck_status():
         fuel_filled = fuel_filled -1
         truck_data["fuel_level"] = fuel_filled/float(fuel_capacity) * 100.0 #subtract fuel
         
-    data = json.dumps(truck_data,indent=4,sort_keys=True,cls=EnumEncoder)#put dict into JSON format     
+    # The remaining route is sent back encoded instead of as a list of cells
+    truck_msg = dict(truck_data)
+    del truck_msg["a_star_path"]
+    truck_msg[ROUTE_KEY] = encode_path(truck_data["a_star_path"])
+    data = json.dumps(truck_msg,separators=(',', ':'),sort_keys=True,cls=EnumEncoder)#put dict into JSON format
     publishing_channel.basic_publish(exchange = 'iDumpster_exchange',
                                      routing_key = topic, body = data)
     print "Sent: ", data
@@ -99,15 +108,17 @@ def receive_path_info(channel, delivery_info, msg_properties, msg):
     if msg is not "":
         try:
             recv_path_msg = json.loads(msg, object_hook=as_enum)
+            # Raises ValueError on a malformed route, handled like any unparsable message
+            a_star_path = path_from_message(recv_path_msg)
 
             if "status" not in recv_path_msg:
                 print "Warning: Reply Message 'status' not found, Ignoring message"
-            elif "a_star_path" not in recv_path_msg:
-                print "Warning: Reply Message 'a_star_path' not found, Ignoring message"
+            elif a_star_path is None:
+                print "Warning: Reply Message '" + ROUTE_KEY + "' not found, Ignoring message"
             else:
                 truck_data["status"] = recv_path_msg["status"]
-                truck_data["a_star_path"] = recv_path_msg["a_star_path"]
-                print recv_path_msg["a_star_path"]
+                truck_data["a_star_path"] = a_star_path
+                print a_star_path
 
         except ValueError, ve:
             print "Warning: Discarding message: received message couldn't be parsed" + str(ve.message)
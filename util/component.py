@@ -23,10 +23,20 @@
 
 import json
 import ast
+import base64
+import threading
+import Queue
+from contextlib import contextmanager
 # import logging
-from copy import deepcopy
+from array import array
+from collections import Mapping
+from collections import MutableMapping
 from enum import Enum
 from grid_structs import GridWithWeights
+from map_format import load_grid
+from map_format import encode_map
+from map_format import decode_map
+from map_patch import MapChange
 
 
 FUEL_COST_PER_STEP = 2
@@ -35,6 +45,8 @@ class EnumEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Enum):
             return {"__enum__": str(obj)}
+        if isinstance(obj, ComponentRecord):
+            return obj.as_dict()
         return json.JSONEncoder.default(self, obj)
 
 def as_enum(d):
@@ -45,24 +57,23 @@ def as_enum(d):
         return d
 
 class MapEncoder(json.JSONEncoder):
+    """ Sends a Map as its binary map (see util.map_format) in base64 """
     def default(self, obj):
         if isinstance(obj, Map):
-            map_dict = dict()
-            for key in obj.__dict__.keys():
-                if isinstance(obj.__dict__[key], GridWithWeights):
-                    map_dict[key] = obj.__dict__[key].__dict__
-                else:
-                    map_dict[key] = obj.__dict__[key]
-            return {"__map__": str(map_dict)}
+            return {"__map__": base64.b64encode(encode_map(obj.graph))}
         return json.JSONEncoder.default(self, obj)
 
 def as_map(d):
     """ Object hook for loading json data of Map object.
+    Maps are sent as base64 binary maps. Older senders wrote str() of the Map's __dict__,
+    which always starts with "{", so it is still read back with ast.literal_eval.
     Took help of http://stackoverflow.com/questions/988228/converting-a-string-to-dictionary
-    Here we first re-convert our string type to dictionary and return a Map object with the
-    data exactly matching with the received json map data.
     """
     if "__map__" in d:
+        if not d["__map__"].startswith("{"):
+            map_obj = Map(template=None)
+            map_obj.graph = decode_map(base64.b64decode(d["__map__"]))
+            return map_obj
         map_data = ast.literal_eval(d["__map__"])
         for key in map_data.keys():
             if key == 'graph':
@@ -92,90 +103,389 @@ class TruckState(Enum):
 class DumpsterState(Enum):
     UNASSIGNED = 0
     ASSIGNED = 1
+    # The assigned truck reached the dumpster and its return trip is being sent
+    COLLECTING = 2
+
+# Secondary indexes of the State, each one the set of names of the components it matches
+TRUCKS = "trucks"
+DUMPSTERS = "dumpsters"
+IDLE_TRUCKS = "idle_trucks"
+
+def is_idle_truck(component):
+    return component["type"] == component_type.Truck and component.get("status") == TruckState.IDLE and "assigned_to" not in component
+
+STATE_INDEXES = {TRUCKS: lambda component: component["type"] == component_type.Truck,
+                 DUMPSTERS: lambda component: component["type"] == component_type.Dumpster,
+                 IDLE_TRUCKS: is_idle_truck}
+
+# Number of buckets, each with its own lock, the components of a State are spread over, see State
+STATE_LOCK_STRIPES = 64
+
+def state_bucket(component_name):
+    """ Bucket, and lock stripe, of a component of the State """
+    return hash(component_name) % STATE_LOCK_STRIPES
+
+class _Absent(object):
+    def __repr__(self):
+        return "ABSENT"
+
+# Stands for a missing field in State.compare_and_set, as expected value or as update to delete the field
+ABSENT = _Absent()
+
+class StateSnapshot(Mapping):
+    """ Read only view of the State at one version, component name -> component record.
+    Taking one costs STATE_LOCK_STRIPES references: State never changes a bucket or record
+    it handed out, it copies the bucket and the records it writes to first (copy on write).
+    Records (see ComponentRecord) are shared with later snapshots, so they must not be
+    modified by readers.
+    """
+    def __init__(self, buckets, version, indexes):
+        # One dict of name -> record and one dict of index -> names per bucket, see state_bucket
+        self.__buckets = buckets
+        self.__indexes = indexes
+        self.version = version
+
+    def names(self, index):
+        """ Names of the components in one of the STATE_INDEXES, in O(number of names) """
+        return [component_name for indexes in self.__indexes for component_name in indexes[index]]
+
+    def __getitem__(self, component_name):
+        return self.__buckets[state_bucket(component_name)][component_name]
+
+    def __iter__(self):
+        return (component_name for bucket in self.__buckets for component_name in bucket)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.__buckets)
+
+    def __contains__(self, component_name):
+        return component_name in self.__buckets[state_bucket(component_name)]
+
+    def __repr__(self):
+        return "StateSnapshot(version=%d, components=%d)" % (self.version, len(self))
 
 class State:
+    """ Components by name, safe to share between the ingestion, dispatch and web server threads.
+
+    Readers take snapshots (getCurrentState) or single records (get) without any lock. Every
+    component hashes to one of STATE_LOCK_STRIPES buckets, each a dict with its own lock: writes
+    hold the lock of their component, so writes to different components only contend for the
+    short copy on write step, and locked(*names) holds the locks of several components for a
+    compound change. compare_and_set checks fields and changes them atomically, e.g. to claim a
+    truck only if it's still idle.
+
+    The first write to a bucket after a snapshot copies that bucket and its index sets, about
+    1/STATE_LOCK_STRIPES of the components, and the record it writes to.
+    """
     def __init__(self):
-        self.__state = {}
+        # component name -> record, one dict per bucket, see state_bucket
+        self.__buckets = [{} for bucket in range(STATE_LOCK_STRIPES)]
+        # STATE_INDEXES name -> set of component names, one dict per bucket, copied on write like the buckets
+        self.__indexes = [dict((index, set()) for index in STATE_INDEXES) for bucket in range(STATE_LOCK_STRIPES)]
+        # Bumped by every change, snapshots carry the version they were taken at
+        self.version = 0
+        # The last snapshot handed out, reused until the next change
+        self.__snapshot = None
+        # Buckets the last snapshot holds, copied before they're written to
+        self.__shared = set()
+        # Records copied since the last snapshot, those can be written in place
+        self.__owned = set()
+        # (index, on_update, on_remove) of every watch
+        self.__watchers = []
+        # Guards the dicts and the indexes, only held for the copy on write and the change itself
+        self.__lock = threading.RLock()
+        self.__stripes = [threading.RLock() for stripe in range(STATE_LOCK_STRIPES)]
         # logging.info("Initializing environment")
         print "Initializing Environment State"
 
-    def put(self, component):
+    def __write(self, component_name, copy_record=True):
+        """ Makes the bucket of component_name, and its record unless copy_record is False, private
+        to the State again before it's changed, and returns the bucket. Must be called with the lock held. """
+        bucket = state_bucket(component_name)
+        if bucket in self.__shared:
+            self.__buckets[bucket] = dict(self.__buckets[bucket])
+            self.__indexes[bucket] = dict((index, set(names)) for (index, names) in self.__indexes[bucket].items())
+            self.__shared.discard(bucket)
+        self.__snapshot = None
+        components = self.__buckets[bucket]
+        if copy_record and component_name not in self.__owned:
+            components[component_name] = components[component_name].copy()
+            self.__owned.add(component_name)
+        self.version += 1
+        return components
+
+    def __reindex(self, component_name):
+        """ Puts component_name in the indexes it matches now and takes it out of the others """
+        bucket = state_bucket(component_name)
+        component = self.__buckets[bucket].get(component_name)
+        indexes = self.__indexes[bucket]
+        left = set()
+        for (index, matches) in STATE_INDEXES.items():
+            names = indexes[index]
+            if component is not None and matches(component):
+                names.add(component_name)
+            elif component_name in names:
+                names.discard(component_name)
+                left.add(index)
+        for (index, on_update, on_remove) in self.__watchers:
+            if component_name in indexes[index]:
+                on_update(component_name, component)
+            elif index in left:
+                on_remove(component_name)
+
+    def watch(self, index, on_update, on_remove):
+        """
+        Keeps something in step with one of the STATE_INDEXES, e.g. a spatial index of the idle trucks
+
+        on_update(name, record) is called for the components already in the index and from then on
+        whenever one enters the index or is written while in it, on_remove(name) whenever one leaves it.
+        Both run with the State's lock held, so they must be quick and mustn't write to the State.
+        """
+        with self.__lock:
+            self.__watchers.append((index, on_update, on_remove))
+            for (components, indexes) in zip(self.__buckets, self.__indexes):
+                for component_name in indexes[index]:
+                    on_update(component_name, components[component_name])
+
+    @contextmanager
+    def locked(self, *component_names):
+        """ Holds the locks of the given components, for changes that must look atomic to other writers """
+        # Always taken in the same order, so two compound changes can't deadlock
+        stripes = sorted(set(state_bucket(component_name) for component_name in component_names))
+        for stripe in stripes:
+            self.__stripes[stripe].acquire()
+        try:
+            yield self
+        finally:
+            for stripe in reversed(stripes):
+                self.__stripes[stripe].release()
+
+    def compare_and_set(self, component_name, expected, updates):
+        """
+        Changes fields of a component only if other fields still have the values a decision was based on
+
+        :param expected: (dict) field -> value the field must have, ABSENT if it must be missing
+        :param updates: (dict) field -> new value, ABSENT to delete the field
+        :return: (bool) True if the component matched and was changed, False if nothing was changed
+        """
+        return self.compare_and_set_all([(component_name, expected, updates)])
+
+    def compare_and_set_all(self, changes):
+        """ compare_and_set of several components at once, either all of them match and change or none does
+
+        :param changes: List of (component name, expected, updates)
+        """
+        with self.locked(*[component_name for (component_name, expected, updates) in changes]):
+            for (component_name, expected, updates) in changes:
+                component = self.__buckets[state_bucket(component_name)].get(component_name)
+                if component is None:
+                    return False
+                for (key, value) in expected.items():
+                    if component.get(key, ABSENT) != value:
+                        return False
+            with self.__lock:
+                for (component_name, expected, updates) in changes:
+                    component = self.__write(component_name)[component_name]
+                    for (key, value) in updates.items():
+                        if value is ABSENT:
+                            if key in component:
+                                del component[key]
+                        else:
+                            component[key] = value
+                    self.__reindex(component_name)
+            return True
+
+    def put(self, component, **fields):
+        """
+        Adds the component, or replaces its record entirely
+
+        :param fields: Fields set on the record besides the component's own ones, written along with it
+                       so that readers never see the record without them
+        """
         component_name = component.getName()
-        if component_name not in self.__state:
-            self.__state[component_name] = component.getInfo()
-        # Updating existing component entirely
-        else:
-            # print "WARNING: Updating existing component"
-            self.__state[component_name] = component.getInfo()
+        # getInfo returns a copy, so the record is the State's own
+        record = component.getInfo()
+        for (key, value) in fields.items():
+            record[key] = value
+        with self.locked(component_name), self.__lock:
+            self.__write(component_name, copy_record=False)[component_name] = record
+            self.__owned.add(component_name)
+            self.__reindex(component_name)
 
     def update(self, component_name, key, value):
-        if component_name not in self.__state:
-            print "ERROR: Updating component that is not present in the current state"
-        else:
-            self.__state[component_name][key] = value
+        with self.locked(component_name), self.__lock:
+            if not self.exist(component_name):
+                print "ERROR: Updating component that is not present in the current state"
+            else:
+                self.__write(component_name)[component_name][key] = value
+                self.__reindex(component_name)
 
     def get(self, component_name, **optional_parameters):
-        if component_name not in self.__state:
+        """ Returns the record of the component, or one of its fields with key=. Records must not be modified """
+        component = self.__buckets[state_bucket(component_name)].get(component_name)
+        if component is None:
             print "ERROR: Component not present in the State object"
             return
         else:
             if "key" in optional_parameters:
                 if "location" in optional_parameters["key"]:
-                    return (self.__state[component_name]["location"]["x"], self.__state[component_name]["location"]["y"])
+                    return component.location
                 else:
-                    return self.__state[component_name][optional_parameters["key"]]
+                    return component[optional_parameters["key"]]
             else:
-                return self.__state[component_name]
+                return component
 
     def exist(self, component_name):
-        return component_name in self.__state
+        return component_name in self.__buckets[state_bucket(component_name)]
 
     def delete(self, component_name):
-        if component_name in self.__state:
-            del self.__state[component_name]
-        else:
-            # logging.error("Trying to remove non-existing component")
-            print "ERROR: Component not present in the State object"
+        with self.locked(component_name), self.__lock:
+            if self.exist(component_name):
+                del self.__write(component_name, copy_record=False)[component_name]
+                self.__owned.discard(component_name)
+                self.__reindex(component_name)
+            else:
+                # logging.error("Trying to remove non-existing component")
+                print "ERROR: Component not present in the State object"
 
     def getCurrentState(self):
-        return deepcopy(self.__state)
+        """ Returns a consistent StateSnapshot of every component, see StateSnapshot """
+        with self.__lock:
+            if self.__snapshot is None:
+                self.__snapshot = StateSnapshot(list(self.__buckets), self.version, list(self.__indexes))
+                self.__shared = set(range(STATE_LOCK_STRIPES))
+                self.__owned = set()
+            return self.__snapshot
+
+    def names(self, index):
+        """ Names of the components in one of the STATE_INDEXES, e.g. IDLE_TRUCKS, in O(number of names) """
+        with self.__lock:
+            return [component_name for indexes in self.__indexes for component_name in indexes[index]]
 
     def type(self, component_name):
-        return self.__state[component_name]["type"]
+        return self.__buckets[state_bucket(component_name)][component_name]["type"]
 
     def remove(self, component_name, key):
-        if key in self.__state[component_name]:
-            del self.__state[component_name][key]
-        else:
-            print "ERROR: Component's field not present in the State object"
+        with self.locked(component_name), self.__lock:
+            if key in self.__buckets[state_bucket(component_name)][component_name]:
+                del self.__write(component_name)[component_name][key]
+                self.__reindex(component_name)
+            else:
+                print "ERROR: Component's field not present in the State object"
 
 class Map:
     def __init__(self, width=None, height=None, template=None):
         self.graph = GridWithWeights(width, height)
+        # Bumped by every patch that changed the map, see util.map_patch
+        self.epoch = 0
+        # (callback, synchronous) in the order they subscribed
+        self.__subscribers = []
+        self.__lock = threading.RLock()
+        # Changes waiting for the subscriber thread, started by the first patch
+        self.__changes = Queue.Queue()
+        self.__notifier = None
         self.add_template(template)
 
+    def subscribe(self, callback, synchronous=False):
+        """
+        Calls callback(change) with the MapChange of every patch applied from now on
+
+        :param synchronous: (bool) Call it from apply_patch, with the map lock held, instead of from the
+                            subscriber thread. Only for quick bookkeeping that must be done before
+                            apply_patch returns, e.g. dropping the cached routes the patch changed
+        """
+        with self.__lock:
+            self.__subscribers.append((callback, synchronous))
+
+    def unsubscribe(self, callback):
+        with self.__lock:
+            self.__subscribers = [(subscriber, synchronous) for (subscriber, synchronous) in self.__subscribers
+                                  if subscriber != callback]
+
+    def flush(self):
+        """ Waits until the subscriber thread has handed out every change applied so far """
+        self.__changes.join()
+
+    def apply_patch(self, patch):
+        """
+        Applies a MapPatch to the map and notifies the subscribers, in the order they subscribed.
+        Patches are applied one at a time and subscribers get them in epoch order: the synchronous
+        ones before apply_patch returns, the others later from a single subscriber thread, so that
+        the thread applying patches never waits for the routes they cause to be repaired.
+
+        :param patch: (MapPatch) Walls and weights to change
+        :return: (MapChange) What changed, nothing if the patch left the map as it was
+        :raises ValueError: If the patch doesn't fit the map, nothing is changed then
+        """
+        with self.__lock:
+            (cells, improved) = patch.apply(self.graph)
+            if not cells:
+                return MapChange(self.epoch, patch, cells, improved, self.graph.version, self.graph.version)
+            from_version = self.graph.version
+            self.graph.touch()
+            self.epoch += 1
+            change = MapChange(self.epoch, patch, cells, improved, from_version, self.graph.version)
+            subscribers = list(self.__subscribers)
+            self.__notify([callback for (callback, synchronous) in subscribers if synchronous], change)
+            # Queued with the lock held, so the subscriber thread sees the changes in epoch order
+            self.__changes.put(([callback for (callback, synchronous) in subscribers if not synchronous], change))
+            if self.__notifier is None:
+                self.__notifier = threading.Thread(target=self.__notify_changes, name="Map subscribers")
+                self.__notifier.daemon = True
+                self.__notifier.start()
+            return change
+
+    def __notify_changes(self):
+        while True:
+            (callbacks, change) = self.__changes.get()
+            try:
+                self.__notify(callbacks, change)
+            finally:
+                self.__changes.task_done()
+
+    def __notify(self, callbacks, change):
+        for callback in callbacks:
+            try:
+                callback(change)
+            except Exception, e:
+                # A failing subscriber mustn't keep the others in the dark
+                print "ERROR: Map subscriber " + repr(callback) + " failed on " + repr(change) + ": " + str(e)
+
+    @classmethod
+    def load(cls, occupancy_file, weights_file=None):
+        """ Creates the map of a binary map file or of .npy layer files, see util.map_format """
+        map_obj = cls(template=None)
+        map_obj.graph = load_grid(occupancy_file, weights_file)
+        return map_obj
+
     def add_template(self, design_type):
         if design_type == 'TEMPLATE_1':
-            # Adding walls
-            for x in range(self.graph.width):
-                for y in range(self.graph.height):
-                    if ((x * y) + ((x + 1) * y) + (x * (y + 1)) + ((x + 1) * (y + 1))) % 3:
-                        self.graph.walls.append((x, y))
-
-            # Adding default weights
-            passable_nodes = []
-            for x in range(self.graph.width):
-                for y in range(self.graph.height):
-                    if (x, y) not in self.graph.walls:
-                        passable_nodes.append((x, y))
-            self.graph.default_weights = {location: 0 for location in passable_nodes}
-
-            # Cleaning landfill location
-
-            for x in range(2):
-                for y in range(2):
-                    if (x, y) in self.graph.walls:
-                        self.graph.walls.remove((x, y))
+            graph = self.graph
+            width = graph.width
+            height = graph.height
+            # A cell is a wall when (x * y) + ((x + 1) * y) + (x * (y + 1)) + ((x + 1) * (y + 1)),
+            # that is 4xy + 2x + 2y + 1, isn't a multiple of 3. That only depends on x % 3 and y % 3,
+            # so the grid repeats three distinct rows, each repeating a three cell pattern, and the
+            # layers are built a row at a time instead of a cell at a time
+            rows = []
+            weight_rows = []
+            for y in range(3):
+                pattern = [1 if (4 * x * y + 2 * x + 2 * y + 1) % 3 else 0 for x in range(3)]
+                row = (pattern * (width // 3 + 1))[:width]
+                rows.append(bytearray(row))
+                # Passable cells are roads of weight 0, walls keep the default weight of 1
+                weight_rows.append(array('d', [float(wall) for wall in row]))
+            block = bytearray().join(rows)
+            weight_block = weight_rows[0] + weight_rows[1] + weight_rows[2]
+            graph.cells[:] = (block * (height // 3 + 1))[:width * height]
+            graph.cell_weights[:] = (weight_block * (height // 3 + 1))[:width * height]
+
+            # Cleaning landfill location, cleared cells are roads like every other passable cell
+            for x in range(min(2, width)):
+                for y in range(min(2, height)):
+                    graph.cells[graph.index((x, y))] = 0
+                    graph.cell_weights[graph.index((x, y))] = 0
+            graph.touch()
 
             # Landfill is at (0, 0)
 
@@ -191,83 +501,229 @@ class Map:
             # self.graph.dist_weights = {diag_fuel_cost: 7, ortho_fuel_cost: 5}
 
 
+""" Component records are what the State keeps per component, one fixed set of __slots__
+per component type instead of a dict, since the server may track tens of thousands of them.
+They read and write like the dicts they replace (record["trash_level"], "assigned_to" in
+record, del record["assigned_to"]), location included: record["location"] is a fresh
+{"x": x, "y": y} dict while record.location is the (x, y) tuple kept in the record.
+as_dict() turns a record into plain dicts at the JSON boundary.
+"""
+
+class ComponentRecord(object):
+    __slots__ = ("name", "type", "location", "status")
+    # Fields a record of this type can hold, optional ones may be missing
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, **fields):
+        for (key, value) in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        try:
+            if key == "location":
+                return {"x": self.location[0], "y": self.location[1]}
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError("A " + type(self).__name__ + " has no field " + repr(key))
+        if key == "location" and isinstance(value, dict):
+            value = (value["x"], value["y"])
+        elif key == "location":
+            value = (value[0], value[1])
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return [key for key in self.__fields() if hasattr(self, key)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    __marker = object()
+
+    def pop(self, key, default=__marker):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default is self.__marker:
+            raise KeyError(key)
+        return default
+
+    def popitem(self):
+        for key in self.keys():
+            return (key, self.pop(key))
+        raise KeyError("popitem(): record is empty")
+
+    def clear(self):
+        for key in self.keys():
+            del self[key]
+
+    def update(*args, **fields):
+        """ Same as dict.update, from a mapping, an iterable of (key, value) pairs and/or keyword fields """
+        (self, others) = (args[0], args[1:])
+        if len(others) > 1:
+            raise TypeError("update expected at most 1 positional argument, got " + str(len(others)))
+        if others:
+            other = others[0]
+            pairs = other.items() if hasattr(other, "keys") else other
+            for (key, value) in pairs:
+                self[key] = value
+        for (key, value) in fields.items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __fields(self):
+        # Slots of the whole class hierarchy, in declaration order
+        fields = []
+        for cls in reversed(type(self).__mro__):
+            fields.extend(cls.__dict__.get("__slots__", ()))
+        return fields
+
+    def copy(self):
+        """ Shallow copy, the State copies a record this way before changing it """
+        record = type(self).__new__(type(self))
+        for key in self.__fields():
+            if hasattr(self, key):
+                setattr(record, key, getattr(self, key))
+        return record
+
+    def as_dict(self):
+        """ The record as the nested dict it used to be, for JSON messages and web pages """
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (ComponentRecord, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + ", ".join(key + "=" + repr(value) for (key, value) in self.items()) + ")"
+
+MutableMapping.register(ComponentRecord)
+
+class DumpsterRecord(ComponentRecord):
+    __slots__ = ("trash_level", "trash_capacity", "assigned_to")
+    FIELDS = ComponentRecord.FIELDS | frozenset(__slots__)
+
+class TruckRecord(ComponentRecord):
+    __slots__ = ("trash_level", "trash_capacity", "fuel_level", "fuel_capacity", "a_star_path", "assigned_to")
+    FIELDS = ComponentRecord.FIELDS | frozenset(__slots__)
+
 """ This python class, dumpster will provide both definition of fields and methods
 for creating dumpster and maintaining the state of the dumpsters
 """
 
-class Dumpster:
-    __info = {"location": {"x": None, "y": None}, "type": component_type.Dumpster, "status": DumpsterState.UNASSIGNED}
+class Dumpster(object):
+    __slots__ = ("__info",)
     ThresholdLevel = 0.6
     def __init__(self, name, location, trash_capacity, trash_level):
-        self.__info["name"] = name
-        self.__info["location"]["x"] = location["x"]
-        self.__info["location"]["y"] = location["y"]
-        self.__info["trash_level"] = trash_level
-        self.__info["trash_capacity"] = trash_capacity
+        self.__info = DumpsterRecord(name=name, type=component_type.Dumpster, location=location,
+                                     status=DumpsterState.UNASSIGNED, trash_level=trash_level,
+                                     trash_capacity=trash_capacity)
 
     def getTrashLevel(self):
-        return self.__info["trash_level"]
+        return self.__info.trash_level
 
     def getTrashCollected(self):
-        return self.__info["trash_level"]/10.0 * self.__info["trash_capacity"]
+        return self.__info.trash_level/10.0 * self.__info.trash_capacity
 
     def getLocation(self):
-        return (self.__info["location"]["x"], self.__info["location"]["y"])
+        return self.__info.location
 
     def getName(self):
-        return self.__info["name"]
+        return self.__info.name
 
     def getInfo(self):
-        return deepcopy(self.__info)
+        return self.__info.copy()
 
 """ Class truck defines methods to create new truck, get location, get status, etc.
 """
 
-class Truck:
-    # Truck dictionary to store the truck information
-    __info = {"location": {"x": None, "y": None}, "type": component_type.Truck}
+class Truck(object):
+    # Truck record to store the truck information
+    __slots__ = ("__info",)
 
     def __init__(self, name, location, fuel_capacity, trash_capacity, fuel_level, trash_level, status):
-        self.__info["name"] = name
-        self.__info["location"]["x"] = location["x"]
-        self.__info["location"]["y"] = location["y"]
-        self.__info["trash_level"] = trash_level
-        self.__info["trash_capacity"] = trash_capacity
-        self.__info["fuel_level"] = fuel_level
-        self.__info["fuel_capacity"] = fuel_capacity
-        self.__info["status"] = status
+        self.__info = TruckRecord(name=name, type=component_type.Truck, location=location,
+                                  trash_level=trash_level, trash_capacity=trash_capacity,
+                                  fuel_level=fuel_level, fuel_capacity=fuel_capacity, status=status)
 
     def getFuelLevel(self):
-        return self.__info["fuel_level"]
+        return self.__info.fuel_level
 
     def getFuelConsumed(self):
-        return self.__info["fuel_level"]/10.0 * self.__info["fuel_capacity"]
+        return self.__info.fuel_level/10.0 * self.__info.fuel_capacity
 
     def getTrashLevel(self):
-        return self.__info["trash_level"]
+        return self.__info.trash_level
 
     def getTrashCollected(self):
-        return self.__info["trash_level"]/10.0 * self.__info["trash_capacity"]
+        return self.__info.trash_level/10.0 * self.__info.trash_capacity
 
     def getLocation(self):
-        return (self.__info["location"]["x"], self.__info["location"]["y"])
+        return self.__info.location
 
     def getName(self):
-        return self.__info["name"]
+        return self.__info.name
 
     def getInfo(self):
-        return deepcopy(self.__info)
+        return self.__info.copy()
 
     def getStatus(self):
-        return self.__info["status"]
+        return self.__info.status
 
-class Landfill:
-    # Landfill dictionary to store landfill information
-    __info = {"location": {"x": None, "y": None}, "type": component_type.Landfill}
+class Landfill(object):
+    # Landfill record to store landfill information
+    __slots__ = ("__info",)
 
     def __init__(self, x, y):
-        self.__info["location"]["x"] = x
-        self.__info["location"]["y"] = y
+        self.__info = ComponentRecord(type=component_type.Landfill, location=(x, y))
 
     def getLocation(self):
-        return (self.__info["location"]["x"], self.__info["location"]["y"])
\ No newline at end of file
+        return self.__info.location
@@ -6,6 +6,8 @@ The square grid, with weights and draw utility functions are direct implementati
     www.redblobgames.com/pathfinding/a-star/implementation.html
 """
 
+from array import array
+
 FUEL_COST_PER_BLOCK = 1
 
 # Utility functions for dealing with square grids
@@ -60,27 +62,174 @@ def string_grid(graph, state, t_truck, t_dumps, landfill_loc, **style):
 
   return ret_val
 
+class WallsView(object):
+  """ List-like compatibility view over the occupancy layer of a SquareGrid.
+
+  Older code treats graph.walls as a list of (x, y) tuples, so this view keeps the
+  operations used on it (in, append, remove, iteration, len) while the grid itself
+  stores a single byte per cell, which makes every membership test O(1).
+  """
+  def __init__(self, grid):
+    self.grid = grid
+
+  def __contains__(self, id):
+    return not self.grid.passable(id)
+
+  def __iter__(self):
+    grid = self.grid
+    cells = grid.cells
+    index = cells.find(WALL)
+    while index != -1:
+      yield (index % grid.width, index // grid.width)
+      index = cells.find(WALL, index + 1)
+
+  def __len__(self):
+    return self.grid.cells.count(WALL)
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return repr(list(self))
+
+  def append(self, id):
+    self.grid.set_wall(id, True)
+
+  def extend(self, ids):
+    for id in ids:
+      self.grid.set_wall(id, True)
+
+  def remove(self, id):
+    if id not in self:
+      raise ValueError("WallsView.remove(x): x not in walls")
+    self.grid.set_wall(id, False)
+
+class CellWeightsView(object):
+  """ Dict-like compatibility view over a per-cell weight layer of a GridWithWeights.
+
+  Cells that were never assigned a weight read back as the layer default, exactly
+  like the old dict.get(id, 1) lookups, and are left out of iteration.
+  """
+  def __init__(self, grid, layer, default):
+    self.grid = grid
+    self.layer = layer
+    self.default = default
+
+  def __getitem__(self, id):
+    if not self.grid.in_bounds(id):
+      raise KeyError(id)
+    return self.layer[self.grid.index(id)]
+
+  def __setitem__(self, id, value):
+    if not self.grid.in_bounds(id):
+      raise KeyError(id)
+    self.layer[self.grid.index(id)] = value
+    self.grid.touch()
+
+  def __delitem__(self, id):
+    self[id] = self.default
+
+  def __contains__(self, id):
+    return self.grid.in_bounds(id) and self.layer[self.grid.index(id)] != self.default
+
+  def get(self, id, default=None):
+    if id in self:
+      return self.layer[self.grid.index(id)]
+    return self.default if default is None else default
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def keys(self):
+    return [id for (id, value) in self.items()]
+
+  def items(self):
+    width = self.grid.width
+    default = self.default
+    return [((index % width, index // width), value) for (index, value) in enumerate(self.layer) if value != default]
+
+  def update(self, weights):
+    for (id, value) in dict(weights).items():
+      self[id] = value
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+WALL = b'\x01'
+OPEN = b'\x00'
+
 class SquareGrid(object):
+  """ Square grid whose walls are stored as a bytearray occupancy layer, one byte per
+  cell in row major order, so in_bounds/passable/neighbors never scan a list.
+  graph.walls is kept as a list-like view for code that still appends or removes tuples.
+
+  version is bumped on every wall or weight change so that caches built on top of the
+  grid can tell when their results went stale.
+  """
   def __init__(self, width, height):
     self.width = width
     self.height = height
-    self.walls = []
+    self.cells = bytearray((width or 0) * (height or 0))
+    self.version = 0
+
+  def touch(self):
+    """ Marks the grid as changed, to be called after editing dist_weights or fuel_weights in place """
+    self.version += 1
+
+  def _get_walls(self):
+    return WallsView(self)
+
+  def _set_walls(self, walls):
+    self.cells[:] = bytearray(len(self.cells))
+    for id in walls:
+      self.set_wall(tuple(id), True)
+    self.touch()
+
+  walls = property(_get_walls, _set_walls)
+
+  def index(self, id):
+    (x, y) = id
+    return y * self.width + x
+
+  def set_wall(self, id, is_wall):
+    if not self.in_bounds(id):
+      raise ValueError("Wall %s lies outside the %dx%d grid" % (str(id), self.width, self.height))
+    self.cells[self.index(id)] = 1 if is_wall else 0
+    self.touch()
 
   def in_bounds(self, id):
     (x, y) = id
-    return 0 <= x <= self.width and 0 <= y < self.height
+    return 0 <= x < self.width and 0 <= y < self.height
 
   def passable(self, id):
-    return id not in self.walls
+    (x, y) = id
+    if 0 <= x < self.width and 0 <= y < self.height:
+      return not self.cells[y * self.width + x]
+    return True
 
   def neighbors(self, id):
     (x, y) = id
     # Considering Diagonal grids as neighbors too
     results = [(x + 1, y), (x + 1, y + 1), (x, y - 1), (x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y - 1)]
     if (x + y) % 2 == 0: results.reverse() # aesthetics
-    results = filter(self.in_bounds, results)
-    results = filter(self.passable, results)
-    return results
+    width = self.width
+    height = self.height
+    cells = self.cells
+    return [(nx, ny) for (nx, ny) in results if 0 <= nx < width and 0 <= ny < height and not cells[ny * width + nx]]
+
+  def predecessors(self, id):
+    # Cells that can step into id: walls can be left, only not entered, so any in-bound cell around it
+    (x, y) = id
+    results = [(x + 1, y), (x + 1, y + 1), (x, y - 1), (x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y - 1)]
+    width = self.width
+    height = self.height
+    return [(px, py) for (px, py) in results if 0 <= px < width and 0 <= py < height]
 
   def diagonal_neighbors(self, id):
     (x, y) = id
@@ -90,14 +239,103 @@ class SquareGrid(object):
     results = filter(self.passable, results)
 
 class GridWithWeights(SquareGrid):
+  """ Grid with a per-cell default weight layer stored as array('d'), cells that were
+  never weighted cost 1 like before. dist_weights and fuel_weights are keyed by step
+  length rather than by cell and stay plain dicts.
+  """
   def __init__(self, width, height):
     super(GridWithWeights, self).__init__(width, height)
-    self.default_weights = {}
-    self.dist_weights = {}
-    self.fuel_weights = {}
+    self.cell_weights = array('d', [1.0]) * len(self.cells)
+    self._dist_weights = {}
+    self._fuel_weights = {}
+    # TrafficProfile of the grid, set by util.traffic.attach_traffic
+    self.traffic = None
+
+  def _get_default_weights(self):
+    return CellWeightsView(self, self.cell_weights, 1)
+
+  def _set_default_weights(self, weights):
+    self.cell_weights[:] = array('d', [1.0]) * len(self.cells)
+    self.default_weights.update(weights)
+    self.touch()
+
+  default_weights = property(_get_default_weights, _set_default_weights)
+
+  def touch(self):
+    super(GridWithWeights, self).touch()
+    # The hour views keep their summed weights until the grid changes
+    traffic = getattr(self, 'traffic', None)
+    if traffic is not None:
+      traffic.drop_weights()
+
+  def _get_dist_weights(self):
+    return self._dist_weights
+
+  def _set_dist_weights(self, weights):
+    self._dist_weights = weights
+    self.touch()
+
+  dist_weights = property(_get_dist_weights, _set_dist_weights)
+
+  def _get_fuel_weights(self):
+    return self._fuel_weights
+
+  def _set_fuel_weights(self, weights):
+    self._fuel_weights = weights
+    self.touch()
+
+  fuel_weights = property(_get_fuel_weights, _set_fuel_weights)
+
+  def at_hour(self, hour):
+    """ Returns the grid as it is at hour of the day, the grid itself unless a traffic profile is attached """
+    traffic = getattr(self, 'traffic', None)
+    if traffic is None:
+      return self
+    return traffic.at_hour(hour)
+
+  def as_dict(self):
+    """ Plain python view of the grid in the layout of the former list/dict backed grid,
+    used where the map still has to be serialized as a literal.
+    """
+    return {'width': self.width, 'height': self.height, 'walls': list(self.walls),
+            'default_weights': dict(self.default_weights.items()),
+            'dist_weights': self.dist_weights, 'fuel_weights': self.fuel_weights}
+
+  def uniform_cell_weight(self):
+    """ Returns the weight shared by every passable cell, or None if passable cells differ """
+    if getattr(self, '_uniform_weight_version', None) != self.version:
+      weights = set(self.cell_weights)
+      if len(weights) > 1:
+        weights = set(weight for (weight, wall) in zip(self.cell_weights, self.cells) if not wall)
+      self._uniform_weight = weights.pop() if len(weights) == 1 else None
+      self._uniform_weight_version = self.version
+    return self._uniform_weight
+
+  def min_cell_weight(self):
+    """ Returns the lowest cell weight of the grid, a lower bound for admissible heuristics """
+    if getattr(self, '_min_weight_version', None) != self.version:
+      self._min_weight = min(self.cell_weights) if len(self.cell_weights) else 1
+      self._min_weight_version = self.version
+    return self._min_weight
+
+  def cost(self, a, b):
+    """ Full cost of stepping from a to b, the sum the A * search accumulates.
+    Same as default_cost + distance_cost + fuel_cost, inlined as every search calls it per edge.
+    """
+    (x1, y1) = a
+    (x2, y2) = b
+    distance = abs(x1 - x2) + abs(y1 - y2)
+    if 0 <= x2 < self.width and 0 <= y2 < self.height:
+      weight = self.cell_weights[y2 * self.width + x2]
+    else:
+      weight = 1
+    return weight + self._dist_weights.get(distance, 1) + self._fuel_weights.get(distance * FUEL_COST_PER_BLOCK, 1)
 
   def default_cost(self, a, b):
-    return self.default_weights.get(b, 1)
+    (x, y) = b
+    if 0 <= x < self.width and 0 <= y < self.height:
+      return self.cell_weights[y * self.width + x]
+    return 1
 
   def distance_cost(self, a, b):
     (x1, y1) = a
@@ -111,4 +349,3 @@ class GridWithWeights(SquareGrid):
     distance = abs(pow(x1, 1) - pow(x2, 1)) + abs(pow(y1, 1) - pow(y2, 1))
     fuel = distance * FUEL_COST_PER_BLOCK
     return self.fuel_weights.get(fuel, 1)
-
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+Map files, so big maps are loaded instead of generated cell by cell at startup
+
+Two formats are read, told apart by their first bytes.
+
+The binary map format is the compact one, also used to send maps as JSON through MapEncoder.
+All numbers are little endian:
+
+    header   magic "IDMP", format version (uint16), width (uint32), height (uint32)
+    walls    one bit per cell in row major order, most significant bit first, padded to a byte
+    weights  layer kind (uint8), then for kind
+               0  the single weight of every cell (float64)
+               1  one weight per cell (float64)
+               2  the length (uint32) and zlib compressed bytes of one weight per cell (float64)
+    steps    dist_weights then fuel_weights: entry count (uint32), then (step, weight) float64 pairs
+    crc      CRC-32 of everything above (uint32)
+
+A map can also be given as NumPy .npy layers of shape (height, width) in row major order: the
+occupancy layer (uint8 or bool, non zero for walls) and optionally the cell weight layer (float64
+or float32). These are plain arrays, so maps can be produced or edited with NumPy or any other tool
+that writes .npy files, but NumPy isn't needed to read them. The header is parsed here and the
+file is memory mapped, so a layer reaches the grid as one copy of the mapped bytes rather than
+being parsed value by value.
+"""
+
+import ast
+from array import array
+import mmap
+import string
+import struct
+import sys
+import zlib
+
+from grid_structs import GridWithWeights
+
+NPY_MAGIC = b'\x93NUMPY'
+
+MAP_MAGIC = b'IDMP'
+
+# Bumped whenever the layout of the binary format changes, older versions stay readable
+MAP_FORMAT_VERSION = 1
+
+MAP_HEADER = struct.Struct('<4sHII')
+
+UNIFORM_WEIGHTS = 0
+CELL_WEIGHTS = 1
+COMPRESSED_CELL_WEIGHTS = 2
+
+# Cells are 0 or 1, packed by going through a string of binary digits
+CELLS_TO_BITS = string.maketrans('\x00\x01', '01')
+BITS_TO_CELLS = string.maketrans('01', '\x00\x01')
+
+# .npy type descriptors of the layers and the array typecode holding their values
+OCCUPANCY_TYPES = {'|u1': 'B', '|b1': 'B', '|i1': 'b'}
+WEIGHT_TYPES = {'<f8': 'd', '>f8': 'd', '<f4': 'f', '>f4': 'f'}
+
+def read_npy_header(npy_file, file_name):
+    """
+    Reads the header of an .npy file
+
+    :return: (dict, int) The header dict (descr, fortran_order, shape) and the offset of the data
+    :raises ValueError: If the file isn't a valid .npy file
+    """
+    preamble = npy_file.read(8)
+    if len(preamble) != 8 or preamble[:6] != NPY_MAGIC:
+        raise ValueError(file_name + " is not a .npy file")
+    major = ord(preamble[6:7])
+    if major == 1:
+        (header_length,) = struct.unpack('<H', npy_file.read(2))
+        offset = 10 + header_length
+    elif major in (2, 3):
+        (header_length,) = struct.unpack('<I', npy_file.read(4))
+        offset = 12 + header_length
+    else:
+        raise ValueError(file_name + ": unsupported .npy version " + str(major))
+    try:
+        header = ast.literal_eval(npy_file.read(header_length).decode('latin1'))
+        descr = header['descr']
+        shape = tuple(header['shape'])
+        fortran_order = header['fortran_order']
+    except (SyntaxError, ValueError, KeyError, TypeError):
+        raise ValueError(file_name + ": malformed .npy header")
+    return {'descr': descr, 'shape': shape, 'fortran_order': fortran_order}, offset
+
+def load_layer(file_name, types):
+    """
+    Reads a 2D layer of an .npy file into an array
+
+    :param types: (dict) Accepted .npy type descriptors and the array typecode of each
+    :return: (int, int, array) width, height and the values of the layer in row major order
+    :raises ValueError: If the file isn't a C ordered 2D .npy array of one of the given types
+    """
+    with open(file_name, 'rb') as npy_file:
+        (header, offset) = read_npy_header(npy_file, file_name)
+        if header['descr'] not in types:
+            raise ValueError(file_name + ": expected a layer of type " + " or ".join(sorted(types)) + ", got " + str(header['descr']))
+        if len(header['shape']) != 2 or header['fortran_order']:
+            raise ValueError(file_name + ": expected a C ordered (height, width) layer")
+        (height, width) = header['shape']
+        values = array(types[header['descr']])
+        size = width * height * values.itemsize
+        if size:
+            mapped = mmap.mmap(npy_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if len(mapped) < offset + size:
+                    raise ValueError(file_name + ": file is shorter than its " + str(width) + "x" + str(height) + " layer")
+                values.fromstring(mapped[offset:offset + size])
+            finally:
+                mapped.close()
+        if values.itemsize > 1 and header['descr'][0] != ('<' if sys.byteorder == 'little' else '>'):
+            values.byteswap()
+        return width, height, values
+
+def save_layer(file_name, width, height, values, descr):
+    """ Writes a (height, width) layer of row major values as a version 1.0 .npy file """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d, %d), }" % (descr, height, width)
+    # The data starts on a 64 byte boundary and the header ends with a newline
+    padding = 63 - (10 + len(header)) % 64
+    header = header + ' ' * padding + '\n'
+    with open(file_name, 'wb') as npy_file:
+        npy_file.write(NPY_MAGIC + b'\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        if isinstance(values, array):
+            values = values[:]
+            if values.itemsize > 1 and sys.byteorder != 'little':
+                values.byteswap()
+            npy_file.write(values.tostring())
+        else:
+            npy_file.write(bytes(values))
+
+def load_grid(occupancy_file, weights_file=None):
+    """
+    Builds a grid from a binary map file or from .npy layer files
+
+    :param occupancy_file: (str) Binary map file, or .npy occupancy layer whose non zero cells are walls
+    :param weights_file: (str) .npy cell weight layer of the same shape, every cell weighs 1 without it
+    :return: (GridWithWeights) The loaded grid
+    :raises ValueError: On invalid files or layers of different shapes
+    """
+    with open(occupancy_file, 'rb') as map_file:
+        is_binary_map = map_file.read(len(MAP_MAGIC)) == MAP_MAGIC
+    if is_binary_map:
+        if weights_file is not None:
+            raise ValueError(occupancy_file + " is a binary map file, it carries its own weights")
+        return load_map(occupancy_file)
+    (width, height, occupancy) = load_layer(occupancy_file, OCCUPANCY_TYPES)
+    graph = GridWithWeights(width, height)
+    # Any non zero value is a wall, the grid itself stores 1
+    graph.cells[:] = bytearray(occupancy.tostring()).translate(bytearray([0] + [1] * 255))
+    if weights_file is not None:
+        (weights_width, weights_height, weights) = load_layer(weights_file, WEIGHT_TYPES)
+        if (weights_width, weights_height) != (width, height):
+            raise ValueError("%s is %dx%d but %s is %dx%d" % (weights_file, weights_width, weights_height, occupancy_file, width, height))
+        graph.cell_weights[:] = weights if weights.typecode == 'd' else array('d', weights)
+    graph.touch()
+    return graph
+
+def save_grid(graph, occupancy_file, weights_file=None):
+    """ Writes the layers of a grid as .npy files that load_grid reads back """
+    save_layer(occupancy_file, graph.width, graph.height, graph.cells, '|u1')
+    if weights_file is not None:
+        save_layer(weights_file, graph.width, graph.height, graph.cell_weights, '<f8')
+
+def pack_cells(cells):
+    """ Packs a bytearray of 0/1 cells into bits, most significant bit first """
+    if not cells:
+        return b''
+    bits = str(cells).translate(CELLS_TO_BITS)
+    bits += '0' * (-len(bits) % 8)
+    return ('%0*x' % (len(bits) // 4, int(bits, 2))).decode('hex')
+
+def unpack_cells(packed, count):
+    """ Unpacks the first count cells of bits packed by pack_cells """
+    if not count:
+        return bytearray()
+    bits = format(int(packed.encode('hex'), 16), '0%db' % (len(packed) * 8))
+    return bytearray(bits[:count].translate(BITS_TO_CELLS))
+
+def encode_step_weights(weights):
+    values = array('d')
+    for (step, weight) in sorted(weights.items()):
+        values.extend((step, weight))
+    return struct.pack('<I', len(weights)) + little_endian(values)
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values = values[:]
+        values.byteswap()
+    return values.tostring()
+
+def encode_map(graph, compress=True):
+    """
+    Encodes a grid in the binary map format
+
+    :param graph: (GridWithWeights) Grid to encode
+    :param compress: (bool) Compress the cell weights, unless every cell weighs the same
+    :return: (str) The encoded map
+    """
+    parts = [MAP_HEADER.pack(MAP_MAGIC, MAP_FORMAT_VERSION, graph.width, graph.height), pack_cells(graph.cells)]
+    weights = graph.cell_weights
+    if len(weights) and weights.count(weights[0]) == len(weights):
+        parts.append(struct.pack('<Bd', UNIFORM_WEIGHTS, weights[0]))
+    elif compress:
+        # Weights repeat a handful of values in long runs, zlib shrinks them many times over
+        compressed = zlib.compress(little_endian(weights), 1)
+        parts.append(struct.pack('<BI', COMPRESSED_CELL_WEIGHTS, len(compressed)) + compressed)
+    else:
+        parts.append(struct.pack('<B', CELL_WEIGHTS) + little_endian(weights))
+    parts.append(encode_step_weights(graph.dist_weights))
+    parts.append(encode_step_weights(graph.fuel_weights))
+    data = b''.join(parts)
+    return data + struct.pack('<I', zlib.crc32(data) & 0xffffffff)
+
+def decode_map(data):
+    """
+    Decodes a grid encoded by encode_map
+
+    :param data: (str) The encoded map
+    :return: (GridWithWeights) The decoded grid
+    :raises ValueError: If data isn't a valid binary map, was truncated or doesn't match its checksum
+    """
+    if len(data) < MAP_HEADER.size + 4 or data[:len(MAP_MAGIC)] != MAP_MAGIC:
+        raise ValueError("Not a binary map")
+    (crc,) = struct.unpack('<I', data[-4:])
+    if zlib.crc32(data[:-4]) & 0xffffffff != crc:
+        raise ValueError("Binary map checksum mismatch, the map is corrupted")
+    (magic, version, width, height) = MAP_HEADER.unpack_from(data)
+    if version > MAP_FORMAT_VERSION:
+        raise ValueError("Binary map version " + str(version) + " is newer than this reader, version " + str(MAP_FORMAT_VERSION))
+    try:
+        graph = GridWithWeights(width, height)
+        size = width * height
+        offset = MAP_HEADER.size
+        walls_size = (size + 7) // 8
+        graph.cells[:] = unpack_cells(data[offset:offset + walls_size], size)
+        offset += walls_size
+        (kind,) = struct.unpack_from('<B', data, offset)
+        offset += 1
+        if kind == UNIFORM_WEIGHTS:
+            graph.cell_weights[:] = array('d', struct.unpack_from('<d', data, offset)) * size
+            offset += 8
+        elif kind == CELL_WEIGHTS:
+            graph.cell_weights[:] = read_doubles(data, offset, size)
+            offset += 8 * size
+        elif kind == COMPRESSED_CELL_WEIGHTS:
+            (length,) = struct.unpack_from('<I', data, offset)
+            try:
+                weights = zlib.decompress(data[offset + 4:offset + 4 + length])
+            except zlib.error, e:
+                raise ValueError("weight layer: " + str(e))
+            if len(weights) != 8 * size:
+                raise ValueError("weight layer holds %d bytes instead of %d" % (len(weights), 8 * size))
+            graph.cell_weights[:] = read_doubles(weights, 0, size)
+            offset += 4 + length
+        else:
+            raise ValueError("unknown weight layer kind " + str(kind))
+        step_weights = []
+        for layer in range(2):
+            (count,) = struct.unpack_from('<I', data, offset)
+            values = read_doubles(data, offset + 4, 2 * count)
+            offset += 4 + 16 * count
+            step_weights.append(dict((parse_step(values[i]), values[i + 1]) for i in range(0, len(values), 2)))
+        if offset != len(data) - 4:
+            raise ValueError("unexpected length")
+    except struct.error, e:
+        raise ValueError("Truncated binary map: " + str(e))
+    except ValueError, e:
+        raise ValueError("Malformed binary map: " + str(e))
+    (graph._dist_weights, graph._fuel_weights) = step_weights
+    graph.touch()
+    return graph
+
+def read_doubles(data, offset, count):
+    values = array('d')
+    if offset + 8 * count > len(data):
+        raise struct.error("%d weights expected at offset %d" % (count, offset))
+    values.fromstring(data[offset:offset + 8 * count])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def parse_step(value):
+    # Step lengths are looked up as ints by GridWithWeights.cost
+    return int(value) if value.is_integer() else value
+
+def save_map(graph, file_name):
+    """ Writes a grid as a binary map file """
+    with open(file_name, 'wb') as map_file:
+        map_file.write(encode_map(graph))
+
+def load_map(file_name):
+    """
+    Reads a binary map file
+
+    :raises ValueError: If the file isn't a valid binary map, naming the file
+    """
+    with open(file_name, 'rb') as map_file:
+        data = map_file.read()
+    try:
+        return decode_map(data)
+    except ValueError, e:
+        raise ValueError(file_name + ": " + str(e))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Delta patches of a running map
+
+A MapPatch lists walls to add or remove and rectangles whose cells get a new weight. Map.apply_patch
+applies it in place, bumps the map's epoch and hands a MapChange to every subscriber. The change
+names the cells that really changed, so caches and planners only drop or repair what the patch
+touched instead of starting over.
+
+Within a patch walls are removed first, then added, then the weights are set.
+
+Patches travel as JSON messages of type MAP_PATCH_TYPE:
+
+    {"type": "map_patch", "add_walls": [[x, y], ...], "remove_walls": [[x, y], ...],
+     "weights": [{"from": [x0, y0], "to": [x1, y1], "weight": w}, ...]}
+"""
+
+MAP_PATCH_TYPE = "map_patch"
+
+class MapPatch(object):
+  def __init__(self, add_walls=(), remove_walls=(), weights=()):
+    """
+    Create a patch, more edits can be added with its methods
+
+    :param add_walls: Iterable of (x, y) cells that become walls
+    :param remove_walls: Iterable of (x, y) cells that become passable
+    :param weights: Iterable of ((x0, y0), (x1, y1), weight), the cells of the rectangle get weight
+    """
+    self.walls_added = []
+    self.walls_removed = []
+    self.weights = []
+    self.add_walls(add_walls)
+    self.remove_walls(remove_walls)
+    for (corner1, corner2, weight) in weights:
+      self.set_weight(corner1, corner2, weight)
+
+  def add_walls(self, cells):
+    self.walls_added.extend(tuple(cell) for cell in cells)
+    return self
+
+  def remove_walls(self, cells):
+    self.walls_removed.extend(tuple(cell) for cell in cells)
+    return self
+
+  def set_weight(self, corner1, corner2, weight):
+    """ Gives every cell of the rectangle corner1 - corner2, corners included, the given weight """
+    self.weights.append((tuple(corner1), tuple(corner2), weight))
+    return self
+
+  def __len__(self):
+    return len(self.walls_added) + len(self.walls_removed) + len(self.weights)
+
+  def validate(self, graph):
+    """ Raises ValueError if the patch doesn't fit graph, before anything is changed """
+    for cell in self.walls_added + self.walls_removed:
+      if not graph.in_bounds(cell):
+        raise ValueError("Patched cell " + str(cell) + " lies outside the %dx%d grid" % (graph.width, graph.height))
+    for (corner1, corner2, weight) in self.weights:
+      if not (graph.in_bounds(corner1) and graph.in_bounds(corner2)):
+        raise ValueError("Patched rectangle %s - %s leaves the %dx%d grid" % (str(corner1), str(corner2), graph.width, graph.height))
+      if weight < 0:
+        raise ValueError("Cell weights can't be negative, got " + str(weight))
+
+  def apply(self, graph):
+    """
+    Writes the patch into graph without touching it, Map.apply_patch does that once for the whole patch
+
+    :return: (list, list) The cells whose wall or weight changed, and those of them that got cheaper to enter
+    :raises ValueError: If the patch doesn't fit graph, nothing is changed then
+    """
+    self.validate(graph)
+    cells = graph.cells
+    cell_weights = graph.cell_weights
+    before = {}
+    def remember(index):
+      if index not in before:
+        before[index] = (cells[index], cell_weights[index])
+    for cell in self.walls_removed:
+      index = graph.index(cell)
+      remember(index)
+      cells[index] = 0
+    for cell in self.walls_added:
+      index = graph.index(cell)
+      remember(index)
+      cells[index] = 1
+    for (corner1, corner2, weight) in self.weights:
+      (x0, x1) = sorted((corner1[0], corner2[0]))
+      (y0, y1) = sorted((corner1[1], corner2[1]))
+      for y in range(y0, y1 + 1):
+        for index in range(graph.index((x0, y)), graph.index((x1, y)) + 1):
+          if cell_weights[index] != weight:
+            remember(index)
+            cell_weights[index] = weight
+
+    changed = []
+    improved = []
+    width = graph.width
+    for (index, (wall, weight)) in sorted(before.items()):
+      if (cells[index], cell_weights[index]) == (wall, weight):
+        continue
+      cell = (index % width, index // width)
+      changed.append(cell)
+      # Walls can't be entered whatever their weight, so only passable cells get cheaper
+      if not cells[index] and (wall or cell_weights[index] < weight):
+        improved.append(cell)
+    return changed, improved
+
+  def as_dict(self):
+    """ The patch as a MAP_PATCH_TYPE message """
+    return {"type": MAP_PATCH_TYPE, "add_walls": [list(cell) for cell in self.walls_added],
+            "remove_walls": [list(cell) for cell in self.walls_removed],
+            "weights": [{"from": list(corner1), "to": list(corner2), "weight": weight}
+                        for (corner1, corner2, weight) in self.weights]}
+
+  @classmethod
+  def from_dict(cls, message):
+    """
+    Reads a MAP_PATCH_TYPE message
+
+    :raises ValueError: If the message isn't a well formed patch
+    """
+    try:
+      return cls(add_walls=[(int(x), int(y)) for (x, y) in message.get("add_walls", [])],
+                 remove_walls=[(int(x), int(y)) for (x, y) in message.get("remove_walls", [])],
+                 weights=[((int(region["from"][0]), int(region["from"][1])), (int(region["to"][0]), int(region["to"][1])),
+                           float(region["weight"])) for region in message.get("weights", [])])
+    except (KeyError, TypeError, ValueError, IndexError), e:
+      raise ValueError("Malformed map patch: " + str(e))
+
+class MapChange(object):
+  """
+  What a patch did to the map, as handed to the subscribers of the map
+
+  epoch is the map's epoch after the patch. cells are the cells whose wall or weight changed and
+  improved the ones that got cheaper to enter. The graph went from version from_version to version.
+  """
+  def __init__(self, epoch, patch, cells, improved, from_version, version):
+    self.epoch = epoch
+    self.patch = patch
+    self.cells = cells
+    self.improved = improved
+    self.from_version = from_version
+    self.version = version
+
+  def improved_bounds(self):
+    """ ((x0, y0), (x1, y1)) box around the improved cells, None if none improved """
+    if not self.improved:
+      return None
+    xs = [x for (x, y) in self.improved]
+    ys = [y for (x, y) in self.improved]
+    return (min(xs), min(ys)), (max(xs), max(ys))
+
+  def __repr__(self):
+    return "MapChange(epoch=%d, cells=%d, improved=%d)" % (self.epoch, len(self.cells), len(self.improved))
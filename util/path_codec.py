@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Compact encoding of the routes exchanged between the central server and the trucks
+
+A route is sent as its first cell followed by run-length encoded moves, one letter per
+direction (the keys the trucks are driven with) prefixed by its repeat count when above 1:
+
+    [(0, 0), (1, 0), (2, 0), (3, 0), (4, 1), (5, 2), (5, 1)]  <->  "0,0;3d2cw"
+
+    w UP    s DOWN    a LEFT       d RIGHT
+    q UP-LEFT         e UP-RIGHT   z DOWN-LEFT    c DOWN-RIGHT
+    x WAIT, the truck stays in its cell for one tick (routes of the cooperative planner)
+
+A route of several hundred cells shrinks from kilobytes of JSON pairs to a few dozen bytes.
+Messages carry it under ROUTE_KEY, the former list under LEGACY_ROUTE_KEY is still understood.
+"""
+
+import re
+
+ROUTE_KEY = "route"
+LEGACY_ROUTE_KEY = "a_star_path"
+
+# Screen coordinates, y grows downwards
+DIRECTION_CODES = {(0, -1): "w", (0, 1): "s", (-1, 0): "a", (1, 0): "d",
+                   (-1, -1): "q", (1, -1): "e", (-1, 1): "z", (1, 1): "c", (0, 0): "x"}
+CODE_DIRECTIONS = dict((code, direction) for (direction, code) in DIRECTION_CODES.items())
+
+ROUTE_RE = re.compile(r"^(?P<x>-?\d+),(?P<y>-?\d+);(?P<moves>(\d*[wsadqezcx])*)$")
+MOVE_RE = re.compile(r"(\d*)([wsadqezcx])")
+
+def encode_path(path):
+    """
+    Encodes a route into its compact string form
+
+    :param path: (list) Consecutive (x, y) cells, every step moving to one of the 8 neighbours or staying
+    :return: (str) Encoded route, "" for an empty route
+    :raises ValueError: If two consecutive cells aren't neighbours
+    """
+    if not path:
+        return ""
+    (x, y) = path[0]
+    moves = []
+    previous = None
+    count = 0
+    for (next_x, next_y) in path[1:]:
+        code = DIRECTION_CODES.get((next_x - x, next_y - y))
+        if code is None:
+            raise ValueError("Cells " + str((x, y)) + " and " + str((next_x, next_y)) + " of the route aren't neighbours")
+        if code == previous:
+            count += 1
+        else:
+            if previous is not None:
+                moves.append((str(count) if count > 1 else "") + previous)
+            (previous, count) = (code, 1)
+        (x, y) = (next_x, next_y)
+    if previous is not None:
+        moves.append((str(count) if count > 1 else "") + previous)
+    return "%d,%d;%s" % (tuple(path[0]) + ("".join(moves),))
+
+def decode_path(route):
+    """
+    Decodes a route encoded by encode_path
+
+    :param route: (str) Encoded route
+    :return: (list) (x, y) cells of the route, [] for an empty route
+    :raises ValueError: If route isn't a valid encoded route
+    """
+    if not route:
+        return []
+    match = ROUTE_RE.match(route)
+    if match is None:
+        raise ValueError("Malformed route: " + repr(route))
+    (x, y) = (int(match.group("x")), int(match.group("y")))
+    path = [(x, y)]
+    for (count, code) in MOVE_RE.findall(match.group("moves")):
+        (dx, dy) = CODE_DIRECTIONS[code]
+        for i in range(int(count) if count else 1):
+            (x, y) = (x + dx, y + dy)
+            path.append((x, y))
+    return path
+
+def path_from_message(message):
+    """
+    Returns the route of a decoded JSON message as a list of (x, y) cells, None if it has none.
+    The encoded ROUTE_KEY wins over a legacy list of [x, y] pairs under LEGACY_ROUTE_KEY.
+    """
+    if ROUTE_KEY in message:
+        return decode_path(message[ROUTE_KEY])
+    if LEGACY_ROUTE_KEY in message:
+        return [tuple(cell) for cell in message[LEGACY_ROUTE_KEY]]
+    return None
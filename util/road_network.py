@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Road network graph backend, an alternative to the square grid for real streets
+
+Intersections are nodes with coordinates and streets are weighted directed edges. The adjacency
+is kept in compressed sparse row (CSR) form: the outgoing edges of node i are the entries
+offsets[i] to offsets[i + 1] of the targets and weights arrays, so memory grows with the
+number of edges rather than with the area of the map. A second CSR over the reversed edges
+answers predecessors() for searches that run backwards from a dumpster or the landfill.
+
+Nodes are addressed by their (x, y) coordinates, just like grid cells, so components keep
+reporting their location and A_Star_Search, RouteCache (with engine=A_Star_Search) and
+One_To_Many_Search run on a RoadNetwork unchanged. A_Star_Search doesn't draw it, there's no
+grid to draw.
+
+The central server doesn't route on road networks yet: its default engine, the landfill
+DistanceField, the traffic profiles and the map patches are all grid only, and trucks report
+grid cells. The backend is there for the engines above and for offline planning.
+
+File format, one record per line, '#' starts a comment:
+
+    node <id> <x> <y>
+    edge <from id> <to id> <weight>
+"""
+
+from array import array
+import math
+
+class RoadNetwork(object):
+  def __init__(self, locations, edges):
+    """
+    Builds the network from its nodes and edges, see RoadNetwork.load for reading a file
+
+    :param locations: (list) (x, y) location of every node, a node is referred to by its position in this list
+    :param edges: Iterable of (from node, to node, weight) triples, the cheapest of parallel edges is kept
+    :raises ValueError: On duplicate locations, unknown nodes, negative weights or edges from a node to itself
+    """
+    self.locations = [tuple(location) for location in locations]
+    self.node_index = {}
+    for (index, location) in enumerate(self.locations):
+      if location in self.node_index:
+        raise ValueError("Two nodes share the location " + str(location))
+      self.node_index[location] = index
+    self.version = 0
+
+    cheapest = {}
+    for (source, target, weight) in edges:
+      if not (0 <= source < len(self.locations) and 0 <= target < len(self.locations)):
+        raise ValueError("Edge " + str((source, target)) + " refers to an unknown node")
+      if weight < 0:
+        raise ValueError("Edge " + str((source, target)) + " has a negative weight")
+      if source == target:
+        # A zero length street leads nowhere and breaks the straight line bound of min_cost_per_distance
+        raise ValueError("Edge " + str((source, target)) + " leads from a node to itself")
+      if (source, target) not in cheapest or weight < cheapest[(source, target)]:
+        cheapest[(source, target)] = weight
+    (self.offsets, self.targets, self.weights) = build_csr(len(self.locations), cheapest.items())
+    (self.reverse_offsets, self.sources, self.reverse_weights) = build_csr(len(self.locations), (((target, source), weight) for ((source, target), weight) in cheapest.items()))
+
+  @classmethod
+  def load(cls, file_name):
+    """
+    Reads a road network file
+
+    :param file_name: (str) Path of the file, in the format described in the module docstring
+    :raises ValueError: On a malformed line, naming its line number
+    """
+    locations = []
+    ids = {}
+    edges = []
+    with open(file_name) as network_file:
+      for (number, line) in enumerate(network_file, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+          continue
+        try:
+          if fields[0] == "node" and len(fields) == 4:
+            if fields[1] in ids:
+              raise ValueError("node " + fields[1] + " is defined twice")
+            ids[fields[1]] = len(locations)
+            locations.append((parse_number(fields[2]), parse_number(fields[3])))
+          elif fields[0] == "edge" and len(fields) == 4:
+            if fields[1] == fields[2]:
+              raise ValueError("edge " + fields[1] + " " + fields[2] + " leads from a node to itself")
+            edges.append((fields[1], fields[2], float(fields[3])))
+          else:
+            raise ValueError("expected 'node <id> <x> <y>' or 'edge <from> <to> <weight>'")
+        except ValueError, e:
+          raise ValueError(file_name + ":" + str(number) + ": " + str(e))
+    unknown = [id for (source, target, weight) in edges for id in (source, target) if id not in ids]
+    if unknown:
+      raise ValueError(file_name + ": edges refer to undefined node " + unknown[0])
+    return cls(locations, [(ids[source], ids[target], weight) for (source, target, weight) in edges])
+
+  def touch(self):
+    """ Marks the network as changed, caches built on it drop their results """
+    self.version += 1
+
+  def __len__(self):
+    return len(self.locations)
+
+  def edge_count(self):
+    return len(self.targets)
+
+  def in_bounds(self, id):
+    return id in self.node_index
+
+  def passable(self, id):
+    # Every node of the network can be driven through
+    return True
+
+  def neighbors(self, id):
+    index = self.node_index[id]
+    locations = self.locations
+    return [locations[target] for target in self.targets[self.offsets[index]:self.offsets[index + 1]]]
+
+  def predecessors(self, id):
+    """ Nodes with an edge into id """
+    index = self.node_index[id]
+    locations = self.locations
+    return [locations[source] for source in self.sources[self.reverse_offsets[index]:self.reverse_offsets[index + 1]]]
+
+  def edge_position(self, a, b):
+    """ Position of the edge a -> b in targets/weights, None if there is no such edge """
+    index = self.node_index[a]
+    target = self.node_index[b]
+    targets = self.targets
+    for position in xrange(self.offsets[index], self.offsets[index + 1]):
+      if targets[position] == target:
+        return position
+    return None
+
+  def cost(self, a, b):
+    """ Weight of the street from a to b, rows are short so it's a scan of a's edges """
+    position = self.edge_position(a, b)
+    if position is None:
+      raise KeyError((a, b))
+    return self.weights[position]
+
+  def set_cost(self, a, b, weight):
+    """ Changes the weight of the existing street from a to b, e.g. after a closure or a jam """
+    position = self.edge_position(a, b)
+    if position is None:
+      raise KeyError((a, b))
+    self.weights[position] = weight
+    source = self.node_index[a]
+    target = self.node_index[b]
+    for position in xrange(self.reverse_offsets[target], self.reverse_offsets[target + 1]):
+      if self.sources[position] == source:
+        self.reverse_weights[position] = weight
+    self.touch()
+
+  def min_cost_per_distance(self):
+    """ Lowest weight per unit of straight line distance over all edges, the factor of an admissible euclidean heuristic """
+    if getattr(self, '_min_ratio_version', None) != self.version:
+      ratio = None
+      locations = self.locations
+      for source in xrange(len(locations)):
+        (x1, y1) = locations[source]
+        for position in xrange(self.offsets[source], self.offsets[source + 1]):
+          (x2, y2) = locations[self.targets[position]]
+          edge_ratio = self.weights[position] / math.hypot(x2 - x1, y2 - y1)
+          if ratio is None or edge_ratio < ratio:
+            ratio = edge_ratio
+      self._min_ratio = ratio or 0
+      self._min_ratio_version = self.version
+    return self._min_ratio
+
+def parse_number(text):
+  value = float(text)
+  return int(value) if value.is_integer() else value
+
+def build_csr(node_count, edges):
+  """
+  Builds the CSR arrays of ((source, target), weight) edges
+
+  :return: (array, array, array) offsets (node_count + 1 entries), targets and weights sorted by source
+  """
+  edges = list(edges)
+  offsets = array('l', [0]) * (node_count + 1)
+  for ((source, target), weight) in edges:
+    offsets[source + 1] += 1
+  for index in xrange(node_count):
+    offsets[index + 1] += offsets[index]
+  fill = array('l', offsets)
+  targets = array('l', [0]) * len(edges)
+  weights = array('d', [0.0]) * len(edges)
+  for ((source, target), weight) in sorted(edges):
+    targets[fill[source]] = target
+    weights[fill[source]] = weight
+    fill[source] += 1
+  return offsets, targets, weights
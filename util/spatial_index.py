@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Spatial index of the components on the map
+
+SpatialIndex buckets named points in a uniform grid of bucket_size x bucket_size cells, so
+moving a component is O(1) and a nearest query only looks at the buckets around the query
+cell, ring by ring, instead of at every component. It stops as soon as no unseen bucket can
+hold anything closer than what it found, so a query costs what the neighbourhood holds, not
+what the fleet holds.
+
+Distances are Chebyshev distances, max(|dx|, |dy|). Trucks move one cell per step in any of
+the 8 directions, so that's the fewest steps between two cells and a lower bound of the
+length of any route between them.
+"""
+
+import heapq
+import threading
+
+DEFAULT_BUCKET_SIZE = 8
+
+def chebyshev_distance(a, b):
+  return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+class SpatialIndex(object):
+  def __init__(self, width, height, bucket_size=DEFAULT_BUCKET_SIZE):
+    """
+    Create an empty index of a width x height map
+
+    :param bucket_size: (int) Side of a bucket in cells
+    """
+    if bucket_size < 1:
+      raise ValueError("Buckets must be at least one cell wide, got " + str(bucket_size))
+    self.width = width
+    self.height = height
+    self.bucket_size = bucket_size
+    # (bucket x, bucket y) -> names in the bucket
+    self.__buckets = {}
+    # name -> (x, y)
+    self.__locations = {}
+    self.__lock = threading.Lock()
+    self.queries = 0
+    self.buckets_visited = 0
+
+  def __bucket(self, location):
+    return (location[0] // self.bucket_size, location[1] // self.bucket_size)
+
+  def move(self, name, location):
+    """ Adds name at location, or moves it there if it's indexed already """
+    location = (location[0], location[1])
+    with self.__lock:
+      previous = self.__locations.get(name)
+      if previous == location:
+        return
+      if previous is not None:
+        self.__drop(name, previous)
+      self.__locations[name] = location
+      self.__buckets.setdefault(self.__bucket(location), set()).add(name)
+
+  def remove(self, name):
+    with self.__lock:
+      location = self.__locations.pop(name, None)
+      if location is not None:
+        self.__drop(name, location)
+
+  def __drop(self, name, location):
+    bucket_key = self.__bucket(location)
+    bucket = self.__buckets[bucket_key]
+    bucket.discard(name)
+    if not bucket:
+      del self.__buckets[bucket_key]
+
+  def location(self, name):
+    """ (x, y) of name, None if it isn't indexed """
+    return self.__locations.get(name)
+
+  def __contains__(self, name):
+    return name in self.__locations
+
+  def __len__(self):
+    return len(self.__locations)
+
+  def nearest(self, location, k=1, radius=None, accept=None):
+    """
+    Finds the k indexed names closest to location
+
+    :param location: (tuple) (x, y) cell to search around
+    :param k: (int) Most names to return
+    :param radius: (int) Largest distance to look at, the whole map by default
+    :param accept: Function accept(name, distance) -> bool, names it rejects are skipped
+    :return: (list) (distance, name) of the closest accepted names, closest first, ties by name
+    """
+    (x, y) = (location[0], location[1])
+    (bucket_x, bucket_y) = self.__bucket(location)
+    size = self.bucket_size
+    last_ring = (max(self.width, self.height) + size - 1) // size + 1
+    if radius is not None:
+      if radius < 0:
+        return []
+      # Cells within radius lie at most this many buckets away
+      last_ring = min(last_ring, (radius + size - 1) // size)
+    # Max heap of the k best so far, as (-distance, name) with names compared inversely
+    best = []
+    with self.__lock:
+      self.queries += 1
+      for ring in range(last_ring + 1):
+        for bucket_key in self.__ring(bucket_x, bucket_y, ring):
+          bucket = self.__buckets.get(bucket_key)
+          self.buckets_visited += 1
+          if not bucket:
+            continue
+          for name in bucket:
+            distance = chebyshev_distance(location, self.__locations[name])
+            if radius is not None and distance > radius:
+              continue
+            if len(best) == k and (distance, name) >= (-best[0][0], best[0][1].name):
+              continue
+            if accept is not None and not accept(name, distance):
+              continue
+            entry = (-distance, _Descending(name))
+            if len(best) < k:
+              heapq.heappush(best, entry)
+            else:
+              heapq.heapreplace(best, entry)
+        # Anything outside the rings seen so far is more than ring * size cells away
+        if len(best) == k and -best[0][0] <= ring * size:
+          break
+    return sorted((-distance, name.name) for (distance, name) in best)
+
+  def __ring(self, bucket_x, bucket_y, ring):
+    """ Bucket keys at Chebyshev distance ring from (bucket_x, bucket_y) """
+    if ring == 0:
+      return [(bucket_x, bucket_y)]
+    keys = []
+    for bx in range(bucket_x - ring, bucket_x + ring + 1):
+      keys.append((bx, bucket_y - ring))
+      keys.append((bx, bucket_y + ring))
+    for by in range(bucket_y - ring + 1, bucket_y + ring):
+      keys.append((bucket_x - ring, by))
+      keys.append((bucket_x + ring, by))
+    return keys
+
+  def stats(self):
+    """ Returns the index counters as a dict, meant for logging """
+    return {"size": len(self.__locations), "buckets": len(self.__buckets), "queries": self.queries,
+            "buckets_visited": self.buckets_visited}
+
+class _Descending(object):
+  """ Orders names backwards, so the max heap of nearest drops the greatest name of a tie first """
+  __slots__ = ("name",)
+
+  def __init__(self, name):
+    self.name = name
+
+  def __lt__(self, other):
+    return self.name > other.name
+
+  def __eq__(self, other):
+    return self.name == other.name
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+Time dependent congestion on top of a GridWithWeights
+
+TrafficProfile keeps one delay layer per hour of the day, an array('d') with one entry per
+cell like the cell weights of the grid. A delay is the extra cost of entering the cell at that
+hour, on top of its static weight, so 0 means free flowing traffic. Layers are updated in bulk:
+a region is written row by row with slice assignments and a whole profile file is loaded into
+fresh layers that replace the old ones at once.
+
+graph.at_hour(hour) returns a Traffic_Grid, a read only view of the grid as it is at that hour.
+It shares the walls and step weights of the grid and its cell weights are the static weights
+plus the delays of the hour, summed once and kept until the grid or the profile changes. The sum
+and the layers shared with the grid are stored as plain attributes of the view, so the planners
+read them without a lock or a property call on every edge; touch() of the grid or of the profile
+drops them. Views
+have the graph interface the planners expect, so any engine, cache or distance field built on
+a view avoids the cells that are slow at that hour. The hour is the departure hour of the route:
+a route is priced with the traffic of the hour it starts in, even if it ends in the next one.
+
+Profile file format, one record per line, '#' starts a comment:
+
+    <hours> <x0> <y0> <x1> <y1> <delay>
+
+hours is a single hour (17), a range (7-9, both included) or * for the whole day, and the
+delay applies to every cell of the rectangle (x0, y0) - (x1, y1), corners included. Later
+lines overwrite earlier ones where they overlap.
+"""
+
+from array import array
+from itertools import imap
+import operator
+import threading
+
+from grid_structs import GridWithWeights
+
+HOURS_PER_DAY = 24
+
+class TrafficProfile(object):
+  def __init__(self, graph):
+    """
+    Create an empty profile of graph, every cell flows freely at every hour
+
+    :param graph: (GridWithWeights) Grid the delays apply to, see attach_traffic to make graph.at_hour use it
+    """
+    self.graph = graph
+    self.version = 0
+    self.layers = [self.__empty_layer() for hour in range(HOURS_PER_DAY)]
+    self.__views = {}
+    self.__lock = threading.Lock()
+
+  def __empty_layer(self):
+    return array('d', [0.0]) * len(self.graph.cells)
+
+  def touch(self):
+    """ Marks the profile as changed, the views sum their weights again on next use """
+    self.version += 1
+    self.drop_weights()
+
+  def drop_weights(self):
+    """ Drops the weights summed by the views, called whenever the grid or the profile changes """
+    with self.__lock:
+      views = self.__views.values()
+    for view in views:
+      view.drop_weights()
+
+  def layer(self, hour):
+    """ Returns the delay layer of hour, emptied first if the grid was resized since it was written """
+    layer = self.layers[hour % HOURS_PER_DAY]
+    if len(layer) != len(self.graph.cells):
+      self.layers = [self.__empty_layer() for hour in range(HOURS_PER_DAY)]
+      self.touch()
+      layer = self.layers[hour % HOURS_PER_DAY]
+    return layer
+
+  def delay(self, id, hour):
+    """ Delay of entering the cell id at hour """
+    if not self.graph.in_bounds(id):
+      raise KeyError(id)
+    return self.layer(hour)[self.graph.index(id)]
+
+  def set_delay(self, hours, corner1, corner2, delay):
+    """
+    Sets the delay of every cell of a rectangle for the given hours
+
+    :param hours: Iterable of hours of the day
+    :param corner1: (tuple) (x, y) corner of the rectangle
+    :param corner2: (tuple) (x, y) opposite corner of the rectangle, both corners included
+    :param delay: (float) Extra cost of entering any of these cells, 0 to clear them
+    :raises ValueError: On a negative delay or a rectangle that leaves the grid
+    """
+    self.__fill([self.layer(hour) for hour in set(hours)], corner1, corner2, delay)
+    self.touch()
+
+  def set_layer(self, hour, delays):
+    """
+    Replaces the whole delay layer of hour
+
+    :param delays: Sequence of one delay per cell, in the row major order of graph.cells
+    :raises ValueError: If delays doesn't have one entry per cell or holds a negative delay
+    """
+    delays = array('d', delays)
+    if len(delays) != len(self.graph.cells):
+      raise ValueError("Expected %d delays, one per cell, got %d" % (len(self.graph.cells), len(delays)))
+    if len(delays) and min(delays) < 0:
+      raise ValueError("Delays can't be negative, they'd break the lower bounds of the heuristics")
+    self.layer(hour)[:] = delays
+    self.touch()
+
+  def clear(self):
+    """ Back to free flowing traffic at every hour """
+    self.layers = [self.__empty_layer() for hour in range(HOURS_PER_DAY)]
+    self.touch()
+
+  def load(self, file_name):
+    """
+    Replaces the profile with the one of a profile file, the old delays are kept if it can't be read
+
+    :param file_name: (str) Path of the file, in the format described in the module docstring
+    :raises ValueError: On a malformed line, naming its line number
+    """
+    layers = [self.__empty_layer() for hour in range(HOURS_PER_DAY)]
+    with open(file_name) as profile_file:
+      for (number, line) in enumerate(profile_file, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+          continue
+        try:
+          if len(fields) != 6:
+            raise ValueError("expected '<hours> <x0> <y0> <x1> <y1> <delay>'")
+          hours = parse_hours(fields[0])
+          (x0, y0, x1, y1) = [int(field) for field in fields[1:5]]
+          self.__fill([layers[hour] for hour in hours], (x0, y0), (x1, y1), float(fields[5]))
+        except ValueError, e:
+          raise ValueError(file_name + ":" + str(number) + ": " + str(e))
+    self.layers = layers
+    self.touch()
+
+  def __fill(self, layers, corner1, corner2, delay):
+    graph = self.graph
+    if delay < 0:
+      raise ValueError("Delays can't be negative, they'd break the lower bounds of the heuristics")
+    if not (graph.in_bounds(corner1) and graph.in_bounds(corner2)):
+      raise ValueError("Rectangle %s - %s leaves the %dx%d grid" % (str(corner1), str(corner2), graph.width, graph.height))
+    (x0, x1) = sorted((corner1[0], corner2[0]))
+    (y0, y1) = sorted((corner1[1], corner2[1]))
+    row = array('d', [delay]) * (x1 - x0 + 1)
+    for layer in layers:
+      for y in range(y0, y1 + 1):
+        start = y * graph.width + x0
+        layer[start:start + len(row)] = row
+
+  def at_hour(self, hour):
+    """ Returns the Traffic_Grid of hour, the same object on every call so caches built on it are shared """
+    hour = hour % HOURS_PER_DAY
+    with self.__lock:
+      view = self.__views.get(hour)
+      if view is None:
+        view = self.__views[hour] = Traffic_Grid(self.graph, self, hour)
+      return view
+
+  def stats(self):
+    """ Returns the profile counters as a dict, meant for logging """
+    return {"version": self.version, "views": len(self.__views),
+            "congested_hours": sum(1 for layer in self.layers if any(layer))}
+
+def attach_traffic(graph, profile=None):
+  """ Makes graph.at_hour use profile, a new empty one by default, and returns it """
+  if profile is None:
+    profile = TrafficProfile(graph)
+  elif profile.graph is not graph:
+    raise ValueError("The traffic profile belongs to another grid")
+  graph.traffic = profile
+  return profile
+
+def parse_hours(text):
+  """ Parses the hours field of a profile line into a list of hours """
+  if text == "*":
+    return range(HOURS_PER_DAY)
+  (first, separator, last) = text.partition("-")
+  (first, last) = (int(first), int(last if separator else first))
+  if not (0 <= first <= last < HOURS_PER_DAY):
+    raise ValueError("hours must be *, h or h-h with 0 <= h < " + str(HOURS_PER_DAY) + ", got " + text)
+  return range(first, last + 1)
+
+class _Layer(object):
+  """
+  Layer of a view, read(view) on first use and then stored in the view's __dict__
+
+  Without __set__ the stored value shadows the descriptor, so the planners read it as a plain
+  attribute on every edge until drop_weights removes it.
+  """
+  def __init__(self, name, read):
+    self.name = name
+    self.read = read
+
+  def __get__(self, view, owner):
+    if view is None:
+      return self
+    return view.load_layer(self.name, self.read)
+
+def _sum_weights(view):
+  return array('d', imap(operator.add, view.base.cell_weights, view.profile.layer(view.hour)))
+
+class Traffic_Grid(GridWithWeights):
+  """
+  Read only view of a grid at one hour of the day, see the module docstring
+  """
+  def __init__(self, base, profile, hour):
+    # The layers of the grid are shared, not copied, so the parent __init__ isn't run
+    self.base = base
+    self.profile = profile
+    self.hour = hour
+    self.traffic = profile
+    # Reentrant: a resized grid makes profile.layer touch the profile, which drops the weights being summed
+    self.__lock = threading.RLock()
+
+  width = _Layer('width', lambda self: self.base.width)
+  height = _Layer('height', lambda self: self.base.height)
+  cells = _Layer('cells', lambda self: self.base.cells)
+  _dist_weights = _Layer('_dist_weights', lambda self: self.base.dist_weights)
+  _fuel_weights = _Layer('_fuel_weights', lambda self: self.base.fuel_weights)
+  dist_weights = _Layer('dist_weights', lambda self: self.base.dist_weights)
+  fuel_weights = _Layer('fuel_weights', lambda self: self.base.fuel_weights)
+  cell_weights = _Layer('cell_weights', _sum_weights)
+  LAYERS = ('width', 'height', 'cells', '_dist_weights', '_fuel_weights', 'dist_weights', 'fuel_weights', 'cell_weights')
+
+  def _get_version(self):
+    # Changes whenever the grid or the profile does, the caches of the view compare it for equality
+    return (self.base.version, self.profile.version)
+
+  version = property(_get_version)
+
+  def load_layer(self, name, read):
+    """ Returns the layer name, read and kept as an attribute of the view until the weights are dropped """
+    with self.__lock:
+      if name not in self.__dict__:
+        self.__dict__[name] = read(self)
+      return self.__dict__[name]
+
+  def drop_weights(self):
+    # Under the lock so that a layer read while the grid changes can't be stored after it's dropped
+    with self.__lock:
+      for name in self.LAYERS:
+        self.__dict__.pop(name, None)
+
+  def touch(self):
+    # Walls are shared with the grid, so a change made through the view is a change of the grid
+    self.base.touch()
+
+  def at_hour(self, hour):
+    return self.profile.at_hour(hour)
+
+  def __reduce_ex__(self, protocol):
+    # Pickled, e.g. for worker processes, as a standalone grid holding this hour's weights
+    return (grid_from_layers, (self.width, self.height, bytearray(self.cells), self.cell_weights,
+                               dict(self.dist_weights), dict(self.fuel_weights)))
+
+def snapshot(view):
+  """ Returns a standalone GridWithWeights copy of a view, with the weights of its hour """
+  return grid_from_layers(view.width, view.height, view.cells, view.cell_weights, dict(view.dist_weights), dict(view.fuel_weights))
+
+def grid_from_layers(width, height, cells, cell_weights, dist_weights, fuel_weights):
+  grid = GridWithWeights(width, height)
+  grid.cells[:] = cells
+  grid.cell_weights[:] = cell_weights
+  grid._dist_weights = dist_weights
+  grid._fuel_weights = fuel_weights
+  return grid